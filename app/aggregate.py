@@ -1,29 +1,115 @@
 # app/aggregate.py
-from typing import Dict, Any, List, Set
+import os
+from typing import Dict, Any, List, Set, Optional
 from collections import defaultdict
-from .supa import pg_select_all, pg_upsert, pg_delete
-from .config import TABLE_ACTIVE, TABLE_ALLOC
+from .supa import pg_select_all, upsert_many, delete_in, pg_rpc
+from .config import TABLE_ACTIVE, TABLE_ALLOC, getenv_bool, getenv_int
+from .metrics import METRICS
+
+# Rebuild via the refresh_country_allocation() function (Q10); Python path is the fallback
+AGG_SERVER_SIDE = getenv_bool("E2T_AGG_SERVER_SIDE", True)
+RPC_REFRESH_ALLOC = "refresh_country_allocation"
+
+# delta = fold the worker's per-country changes in (Q11), full = rebuild every run
+AGG_MODE = os.environ.get("E2T_AGG_MODE", "delta").strip().lower()
+AGG_RECONCILE_EVERY = getenv_int("E2T_AGG_RECONCILE_EVERY", 7)             # runs between full drift checks
+RPC_APPLY_DELTAS = "apply_country_allocation_deltas"
+RPC_DRIFT = "country_allocation_drift"
+
+_runs_since_reconcile: Optional[int] = None   # None → first run in this process always reconciles
+
+def country_key(country: Any) -> str:
+    """Same bucketing as the SQL: coalesce(nullif(trim(country), ''), 'Unknown')."""
+    return (str(country) if country is not None else "").strip() or "Unknown"
 
 def recompute_country_totals() -> None:
+    METRICS.inc("agg_rebuilds")
+    if AGG_SERVER_SIDE:
+        try:
+            n = pg_rpc(RPC_REFRESH_ALLOC)
+            print(f"[AGG] Server-side rebuild → {n} countries")
+            return
+        except Exception as e:
+            print(f"[AGG] RPC {RPC_REFRESH_ALLOC} unavailable ({str(e)[:120]}) → falling back to Python recompute")
+    recompute_country_totals_python()
+
+def recompute_country_totals_python() -> None:
     # 1) Build new totals from e2t_active
     rows = pg_select_all(TABLE_ACTIVE, "country,plan")
     buckets: Dict[str, float] = defaultdict(float)
     for r in rows:
-        c = (r.get("country") or "").strip() or "Unknown"
+        c = country_key(r.get("country"))
         try:
             p = float(r.get("plan") or 0)
         except Exception:
             p = 0.0
         buckets[c] += p
 
-    # 2) Upsert all new totals
+    # 2) Upsert all new totals (one bulk call)
     new_countries: Set[str] = set(buckets.keys())
-    for country, total in buckets.items():
-        pg_upsert(TABLE_ALLOC, {"country": country, "total_plan": total}, on_conflict="country")
+    upsert_many(TABLE_ALLOC, [{"country": c, "total_plan": t} for c, t in buckets.items()], on_conflict="country")
 
     # 3) Delete stale rows (countries that existed before but are not in the new set)
     existing = pg_select_all(TABLE_ALLOC, "country")
-    for r in existing:
-        c = (r.get("country") or "").strip() or "Unknown"
-        if c not in new_countries:
-            pg_delete(TABLE_ALLOC, {"country": f"eq.{c}"})
+    stale = sorted({country_key(r.get("country")) for r in existing} - new_countries)
+    if stale:
+        delete_in(TABLE_ALLOC, "country", stale)
+
+def apply_country_deltas(deltas: Dict[str, float]) -> bool:
+    """
+    Fold {country: plan delta} into the totals table in one call. False if the RPC failed.
+    Not idempotent, so never retried: a call that committed but lost its response would be
+    counted twice. The caller rebuilds on False, which is correct either way.
+    """
+    if not deltas:
+        return True
+    payload = [{"country": c, "delta": d} for c, d in deltas.items()]
+    try:
+        n = pg_rpc(RPC_APPLY_DELTAS, {"deltas": payload}, attempts=1)
+        METRICS.inc("agg_delta_countries", len(payload))
+        print(f"[AGG] Applied deltas for {len(payload)} countries (upserted {n})")
+        return True
+    except Exception as e:
+        print(f"[AGG] RPC {RPC_APPLY_DELTAS} failed ({str(e)[:120]})")
+        return False
+
+def reconcile_country_totals() -> int:
+    """Compare the totals table against a full rebuild; rebuild if they drifted. Returns drifted rows."""
+    try:
+        drift = pg_rpc(RPC_DRIFT) or []
+    except Exception as e:
+        print(f"[AGG] Drift check unavailable ({str(e)[:120]}) → full rebuild")
+        recompute_country_totals()
+        return -1
+    METRICS.inc("agg_reconciles")
+    METRICS.inc("agg_drifted_countries", len(drift))
+    if drift:
+        for d in drift[:10]:
+            print(f"[AGG] Drift {d.get('country')}: stored={d.get('stored')} expected={d.get('expected')}")
+        print(f"[AGG] {len(drift)} countries drifted → full rebuild")
+        recompute_country_totals()
+    else:
+        print("[AGG] Reconciliation OK (totals match a full rebuild)")
+    return len(drift)
+
+def update_country_totals(deltas: Optional[Dict[str, float]]) -> None:
+    """
+    End-of-run aggregation. In delta mode apply the run's per-country deltas and
+    run the full drift check on the first run of the process and every
+    AGG_RECONCILE_EVERY runs after; otherwise (or if deltas are unknown) rebuild.
+    """
+    with METRICS.stage("aggregate"):
+        _update_country_totals(deltas)
+
+def _update_country_totals(deltas: Optional[Dict[str, float]]) -> None:
+    global _runs_since_reconcile
+    if AGG_MODE != "delta" or deltas is None or not apply_country_deltas(deltas):
+        recompute_country_totals()
+        _runs_since_reconcile = 0
+        return
+
+    if _runs_since_reconcile is None or _runs_since_reconcile + 1 >= max(AGG_RECONCILE_EVERY, 1):
+        reconcile_country_totals()
+        _runs_since_reconcile = 0
+    else:
+        _runs_since_reconcile += 1
@@ -1,28 +1,86 @@
 # app/classify.py
-from typing import List, Dict, Tuple
-from .config import COL_LV_TEMPNAME, COL_LV_NAME
+import math
+import re
+from typing import Any, List, Dict, Optional, Tuple, Sequence
+import numpy as np
+from .config import COL_LV_TEMPNAME, COL_LV_NAME, EXCLUSION_RULES
 
-def split_excluded(rows: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+_SEP = "\x00"   # row separator in the joined scan buffer (never part of a pattern)
+
+
+def norm_account_id(v: Any) -> Optional[str]:
+    """lv_name → e2t_active.account_id: numeric names lose leading zeros (Q13 does the same in SQL)."""
+    if v is None or (isinstance(v, float) and math.isnan(v)): return None
+    s = str(v).strip()
+    try: return str(int(float(s)))
+    except Exception: return s
+
+
+def _row_starts(joined: str, lengths: np.ndarray) -> np.ndarray:
+    """Start offset of every row inside the joined (lower-cased) buffer."""
+    if len(joined) == int(lengths.sum()) + len(lengths) - 1:
+        return np.concatenate(([0], np.cumsum(lengths[:-1] + 1)))
+    # lower() changed some string lengths (e.g. 'İ'): locate the separators instead
+    seps = np.flatnonzero(np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32) == 0)
+    return np.concatenate(([0], seps + 1))
+
+
+def match_rules(temps: Sequence[str], rules=EXCLUSION_RULES) -> np.ndarray:
+    """
+    Boolean matrix [len(temps), len(rules)]: does TempName i contain pattern j
+    (case-insensitive substring)? All names are lower-cased and joined once, and
+    each pattern is a single C-level regex scan over that buffer.
+    """
+    hits = np.zeros((len(temps), len(rules)), dtype=bool)
+    if not len(temps):
+        return hits
+    joined = _SEP.join(temps).lower()
+    if joined.count(_SEP) != len(temps) - 1:   # a name carries the separator itself
+        temps = [t.replace(_SEP, "\x01") for t in temps]
+        joined = _SEP.join(temps).lower()
+    lengths = np.fromiter(map(len, temps), dtype=np.int64, count=len(temps))
+    starts = _row_starts(joined, lengths)
+    for j, (pattern, _) in enumerate(rules):
+        pos = np.fromiter((m.start() for m in re.finditer(re.escape(pattern), joined)), dtype=np.int64)
+        if len(pos):
+            hits[np.searchsorted(starts, pos, side="right") - 1, j] = True
+    return hits
+
+
+def exclusion_reasons(hits: np.ndarray, rules=EXCLUSION_RULES) -> Tuple[np.ndarray, List[str]]:
+    """
+    match_rules() matrix → (indices of the excluded rows, one reason label per
+    excluded row). Labels are built once per distinct rule combination.
+    """
+    codes = [reason for _, reason in rules]
+    exc_idx = np.flatnonzero(hits.any(axis=1))
+    if not len(exc_idx):
+        return exc_idx, []
+    if len(rules) <= 62:   # combination as a bitmask: 1-D unique is much cheaper than unique rows
+        bits = hits[exc_idx].astype(np.int64) @ (np.int64(1) << np.arange(len(rules), dtype=np.int64))
+        combos, inv = np.unique(bits, return_inverse=True)
+        combos = (int(c) >> np.arange(len(rules)) & 1 for c in combos)
+    else:
+        combos, inv = np.unique(hits[exc_idx], axis=0, return_inverse=True)
+    labels = [",".join(dict.fromkeys(codes[j] for j in np.flatnonzero(c))) for c in combos]
+    return exc_idx, [labels[k] for k in inv.ravel().tolist()]
+
+
+def split_excluded(rows: List[Dict], rules=EXCLUSION_RULES) -> Tuple[List[Dict], List[Dict]]:
     """
     Returns (excluded_list, to_process_list)
     excluded has fields: account_id, reason, tempname
     to_process has lv_name (as provided)
     """
-    excluded, ok = [], []
-    for r in rows:
-        temp = str(r.get(COL_LV_TEMPNAME, "") or "")
-        name = str(r.get(COL_LV_NAME, "") or "").strip()
-        low = temp.lower()
-        reason = []
-        if "audition" in low:   reason.append("audition")
-        if "free trial" in low: reason.append("free trial")
-        if reason:
-            excluded.append({
-                "account_id": name,
-                "reason": ",".join(reason),
-                "tempname": temp
-            })
-        else:
-            if name:
-                ok.append(r)
+    temps = [str(r.get(COL_LV_TEMPNAME, "") or "") for r in rows]
+    names = [str(r.get(COL_LV_NAME, "") or "").strip() for r in rows]
+    hits = match_rules(temps, rules)
+    exc_idx, reasons = exclusion_reasons(hits, rules)
+
+    excluded = [{
+        "account_id": names[i],
+        "reason": reason,
+        "tempname": temps[i]
+    } for i, reason in zip(exc_idx.tolist(), reasons)]
+    ok = [rows[i] for i in np.flatnonzero(~hits.any(axis=1)).tolist() if names[i]]
     return (excluded, ok)
@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import json
 
 
 def getenv_bool(name: str, default: bool = False) -> bool:
@@ -11,6 +12,14 @@ def getenv_bool(name: str, default: bool = False) -> bool:
         return default
     return str(v).strip().lower() in ("1", "true", "yes", "y", "on")
 
+def getenv_int(name: str, default: int) -> int:
+    v = os.environ.get(name, "").strip()   # a blank key (e.g. from .env) counts as unset
+    return int(v if v else default)
+
+def getenv_float(name: str, default: float) -> float:
+    v = os.environ.get(name, "").strip()
+    return float(v if v else default)
+
 SUPABASE_URL = os.environ.get("SUPABASE_URL", "").strip()
 SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", os.environ.get("SUPABASE_ANON_KEY", "")).strip()
 
@@ -18,7 +27,14 @@ SIRIX_API_URL = os.environ.get("SIRIX_API_URL", "https://restapi-real3.sirixtrad
 SIRIX_TOKEN   = os.environ.get("SIRIX_TOKEN", "").strip()
 
 TZ_LABEL = os.environ.get("TZ_LABEL", "Europe/London")
-RATE_DELAY_SEC = float(os.environ.get("RATE_DELAY_SEC", "0.2"))
+RATE_DELAY_SEC = getenv_float("RATE_DELAY_SEC", 0.2)
+
+# Sirix adaptive rate limit (requests/sec). The start rate defaults to what the old
+# RATE_DELAY_SEC throttle allowed with 8 workers; it then adapts between MIN and MAX.
+SIRIX_RATE_START = getenv_float("SIRIX_RATE_START", 8.0 / RATE_DELAY_SEC if RATE_DELAY_SEC > 0 else 40.0)
+SIRIX_RATE_MIN   = getenv_float("SIRIX_RATE_MIN", 2)
+SIRIX_RATE_MAX   = getenv_float("SIRIX_RATE_MAX", 400)
+SIRIX_RATE_BURST = getenv_float("SIRIX_RATE_BURST", 20)
 
 E2T_NOTIFY_NETLIFY = getenv_bool("E2T_NOTIFY_NETLIFY", False)
 NETLIFY_BUILD_HOOK_URL = os.environ.get("NETLIFY_BUILD_HOOK_URL", "").strip()
@@ -28,9 +44,32 @@ TABLE_CRM_SKIM   = "lv_tpaccount_skim"     # lv_name, lv_tempname, lv_accountidn
 TABLE_ACTIVE     = "e2t_active"            # account_id, country, plan
 TABLE_EXCLUDED   = "e2t_excluded"          # account_id, reason, tempname
 TABLE_ALLOC      = "e2t_country_allocation"  # country, total_plan
-VIEW_ALLOC       = "v_e2t_country_allocation" # optional view
+VIEW_ALLOC       = "v_e2t_country_allocation" # dashboard view: totals + goal columns (Q15)
+TABLE_SYNC_STATE = "e2t_sync_state"        # name, hwm, kind (CDC high-water marks)
+
+# Exclusion rules: case-insensitive TempName substring → reason code, checked in order.
+# Override with a JSON object, e.g. E2T_EXCLUSION_RULES='{"audition": "audition", "free trial": "free trial"}'
+DEFAULT_EXCLUSION_RULES = (("audition", "audition"), ("free trial", "free trial"))
+
+def _load_exclusion_rules(raw: str):
+    if not raw.strip():
+        return DEFAULT_EXCLUSION_RULES
+    rules = json.loads(raw)
+    pairs = rules.items() if isinstance(rules, dict) else rules
+    out = tuple((str(p).lower(), str(r)) for p, r in pairs if str(p))
+    if not out:
+        raise ValueError("E2T_EXCLUSION_RULES has no usable patterns")
+    return out
+
+EXCLUSION_RULES = _load_exclusion_rules(os.environ.get("E2T_EXCLUSION_RULES", ""))
 
 # Columns used from CRM mirror
 COL_LV_NAME      = "lv_name"
 COL_LV_TEMPNAME  = "lv_tempname"
 COL_LV_ACCNAME   = "lv_accountidname"
+
+# Large tables are read with keyset pagination (primary key > last seen) instead of limit/offset
+KEYSET_COLUMNS = {
+    TABLE_CRM_SKIM: COL_LV_NAME,
+    TABLE_ACTIVE:   "account_id",
+}
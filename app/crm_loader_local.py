@@ -1,220 +1,395 @@
 # app/crm_loader_local.py  (FAST BATCH UPSERT)
-import os, time, math, random, urllib, requests, pandas as pd
-from sqlalchemy import create_engine
+import os, re, time, queue, threading, urllib, pandas as pd
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# --- env/config ---
-SUPABASE_URL = os.environ["SUPABASE_URL"].rstrip("/")
-SUPABASE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
-BASE_REST = f"{SUPABASE_URL}/rest/v1"
-TABLE = "lv_tpaccount_skim"
+from .config import TABLE_CRM_SKIM, TABLE_ACTIVE, TABLE_EXCLUDED, TABLE_SYNC_STATE, getenv_float, getenv_int
+from .supa import pg_select, pg_iter_pages_parallel, select_in, upsert_many, delete_in, count_rows
+from .classify import split_excluded, norm_account_id
+from .aggregate import country_key, apply_country_deltas, recompute_country_totals
+from .fingerprint import FingerprintStore, encode_keys, hash_rows
+from .uploader import BatchUploader
+from .idset import IdSet
+from .metrics import METRICS, serve_metrics
+from .profiling import profile_run
+
+# --- env/config ---  (Supabase URL/key are read by app.config for the shared client)
+TABLE = TABLE_CRM_SKIM
 MSSQL_ODBC_DSN = os.environ["MSSQL_ODBC_DSN"]
 
 # knobs (env overrides)
-BATCH_SIZE   = int(os.environ.get("CRM_BATCH_SIZE", "1000"))        # rows per POST
-LOG_EVERY    = int(os.environ.get("CRM_LOG_EVERY", "2000"))         # heartbeat
+BATCH_SIZE   = getenv_int("CRM_BATCH_SIZE", 1000)                   # rows per POST (starting size, adapts)
+BATCH_MIN    = getenv_int("CRM_BATCH_MIN", 50)
+BATCH_MAX    = getenv_int("CRM_BATCH_MAX", 5000)
+UPLOAD_WORKERS = getenv_int("CRM_UPLOAD_WORKERS", 4)                # POSTs in flight
+UPLOAD_TARGET  = getenv_float("CRM_UPLOAD_TARGET_SEC", 5)           # batch latency the sizing aims for
+LOG_EVERY    = getenv_int("CRM_LOG_EVERY", 2000)                    # heartbeat
 ONLY_NEW     = os.environ.get("CRM_ONLY_NEW", "true").lower() in ("1","true","yes","y")
-BATCH_SLEEP  = float(os.environ.get("CRM_BATCH_SLEEP", "0.0"))      # throttle
-
-# --- HTTP session with keep-alive ---
-def make_session() -> requests.Session:
-    s = requests.Session()
-    s.headers.update({
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Prefer": "resolution=merge-duplicates",   # allow upsert
-    })
-    return s
-
-def _retryable(msg: str) -> bool:
-    msg = (msg or "").lower()
-    return any(k in msg for k in ("timeout", "temporarily unavailable", "remote", "reset", "eof", "disconnect"))
-
-def supa_count_rows(session: requests.Session, table: str) -> int:
-    url = f"{BASE_REST}/{table}"
-    params = {"select": "lv_name"}
-    headers = {"Prefer": "count=exact", "Range": "0-0"}
+# ONLY_NEW via ON CONFLICT DO NOTHING on the server instead of downloading every lv_name first.
+# Off by default: it POSTs the whole extract and the server checks every row for a conflict,
+# while the key download sends only the new rows (worth it only when few keys exist yet).
+ONLY_NEW_SERVER = os.environ.get("CRM_ONLY_NEW_SERVER_SIDE", "false").lower() in ("1","true","yes","y")
+BATCH_SLEEP  = getenv_float("CRM_BATCH_SLEEP", 0.0)                 # throttle (per worker, after each POST)
+STREAM       = os.environ.get("CRM_STREAM", "true").lower() in ("1","true","yes","y")
+CHUNK_ROWS   = getenv_int("CRM_CHUNK_ROWS", 20000)                  # rows per extracted chunk (stream mode)
+PREFETCH     = getenv_int("CRM_PREFETCH_CHUNKS", 2)                 # chunks read ahead of the uploader
+CDC          = os.environ.get("CRM_CDC", "false").lower() in ("1","true","yes","y")
+CDC_COLUMN   = os.environ.get("CRM_CDC_COLUMN", "VersionNumber").strip()     # rowversion or ModifiedOn-style column
+CDC_KIND     = os.environ.get("CRM_CDC_KIND", "rowversion").strip().lower()  # rowversion | timestamp
+CDC_OVERLAP  = getenv_int("CRM_CDC_OVERLAP_SEC", 300)               # timestamp mode: re-read window behind the mark
+CDC_STATE    = "crm_lv_tpaccount"                                    # row name in e2t_sync_state
+DIFF         = os.environ.get("CRM_DIFF", "true").lower() in ("1","true","yes","y")
+DIFF_PATH    = os.environ.get("CRM_DIFF_PATH", ".cache/crm_fingerprints")     # local fingerprint store (dir)
+DIFF_MAX_DEL = getenv_float("CRM_DIFF_MAX_DELETE_PCT", 5)           # hold back deletes above this % of the store
+
+CRM_SQL = """
+SELECT
+    CAST(Lv_name AS NVARCHAR(255))              AS lv_name,
+    CAST(Lv_TempName AS NVARCHAR(255))          AS lv_tempname,
+    CAST(lv_accountidName AS NVARCHAR(255))     AS lv_accountidname
+FROM dbo.Lv_tpaccount
+"""
+CRM_COLS = ("lv_name", "lv_tempname", "lv_accountidname")
+
+# ---------- CDC (high-water mark) helpers ----------
+def _cdc_column() -> str:
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", CDC_COLUMN):
+        raise ValueError(f"CRM_CDC_COLUMN is not a plain column name: {CDC_COLUMN!r}")
+    return CDC_COLUMN
+
+def cdc_sql() -> str:
+    """CRM_SQL restricted to rows changed in (lo, hi]."""
+    col = _cdc_column()
+    if CDC_KIND == "rowversion":
+        return CRM_SQL + (f"WHERE {col} > CONVERT(BINARY(8), CAST(:lo AS BIGINT))\n"
+                          f"  AND {col} <= CONVERT(BINARY(8), CAST(:hi AS BIGINT))\n")
+    return CRM_SQL + f"WHERE {col} > :lo AND {col} <= :hi\n"
+
+def cdc_upper_bound(engine) -> Any:
+    """
+    Upper end of this run's window, read before extraction. For rowversion it sits just below
+    MIN_ACTIVE_ROWVERSION(), so rows of transactions still in flight are left for the next run.
+    """
+    if CDC_KIND == "rowversion":
+        sql = "SELECT CAST(MIN_ACTIVE_ROWVERSION() AS BIGINT) - 1"
+    else:
+        sql = f"SELECT MAX({_cdc_column()}) FROM dbo.Lv_tpaccount"
+    with engine.connect() as conn:
+        return conn.execute(text(sql)).scalar()
+
+def _hwm_text(v: Any) -> str:
+    if CDC_KIND == "rowversion":
+        return str(int(v))
+    return v.isoformat() if isinstance(v, datetime) else str(v)
+
+def cdc_params(hwm: str, hi: Any) -> Dict[str, Any]:
+    if CDC_KIND == "rowversion":
+        return {"lo": int(hwm), "hi": int(hi)}
+    # ModifiedOn is not monotonic across concurrent writers: step back a little (upserts are idempotent)
+    return {"lo": datetime.fromisoformat(hwm) - timedelta(seconds=CDC_OVERLAP), "hi": hi}
+
+def read_hwm() -> Optional[str]:
+    """Stored high-water mark, or None (first CDC run, or the mark was taken with another kind)."""
     try:
-        r = session.get(url, params=params, headers=headers, timeout=30)
-        if r.status_code not in (200, 206): return -1
-        cr = r.headers.get("Content-Range", "")
-        if "/" in cr: return int(cr.split("/")[-1])
-        return -1
-    except Exception:
-        return -1
+        rows = pg_select(TABLE_SYNC_STATE, "hwm,kind", filters={"name": f"eq.{CDC_STATE}"})
+    except Exception as e:
+        print(f"[WARN] {TABLE_SYNC_STATE} read failed: {str(e)[:160]}")
+        return None
+    if not rows or not rows[0].get("hwm"):
+        return None
+    if rows[0].get("kind") != CDC_KIND:
+        print(f"[CRM] CDC mark was taken as {rows[0].get('kind')!r}, now {CDC_KIND!r} → full baseline")
+        return None
+    return rows[0]["hwm"]
+
+def save_hwm(hwm: str, rows_synced: int) -> bool:
+    row = {"name": CDC_STATE, "hwm": hwm, "kind": CDC_KIND, "rows_synced": rows_synced,
+           "updated_at": datetime.now(timezone.utc).isoformat()}
+    return all(res.ok for res in upsert_many(TABLE_SYNC_STATE, [row], on_conflict="name"))
 
-def supa_fetch_existing_keys(session: requests.Session) -> set:
+def reclassify_changed(rows: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Apply TempName changes to the worker's tables for rows that changed in the CRM:
+      - now excluded → upsert into e2t_excluded, drop from e2t_active (country totals adjusted)
+      - no longer excluded → drop from e2t_excluded; the worker then fetches it as a new account
+    e2t_excluded is keyed by the trimmed lv_name, e2t_active by the worker's normalised id.
+    """
+    stats = {"excluded": 0, "removed_active": 0, "unexcluded": 0}
+    excluded, ok = split_excluded(rows)
+
+    if excluded:
+        stats["excluded"] = len(excluded)
+        upsert_many(TABLE_EXCLUDED, excluded, "account_id")
+        active_ids = sorted({a for a in map(norm_account_id, (e["account_id"] for e in excluded)) if a})
+        prev = select_in(TABLE_ACTIVE, "account_id,country,plan", "account_id", active_ids)
+        if prev:
+            res = delete_in(TABLE_ACTIVE, "account_id", [r["account_id"] for r in prev])
+            stats["removed_active"] = len(prev)
+            deltas: Dict[str, float] = {}
+            for r in prev:
+                c = country_key(r.get("country"))
+                deltas[c] = deltas.get(c, 0.0) - float(r.get("plan") or 0)
+            if not (all(x.ok for x in res) and apply_country_deltas(deltas)):
+                recompute_country_totals()
+
+    if ok:
+        was = select_in(TABLE_EXCLUDED, "account_id", "account_id", [r["lv_name"] for r in ok])
+        if was:
+            delete_in(TABLE_EXCLUDED, "account_id", [r["account_id"] for r in was])
+            stats["unexcluded"] = len(was)
+    return stats
+
+def supa_fetch_existing_keys() -> IdSet:
     """
     Pull all existing lv_name keys once, paginated, to allow ONLY_NEW filtering.
     """
-    keys = set()
-    url = f"{BASE_REST}/{TABLE}"
-    page = 0
-    page_size = 1000
-    while True:
-        params = {
-            "select": "lv_name",
-            "limit": page_size,
-            "offset": page * page_size
-        }
-        r = session.get(url, params=params, timeout=60)
-        if r.status_code not in (200,206):
-            print(f"[WARN] existing-keys fetch status={r.status_code} at page {page}")
-            break
-        rows = r.json() or []
-        if not rows:
-            break
-        keys.update((str(x.get("lv_name") or "").strip() for x in rows))
-        if len(rows) < page_size:
-            break
-        page += 1
+    keys = IdSet()
+    try:
+        for page in pg_iter_pages_parallel(TABLE, "lv_name"):
+            keys.add_many([str(x.get("lv_name") or "").strip() for x in page])
+    except Exception as e:
+        print(f"[WARN] existing-keys fetch failed: {str(e)[:160]}")
+        return IdSet()
     return keys
 
-def supa_upsert_batch(session: requests.Session, rows: list) -> bool:
+def make_mssql_engine():
+    # Prefer a pure-Python driver on Heroku (no OS ODBC needed)
+    mssql_url = os.environ.get("MSSQL_URL", "").strip()
+    if mssql_url:
+        # Works for either mssql+pymssql:// or mssql+pytds://
+        driver = mssql_url.split("://", 1)[0]
+        conn_args = {"timeout": 30}  # both drivers accept this
+        if "pymssql" in driver:
+            # pymssql also supports login_timeout, and charset at connect level
+            conn_args.update({"login_timeout": 30, "charset": "utf8"})
+
+        return create_engine(
+            mssql_url,
+            pool_pre_ping=True,
+            pool_recycle=300,
+            connect_args=conn_args,
+        )
+    # Local dev via ODBC DSN (Windows/ODBC)
+    params = urllib.parse.quote_plus(MSSQL_ODBC_DSN)
+    return create_engine(
+        f"mssql+pyodbc:///?odbc_connect={params}",
+        pool_pre_ping=True,
+        pool_recycle=300,
+    )
+
+def iter_crm_chunks(engine, chunksize: int = 0, sql: str = CRM_SQL, params: Optional[Dict[str, Any]] = None):
     """
-    Upsert a list[dict] in one POST (fast). Returns True if 2xx.
+    Yield the CRM extract as DataFrames of at most `chunksize` rows, read through a
+    streaming cursor. chunksize=0 yields the whole result as one frame.
     """
-    if not rows:
-        return True
-    url = f"{BASE_REST}/{TABLE}"
-    params = {"on_conflict": "lv_name"}
-    backoff = 0.5
-    for attempt in range(1, 6):
+    with engine.connect() as conn:
+        if not chunksize:
+            yield pd.read_sql(text(sql), conn, params=params)
+            return
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+        for chunk in pd.read_sql(text(sql), conn, params=params, chunksize=chunksize):
+            yield chunk
+
+def _prefetch(chunks, depth: int):
+    """Read chunks on a background thread so extraction overlaps the upserts."""
+    if depth <= 0:
+        yield from chunks
+        return
+    q: "queue.Queue" = queue.Queue(maxsize=depth)
+    end = object()
+
+    def _reader():
         try:
-            r = session.post(url, params=params, json=rows, timeout=90)
-            if r.status_code in (200,201,204):
-                return True
-            # show one sample error if bad request
-            if r.status_code == 400:
-                print(f"[UPsert 400] resp: {r.text[:220]}")
-                return False
-            r.raise_for_status()
-        except Exception as e:
-            msg = str(e)
-            if attempt == 5 or not _retryable(msg):
-                print(f"[UPsert ERR] {msg[:200]}")
-                return False
-            time.sleep(backoff * (1.0 + random.random() * 0.35))
-            backoff = min(backoff * 1.8, 8.0)
-    return False
-
-def chunked(iterable, n):
-    buf = []
-    for x in iterable:
-        buf.append(x)
-        if len(buf) >= n:
-            yield buf
-            buf = []
-    if buf:
-        yield buf
-
-def main():
+            for c in chunks:
+                q.put(c)
+        except BaseException as e:
+            q.put(e)
+            return
+        q.put(end)
+
+    threading.Thread(target=_reader, name="crm-extract", daemon=True).start()
+    while True:
+        item = q.get()
+        if item is end:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+def chunk_to_rows(df: "pd.DataFrame", existing: IdSet, seen: IdSet, store: Optional[FingerprintStore] = None) -> tuple:
+    """
+    Clean one extracted chunk into upsert rows: strip lv_name, drop empties, dedupe
+    (last wins), skip `existing` keys, and with a fingerprint store drop rows whose
+    content is unchanged since the last sync. `seen` accumulates keys across chunks so
+    the unique total can be reported; a key repeated in a later chunk is upserted
+    again, which keeps the whole-table "last wins" result.
+    Returns (rows, {"unique", "repeats", "skipped", "unchanged"}).
+    """
+    names = df["lv_name"].astype("string").str.strip()
+    df = df.assign(lv_name=names)[names.notna() & (names != "")]
+    df = df.drop_duplicates(subset=["lv_name"], keep="last")
+    skipped = 0
+    if existing:
+        keep = ~existing.contains_many(df["lv_name"].tolist())
+        skipped = int(len(df) - keep.sum())
+        df = df[keep]
+    fresh = int(seen.add_many(df["lv_name"].tolist()).sum())
+    repeats = len(df) - fresh
+    unchanged = 0
+    if store is not None:
+        changed = store.diff(encode_keys(df["lv_name"]), hash_rows(df[list(CRM_COLS[1:])]))
+        unchanged = int(len(df) - changed.sum())
+        df = df[changed]
+    # NaN/NA → None column-wise, then zip; no per-cell pd.isna
+    cols = [df[c].astype(object).where(df[c].notna(), None).tolist() for c in CRM_COLS]
+    rows = [dict(zip(CRM_COLS, vals)) for vals in zip(*cols)]
+    return rows, {"unique": fresh, "repeats": repeats, "skipped": skipped, "unchanged": unchanged}
+
+def main(cdc: Optional[bool] = None):
+    """One CRM → skim sync; `cdc` overrides CRM_CDC for this run."""
+    with profile_run("crm"):
+        _main(CDC if cdc is None else cdc)
+
+def _main(cdc: bool):
     started = time.time()
     ts_start = time.strftime("%Y-%m-%d %H:%M:%S")
     print(f"[CRM] Sync started @ {ts_start}")
-    session = make_session()
-
-    before_count = supa_count_rows(session, TABLE)
+    serve_metrics()
+    METRICS.start_run("crm")
+    before_count = count_rows(TABLE, "lv_name")
     if before_count >= 0:
         print(f"[CRM] Supabase rows BEFORE: {before_count:,}")
     else:
         print("[CRM] Could not read BEFORE count")
 
-    # --- read SQL Server ---
-    print("[CRM] Extracting minimal columns …")
+    # --- OPTIONAL: skip already existing keys (CDC already limits the extract to changed rows) ---
+    existing = IdSet()
+    ignore_existing = ONLY_NEW and not cdc and ONLY_NEW_SERVER
+    if ignore_existing:
+        print("[CRM] ONLY_NEW enabled → existing keys left untouched server-side (resolution=ignore-duplicates)")
+    elif ONLY_NEW and not cdc:
+        existing = supa_fetch_existing_keys()
+        if existing:
+            print(f"[CRM] ONLY_NEW enabled → will skip {len(existing):,} existing keys")
 
-    # Prefer a pure-Python driver on Heroku (no OS ODBC needed)
-    mssql_url = os.environ.get("MSSQL_URL", "").strip()
+    # --- read SQL Server (streamed in chunks) + batch upserts ---
+    fetched = unique = skipped_existing = unchanged = deleted = 0
+    attempted = ok = fail = 0
+    seen = IdSet()
+    next_log = max(LOG_EVERY, 1)
+
+    def progress(res, st):   # called by the upload workers, once per finished batch
+        nonlocal next_log
+        done = st["ok"] + st["fail"]
+        METRICS.progress(upserted_ok=st["ok"], upserted_fail=st["fail"], batch_rows=st["batch_rows"])
+        if done >= next_log or not res.ok:
+            next_log = done + max(LOG_EVERY, 1)
+            print(f"[CRM] Progress: fetched {fetched:,} | upserted {done:,} | ok≈{st['ok']:,} fail≈{st['fail']:,} "
+                  f"| batch≈{st['batch_rows']} ({res.elapsed:0.1f}s)")
+    hwm: Optional[str] = None
+    hi: Any = None
+    recl = {"excluded": 0, "removed_active": 0, "unexcluded": 0}
+    recl_lock = threading.Lock()
+    recl_failed = 0
 
+    def reclassify(rows):   # upload workers, once per stored batch (CDC deltas only)
+        # delta rows carry TempName changes → move accounts in/out of the exclusion list
+        nonlocal recl_failed
+        try:
+            st = reclassify_changed(rows)
+        except Exception as e:
+            print(f"[CRM] Reclassifying {len(rows):,} changed rows failed: {str(e)[:160]}")
+            with recl_lock:
+                recl_failed += len(rows)
+            return
+        with recl_lock:
+            for k, v in st.items():
+                recl[k] += v
+
+    store: Optional[FingerprintStore] = None
+    up: Optional[BatchUploader] = None
     try:
-        if mssql_url:
-            # Works for either mssql+pymssql:// or mssql+pytds://
-            driver = mssql_url.split("://", 1)[0]
-            conn_args = {"timeout": 30}  # both drivers accept this
-            if "pymssql" in driver:
-                # pymssql also supports login_timeout, and charset at connect level
-                conn_args.update({"login_timeout": 30, "charset": "utf8"})
-
-            engine = create_engine(
-                mssql_url,
-                pool_pre_ping=True,
-                pool_recycle=300,
-                connect_args=conn_args,
-            )
-        else:
-            # Local dev via ODBC DSN (Windows/ODBC)
-            params = urllib.parse.quote_plus(MSSQL_ODBC_DSN)
-            engine = create_engine(
-                f"mssql+pyodbc:///?odbc_connect={params}",
-                pool_pre_ping=True,
-                pool_recycle=300,
-            )
-
-        sql = """
-        SELECT
-            CAST(Lv_name AS NVARCHAR(255))              AS lv_name,
-            CAST(Lv_TempName AS NVARCHAR(255))          AS lv_tempname,
-            CAST(lv_accountidName AS NVARCHAR(255))     AS lv_accountidname
-        FROM dbo.Lv_tpaccount
-        """
-        df = pd.read_sql(sql, engine)
+        engine = make_mssql_engine()
+        sql, params = CRM_SQL, None
+        if cdc:
+            hwm = read_hwm()
+            hi = cdc_upper_bound(engine)
+            if hwm is None:
+                print(f"[CRM] CDC: no high-water mark yet → full baseline, then mark at {_hwm_text(hi) if hi is not None else '-'}")
+            else:
+                sql, params = cdc_sql(), cdc_params(hwm, hi)
+                print(f"[CRM] CDC: rows with {CDC_COLUMN} in ({hwm}, {_hwm_text(hi) if hi is not None else '-'}]")
+
+        # full reads are diffed against the local fingerprints; only new/changed rows are sent
+        if DIFF and not ONLY_NEW and params is None:
+            store = FingerprintStore(DIFF_PATH)
+            print(f"[CRM] Diff against {len(store):,} stored fingerprints ({DIFF_PATH})")
+
+        print(f"[CRM] Extracting minimal columns … (stream={STREAM}, chunk={CHUNK_ROWS if STREAM else 'all'})")
+        chunks = iter_crm_chunks(engine, CHUNK_ROWS if STREAM else 0, sql, params)
+        if cdc and hwm is not None and hi is None:
+            chunks = iter(())    # empty source table: nothing changed
+        with METRICS.stage("sync"), BatchUploader(TABLE, "lv_name", workers=UPLOAD_WORKERS, batch_rows=BATCH_SIZE,
+                           min_rows=BATCH_MIN, max_rows=BATCH_MAX, target_sec=UPLOAD_TARGET,
+                           sleep=BATCH_SLEEP, on_batch=progress,
+                           on_rows=reclassify if cdc and hwm is not None else None,
+                           resolution="ignore-duplicates" if ignore_existing else "merge-duplicates") as up:
+            for chunk in _prefetch(chunks, PREFETCH if STREAM else 0):
+                fetched += len(chunk)
+                rows, st = chunk_to_rows(chunk, existing, seen, store)
+                del chunk
+                unique += st["unique"]
+                skipped_existing += st["skipped"]
+                unchanged += st["unchanged"]
+                METRICS.progress(fetched=fetched, unique=unique, skipped_existing=skipped_existing, unchanged=unchanged)
+
+                # a key seen in an earlier chunk must land after its earlier version ("last wins")
+                if st["repeats"]:
+                    up.flush()
+                up.submit(rows)
+                attempted += len(rows)
+        ok, fail = up.stats["ok"], up.stats["fail"]
 
     except Exception:
         # Print the real reason so we can see it in Heroku logs, then re-raise
         import traceback
         print("[CRM] FATAL while connecting/fetching:")
         print(traceback.format_exc())
+        METRICS.finish_run(error=traceback.format_exc(limit=1)[-200:])
         raise
 
-    total = len(df)
-    print(f"[CRM] Fetched {total:,} rows")
+    print(f"[CRM] Fetched {fetched:,} rows → {unique:,} unique non-empty keys"
+          + (f" ({unchanged:,} unchanged, skipped)" if store is not None else ""))
 
-    # --- pre-filter: drop empty lv_name + dedupe
-    df["lv_name"] = df["lv_name"].astype(str).str.strip()
-    df = df[df["lv_name"] != ""]
-    df = df.drop_duplicates(subset=["lv_name"], keep="last").reset_index(drop=True)
-    total = len(df)
-    print(f"[CRM] After dedupe/non-empty: {total:,} rows")
-
-    # --- OPTIONAL: skip already existing keys ---
-    skipped_existing = 0
-    if ONLY_NEW:
-        existing = supa_fetch_existing_keys(session)
-        if existing:
-            df = df[~df["lv_name"].isin(existing)].reset_index(drop=True)
-            skipped_existing = len(existing)
-            print(f"[CRM] ONLY_NEW enabled → will skip {skipped_existing:,} existing keys; to upsert: {len(df):,}")
-
-    attempted = ok = fail = 0
-    # --- batch upserts ---
-    for batch_idx, batch_df in enumerate(chunked(df.to_dict(orient="records"), BATCH_SIZE), start=1):
-        # massage None/NaN
-        rows = []
-        for r in batch_df:
-            rows.append({
-                "lv_name": r.get("lv_name"),
-                "lv_tempname": (None if pd.isna(r.get("lv_tempname")) else r.get("lv_tempname")),
-                "lv_accountidname": (None if pd.isna(r.get("lv_accountidname")) else r.get("lv_accountidname")),
-            })
-        attempted += len(rows)
-        ok_batch = supa_upsert_batch(session, rows)
-        if ok_batch:
-            ok += len(rows)
+    # --- vanished keys + new fingerprint store (only after a clean full pass) ---
+    if store is not None:
+        if fail:
+            print(f"[CRM] {fail:,} upserts failed → fingerprint store NOT updated (next run re-sends them)")
         else:
-            fail += len(rows)
-
-        if (attempted % max(LOG_EVERY, 1)) == 0 or ok_batch is False:
-            pct = (attempted / max(total,1)) * 100
-            print(f"[CRM] Progress: {attempted:,}/{total:,} ({pct:0.1f}%) | ok≈{ok:,} fail≈{fail:,}")
+            gone = store.vanished()
+            hold = len(gone) > 0 and len(gone) > len(store) * DIFF_MAX_DEL / 100.0
+            if hold:
+                print(f"[CRM] {len(gone):,} keys vanished from the CRM (> {DIFF_MAX_DEL:g}% of {len(store):,}) "
+                      f"→ deletes held back; check the extract, or raise CRM_DIFF_MAX_DELETE_PCT")
+            elif len(gone):
+                res = delete_in(TABLE, "lv_name", [k.decode("utf-8") for k in gone])
+                deleted = sum(r.rows for r in res if r.ok)
+                hold = deleted < len(gone)
+                print(f"[CRM] Deleted {deleted:,}/{len(gone):,} keys no longer in the CRM")
+            n = store.save(keep_vanished=hold)
+            print(f"[CRM] Fingerprint store updated: {n:,} keys")
 
-        if BATCH_SLEEP > 0:
-            time.sleep(BATCH_SLEEP)
+    if cdc and hi is not None:
+        if fail == 0 and recl_failed == 0 and save_hwm(_hwm_text(hi), attempted):
+            print(f"[CRM] CDC mark advanced to {_hwm_text(hi)}")
+        else:
+            print("[CRM] CDC mark NOT advanced (failed upserts, reclassification or state write) → next run re-reads this window")
 
-    after_count = supa_count_rows(session, TABLE)
+    after_count = count_rows(TABLE, "lv_name")
     if after_count >= 0:
         print(f"[CRM] Supabase rows AFTER: {after_count:,}")
     else:
@@ -224,19 +399,37 @@ def main():
     elapsed = time.time() - started
     mm, ss = divmod(int(elapsed), 60)
     print("\n===== CRM SYNC SUMMARY =====")
-    print(f"Rows fetched         : {total:,}")
-    if ONLY_NEW:
-        print(f"Skipped existing keys: {skipped_existing:,} (prefetch set size; not all were in SQL snapshot)")
+    print(f"Rows fetched         : {fetched:,}")
+    if ignore_existing:
+        print("Skipped existing keys: server-side (ignore-duplicates)")
+    elif ONLY_NEW and not cdc:
+        print(f"Skipped existing keys: {skipped_existing:,} (of {len(existing):,} prefetched)")
+    if store is not None:
+        print(f"Unchanged (diff)     : {unchanged:,}")
+        print(f"Deleted vanished     : {deleted:,}")
     print(f"Attempted upserts    : {attempted:,}")
     print(f"Successful (approx)  : {ok:,}")
     print(f"Failed (approx)      : {fail:,}")
     if before_count >= 0 and after_count >= 0:
         delta = after_count - before_count
         print(f"Supabase delta       : {delta:+,} (from {before_count:,} to {after_count:,})")
-    print(f"Batch size           : {BATCH_SIZE}")
-    print(f"ONLY_NEW             : {ONLY_NEW}")
+    print(f"Batch size           : {BATCH_SIZE} → {up.stats['batch_rows'] if up else '-'} (adaptive, {UPLOAD_WORKERS} workers)")
+    if up and up.stats["splits"]:
+        print(f"Bisected batches     : {up.stats['splits']:,} (single rows rejected: {len(up.stats['poison']):,}{'+' if len(up.stats['poison']) >= 20 else ''})")
+    print(f"Chunk rows           : {CHUNK_ROWS if STREAM else 'all (stream off)'}")
+    print(f"ONLY_NEW             : {ONLY_NEW and not cdc}")
+    if cdc:
+        print(f"CDC                  : {CDC_KIND} on {CDC_COLUMN} ({'delta' if hwm is not None else 'baseline'})")
+        print(f"Reclassified         : excluded={recl['excluded']:,} removed_active={recl['removed_active']:,} "
+              f"unexcluded={recl['unexcluded']:,}")
     print(f"Duration             : {mm:02d}:{ss:02d} (mm:ss)")
     print("===== END =====")
+    METRICS.finish_run(
+        fetched=fetched, unique=unique, skipped_existing=skipped_existing, unchanged=unchanged,
+        deleted=deleted, attempted=attempted, ok=ok, fail=fail,
+        rows_before=before_count, rows_after=after_count, cdc=cdc, reclassified=recl if cdc else None,
+        elapsed_sec=round(elapsed, 3),
+    )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,79 @@
+# app/cron.py  (CRON SCHEDULES)
+"""
+Five-field cron expressions evaluated in a time zone:
+
+    minute hour day-of-month month day-of-week     e.g. "30 7-22 * * 1-5", "*/15 * * * *"
+
+Fields take *, n, a-b, */s, a-b/s and comma lists; day-of-week is 0-7 (0 and 7
+are Sunday). As in cron, when both day fields are restricted a day matching
+either one fires. @hourly, @daily / @midnight and @weekly are accepted.
+
+Times are matched on the local wall clock, so "0 0 * * *" in Europe/London is
+London midnight on both sides of a DST change.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import FrozenSet
+from zoneinfo import ZoneInfo
+
+_ALIASES = {"@hourly": "0 * * * *", "@daily": "0 0 * * *", "@midnight": "0 0 * * *", "@weekly": "0 0 * * 0"}
+_BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _field(spec: str, lo: int, hi: int) -> FrozenSet[int]:
+    out = set()
+    for part in spec.split(","):
+        rng, _, step = part.partition("/")
+        if rng == "*":
+            a, b = lo, hi
+        elif "-" in rng:
+            a, b = (int(x) for x in rng.split("-", 1))
+        else:
+            a = b = int(rng)
+            if step:
+                b = hi
+        s = int(step) if step else 1
+        if not (lo <= a <= b <= hi) or s < 1:
+            raise ValueError(f"cron field {spec!r} out of range {lo}-{hi}")
+        out.update(range(a, b + 1, s))
+    return frozenset(out)
+
+
+class Cron:
+    def __init__(self, expr: str, tz: str = "Europe/London"):
+        self.expr = expr.strip()
+        fields = _ALIASES.get(self.expr, self.expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        self.minutes, self.hours, self.days, self.months, dows = (
+            _field(f, lo, hi) for f, (lo, hi) in zip(fields, _BOUNDS))
+        self.dows = frozenset(d % 7 for d in dows)          # Monday=1 … Sunday=0
+        self.any_day = fields[2] == "*"
+        self.any_dow = fields[4] == "*"
+        self.tz = ZoneInfo(tz)
+
+    def _day_ok(self, t: datetime) -> bool:
+        dom = t.day in self.days
+        dow = (t.isoweekday() % 7) in self.dows
+        if self.any_day or self.any_dow:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, after: datetime) -> datetime:
+        """First firing time strictly after `after` (aware), returned in UTC."""
+        t = after.astimezone(self.tz).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_ok(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t.replace(tzinfo=self.tz).astimezone(timezone.utc)
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+    def __repr__(self) -> str:
+        return f"Cron({self.expr!r})"
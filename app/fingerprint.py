@@ -0,0 +1,109 @@
+# app/fingerprint.py  (CRM ROW FINGERPRINTS)
+"""
+Compact local store of what was last written to lv_tpaccount_skim:
+lv_name → 64-bit hash of the non-key columns.
+
+Two .npy files (sorted keys as fixed-width bytes, uint64 hashes) are opened
+memory-mapped, so a few million keys cost tens of MB on disk and almost
+nothing in RAM until looked up. A sync run diffs each extracted chunk against
+the store (vectorised searchsorted), collects the fingerprints it saw, and
+writes a fresh store only after its upserts succeeded.
+"""
+import os
+import shutil
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+_KEYS = "keys.npy"
+_VALS = "vals.npy"
+
+
+def encode_keys(keys: pd.Series) -> np.ndarray:
+    """Series of str → fixed-width UTF-8 bytes array (numpy 'S' dtype)."""
+    return np.char.encode(keys.astype("string").fillna("").to_numpy(dtype=str), "utf-8")
+
+
+def hash_rows(df: pd.DataFrame) -> np.ndarray:
+    """Stable uint64 per row over the given columns (pandas' fixed-key SipHash); nulls hash alike."""
+    return pd.util.hash_pandas_object(df.astype("string"), index=False).to_numpy(dtype=np.uint64)
+
+
+class FingerprintStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.keys: np.ndarray = np.empty(0, dtype="S1")
+        self.vals: np.ndarray = np.empty(0, dtype=np.uint64)
+        if os.path.exists(os.path.join(path, _KEYS)) and os.path.exists(os.path.join(path, _VALS)):
+            try:
+                keys = np.load(os.path.join(path, _KEYS), mmap_mode="r")
+                vals = np.load(os.path.join(path, _VALS), mmap_mode="r")
+                if len(keys) == len(vals):
+                    self.keys, self.vals = keys, vals
+                else:
+                    print(f"[FP] {path}: keys/vals length mismatch → ignoring store")
+            except Exception as e:
+                print(f"[FP] {path}: unreadable store ({str(e)[:120]}) → ignoring")
+        self._seen = np.zeros(len(self.keys), dtype=bool)
+        self._new_keys: List[np.ndarray] = []
+        self._new_vals: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def diff(self, keys: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+        """
+        Boolean mask over `keys`: True where the key is new or its hash changed.
+        Also records (key, hash) for the next store and marks stored keys as seen.
+        """
+        self._new_keys.append(keys)
+        self._new_vals.append(hashes)
+        if not len(self.keys) or not len(keys):
+            return np.ones(len(keys), dtype=bool)
+        idx = np.searchsorted(self.keys, keys)
+        idx_c = np.minimum(idx, len(self.keys) - 1)
+        found = self.keys[idx_c] == keys
+        self._seen[idx_c[found]] = True
+        return ~found | (self.vals[idx_c] != hashes)
+
+    def vanished(self) -> np.ndarray:
+        """Stored keys that no diff() call has seen this run."""
+        return self.keys[~self._seen]
+
+    def save(self, path: Optional[str] = None, *, keep_vanished: bool = False) -> int:
+        """
+        Write the fingerprints collected by diff() as the new store (last occurrence wins).
+        keep_vanished carries unseen keys over, e.g. when their deletes were held back. Returns keys.
+        """
+        path = path or self.path
+        if keep_vanished and len(self.keys):
+            gone = ~self._seen
+            self._new_keys.insert(0, np.asarray(self.keys[gone]))
+            self._new_vals.insert(0, np.asarray(self.vals[gone]))
+        if self._new_keys:
+            width = max(a.dtype.itemsize for a in self._new_keys) or 1
+            keys = np.concatenate([a.astype(f"S{width}") for a in self._new_keys])
+            vals = np.concatenate(self._new_vals)
+        else:
+            keys, vals = np.empty(0, dtype="S1"), np.empty(0, dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        keys, vals = keys[order], vals[order]
+        last = np.append(keys[1:] != keys[:-1], True) if len(keys) else np.empty(0, dtype=bool)
+        keys, vals = keys[last], vals[last]
+
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, _KEYS), keys)
+        np.save(os.path.join(tmp, _VALS), vals)
+        # drop our mmaps before swapping the directory underneath them
+        self.keys = np.empty(0, dtype="S1")
+        self.vals = np.empty(0, dtype=np.uint64)
+        old = path + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+        return len(keys)
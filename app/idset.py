@@ -0,0 +1,134 @@
+# app/idset.py  (COMPACT ACCOUNT-ID SET)
+"""
+Set of account ids stored as a sorted NumPy int64 array, with a plain Python
+set for the few ids that are not canonical integers.
+
+Sirix/CRM ids are overwhelmingly decimal strings ("140123"), so a million of
+them cost 8 MB here instead of ~70 MB as a set of str. Only canonical forms go
+to the array (no sign, no leading zeros, at most 18 digits) so string equality
+is preserved exactly: "0123" and "123" stay different ids.
+
+Membership and difference are vectorised (searchsorted / setdiff1d). Growing
+the set with add_many() goes through a small sorted side array that is folded
+into the main one every MERGE_AT ids, so building from pages stays cheap.
+"""
+from typing import Iterable, Iterator, Sequence, Set, Tuple
+
+import numpy as np
+
+_MAX_DIGITS = 18          # always fits int64
+
+
+def _split(ids: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(ids as a unicode array, mask of canonical-integer ids, their int64 values)."""
+    arr = np.asarray(ids, dtype=str)
+    if not arr.size:
+        return arr, np.zeros(0, dtype=bool), np.empty(0, dtype=np.int64)
+    lens = np.char.str_len(arr)
+    cps = arr.view(np.uint32).reshape(len(arr), -1)          # code points, zero-padded
+    ascii_digits = ((cps >= 48) & (cps <= 57)).sum(axis=1)    # str.isdigit() would also take '²', '١'
+    num = (lens > 0) & (ascii_digits == lens) & (lens <= _MAX_DIGITS) & ((lens == 1) | (cps[:, 0] != 48))
+    # parse straight from the code points (much cheaper than a str → int64 astype)
+    digits = cps[num, :_MAX_DIGITS].astype(np.int64) - 48
+    exp = lens[num, None] - 1 - np.arange(digits.shape[1])
+    vals = np.where(exp >= 0, digits * np.power(10, np.maximum(exp, 0), dtype=np.int64), 0).sum(axis=1)
+    return arr, num, vals.astype(np.int64)
+
+
+class IdSet:
+    __slots__ = ("_ints", "_strs", "_pend")
+
+    MERGE_AT = 1 << 14     # side-array size at which it is folded into the main array
+
+    def __init__(self, ids: Iterable[str] = ()):
+        self._ints = np.empty(0, dtype=np.int64)
+        self._strs: Set[str] = set()
+        self._pend = np.empty(0, dtype=np.int64)
+        ids = ids if isinstance(ids, (list, tuple, np.ndarray)) else list(ids)
+        if len(ids):
+            self.add_many(ids)
+        self._merge()
+
+    @staticmethod
+    def _insert(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Merge sorted `b` (disjoint from `a`) into sorted `a` in linear time."""
+        return np.insert(a, np.searchsorted(a, b), b) if len(b) else a
+
+    @staticmethod
+    def _isin_sorted(a: np.ndarray, vals: np.ndarray) -> np.ndarray:
+        if not len(a) or not len(vals):
+            return np.zeros(len(vals), dtype=bool)
+        idx = np.minimum(np.searchsorted(a, vals), len(a) - 1)
+        return a[idx] == vals
+
+    def _merge(self) -> None:
+        if len(self._pend):
+            self._ints = self._insert(self._ints, self._pend)
+            self._pend = np.empty(0, dtype=np.int64)
+
+    def _has_ints(self, vals: np.ndarray) -> np.ndarray:
+        return self._isin_sorted(self._ints, vals) | self._isin_sorted(self._pend, vals)
+
+    def contains_many(self, ids: Sequence[str]) -> np.ndarray:
+        """Boolean mask: which of `ids` are in the set."""
+        arr, num, vals = _split(ids)
+        out = np.zeros(len(arr), dtype=bool)
+        out[num] = self._has_ints(vals)
+        if self._strs:
+            other = np.flatnonzero(~num)
+            out[other] = [s in self._strs for s in arr[other].tolist()]
+        return out
+
+    def add_many(self, ids: Sequence[str]) -> np.ndarray:
+        """Add ids; returns the mask of those that were new (first occurrence only)."""
+        arr, num, vals = _split(ids)
+        new = np.zeros(len(arr), dtype=bool)
+        if len(vals):
+            _, first = np.unique(vals, return_index=True)
+            fresh = np.zeros(len(vals), dtype=bool)
+            fresh[first] = True
+            fresh &= ~self._has_ints(vals)
+            new[np.flatnonzero(num)[fresh]] = True
+            if fresh.any():
+                self._pend = self._insert(self._pend, np.sort(vals[fresh]))
+                if len(self._pend) >= self.MERGE_AT:
+                    self._merge()
+        for i in np.flatnonzero(~num).tolist():
+            s = str(arr[i])
+            if s not in self._strs:
+                self._strs.add(s)
+                new[i] = True
+        return new
+
+    def __contains__(self, aid: object) -> bool:
+        return bool(self.contains_many([str(aid)])[0])
+
+    def __len__(self) -> int:
+        self._merge()
+        return len(self._ints) + len(self._strs)
+
+    def __iter__(self) -> Iterator[str]:
+        self._merge()
+        yield from map(str, self._ints.tolist())
+        yield from self._strs
+
+    def __sub__(self, other: "IdSet") -> "IdSet":
+        self._merge()
+        other._merge()
+        out = IdSet()
+        out._ints = np.setdiff1d(self._ints, other._ints, assume_unique=True)
+        out._strs = self._strs - other._strs
+        return out
+
+    def __or__(self, other: "IdSet") -> "IdSet":
+        self._merge()
+        other._merge()
+        out = IdSet()
+        out._ints = np.union1d(self._ints, other._ints)
+        out._strs = self._strs | other._strs
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate footprint (arrays + ~60 B per string id)."""
+        return int(self._ints.nbytes + self._pend.nbytes + 60 * len(self._strs))
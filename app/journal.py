@@ -0,0 +1,132 @@
+# app/journal.py  (WORKER RUN JOURNAL)
+"""
+Local checkpoint journal for worker runs (SQLite, WAL).
+
+Each run records its todo list as the planner streams it, then advances every
+account through queued → fetched → upserted. A run that dies before
+finish() stays "running" and can be resumed: only accounts not yet upserted
+are processed again. If the todo snapshot itself was incomplete the planner
+re-runs, skipping accounts this run already upserted.
+"""
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Iterable, List, Optional, Set, Tuple
+
+QUEUED, FETCHED, UPSERTED, FAILED = 0, 1, 2, 3
+
+_SCHEMA = """
+create table if not exists runs (
+  run_id        text primary key,
+  mode          text,
+  started_at    real not null,
+  finished_at   real,
+  status        text not null,        -- running | done
+  todo_complete integer not null default 0
+);
+create table if not exists items (
+  run_id     text not null,
+  account_id text not null,
+  state      integer not null,
+  primary key (run_id, account_id)
+);
+"""
+
+
+class RunJournal:
+    def __init__(self, path: str, commit_every: int = 2000):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.path = path
+        self.run_id: Optional[str] = None
+        self.commit_every = max(1, commit_every)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        self._db.executescript(_SCHEMA)
+        # finished runs keep their header row only
+        self._db.execute("delete from items where run_id in (select run_id from runs where status = 'done')")
+
+    def _commit_if(self, n: int) -> None:
+        self._pending += n
+        if self._pending >= self.commit_every:
+            self._db.execute("commit")
+            self._db.execute("begin")
+            self._pending = 0
+
+    def unfinished(self) -> Optional[Tuple[str, str, bool]]:
+        """Most recent run that never finished: (run_id, mode, todo_complete)."""
+        row = self._db.execute(
+            "select run_id, mode, todo_complete from runs where status = 'running' order by started_at desc limit 1"
+        ).fetchone()
+        return (row[0], row[1], bool(row[2])) if row else None
+
+    def start(self, mode: str) -> str:
+        self.run_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        with self._lock:
+            # an explicit new run supersedes anything left unfinished
+            self._db.execute("update runs set status = 'done', finished_at = ? where status = 'running'", (time.time(),))
+            self._db.execute("insert into runs(run_id, mode, started_at, status) values (?, ?, ?, 'running')",
+                             (self.run_id, mode, time.time()))
+            self._db.execute("begin")
+        return self.run_id
+
+    def reopen(self, run_id: str) -> str:
+        self.run_id = run_id
+        with self._lock:
+            self._db.execute("begin")
+        return run_id
+
+    def add_todo(self, ids: Iterable[str]) -> None:
+        rows = [(self.run_id, aid, QUEUED) for aid in ids]
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("insert or ignore into items(run_id, account_id, state) values (?, ?, ?)", rows)
+            self._commit_if(len(rows))
+
+    def mark(self, ids: Iterable[str], state: int) -> None:
+        rows = [(state, self.run_id, aid) for aid in ids]
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("update items set state = ? where run_id = ? and account_id = ?", rows)
+            self._commit_if(len(rows))
+
+    def mark_todo_complete(self) -> None:
+        with self._lock:
+            self._db.execute("update runs set todo_complete = 1 where run_id = ?", (self.run_id,))
+            self._db.execute("commit")
+            self._db.execute("begin")
+            self._pending = 0
+
+    def remaining(self) -> List[str]:
+        """Accounts of this run still queued or fetched-but-not-upserted, in snapshot order."""
+        with self._lock:
+            return [r[0] for r in self._db.execute(
+                "select account_id from items where run_id = ? and state in (?, ?) order by rowid",
+                (self.run_id, QUEUED, FETCHED))]
+
+    def upserted(self) -> Set[str]:
+        with self._lock:
+            return {r[0] for r in self._db.execute(
+                "select account_id from items where run_id = ? and state = ?", (self.run_id, UPSERTED))}
+
+    def finish(self) -> None:
+        with self._lock:
+            self._db.execute("update runs set status = 'done', finished_at = ? where run_id = ?",
+                             (time.time(), self.run_id))
+            self._db.execute("commit")
+            self._db.execute("delete from items where run_id = ?", (self.run_id,))
+            self._pending = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db.in_transaction:
+                self._db.execute("commit")
+            self._db.close()
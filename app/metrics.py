@@ -0,0 +1,283 @@
+# app/metrics.py  (RUN METRICS)
+"""
+In-process instrumentation for the worker, the CRM sync and the scheduler.
+
+    METRICS.inc("sirix_ok")                         counters
+    METRICS.request("sirix", 429, 0.180)            latency histogram + status breakdown
+    with METRICS.stage("plan"): ...                 stage durations (running stages show in /progress)
+    METRICS.progress(processed=..., queued=...)     free-form live progress fields
+
+Latencies go into fixed log-spaced buckets (1 ms … ~2 min), so memory stays
+constant over a multi-hour run; p50/p95/p99 are interpolated within a bucket.
+
+Each run (start_run / finish_run) gets a fresh set of series; finish_run writes
+the JSON run report to E2T_REPORT_DIR, keeping the newest E2T_REPORT_KEEP per
+run kind. With E2T_METRICS_PORT set, a local HTTP
+server exposes /metrics (Prometheus text format) and /progress (JSON).
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .config import getenv_int
+
+METRICS_PORT = getenv_int("E2T_METRICS_PORT", 0)                        # 0 = no HTTP endpoint
+METRICS_HOST = os.environ.get("E2T_METRICS_HOST", "127.0.0.1")
+REPORT_DIR   = os.environ.get("E2T_REPORT_DIR", ".cache/reports").strip()  # "" = no JSON run reports
+REPORT_KEEP  = getenv_int("E2T_REPORT_KEEP", 200)                         # newest reports kept per kind; 0 = all
+
+# bucket upper bounds in seconds: 1 ms · 2^(k/2), up to ~131 s
+BUCKETS: Tuple[float, ...] = tuple(0.001 * 2 ** (k / 2) for k in range(35))
+
+
+class Histogram:
+    __slots__ = ("counts", "n", "total", "min", "max", "status")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.status: Dict[str, int] = {}
+
+    def observe(self, seconds: float, status: Any = None) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.n += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        if status is not None:
+            key = str(status)
+            self.status[key] = self.status.get(key, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        if not self.n:
+            return 0.0
+        rank = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = BUCKETS[i - 1] if i else 0.0
+                hi = BUCKETS[i] if i < len(BUCKETS) else self.max
+                est = lo + (hi - lo) * (rank - seen) / c
+                return min(max(est, self.min), self.max)
+            seen += c
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        ms = lambda s: round(s * 1e3, 2)
+        return {"n": self.n, "mean_ms": ms(self.total / self.n) if self.n else 0.0,
+                "p50_ms": ms(self.quantile(0.50)), "p95_ms": ms(self.quantile(0.95)),
+                "p99_ms": ms(self.quantile(0.99)), "min_ms": ms(self.min) if self.n else 0.0,
+                "max_ms": ms(self.max), "status": dict(sorted(self.status.items()))}
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._service: Dict[str, Any] = {}          # outlives runs (scheduler state)
+        self.last_runs: Dict[str, Dict[str, Any]] = {}
+        self.stage_hooks: List[Callable[[str, bool], None]] = []   # (stage, entering) — e.g. app/profiling.py
+        self._reset("idle")
+
+    def _reset(self, kind: str) -> None:
+        self.kind = kind
+        self.run_started = time.time()
+        self.counters: Dict[str, float] = {}
+        self.hists: Dict[str, Histogram] = {}
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self._progress: Dict[str, Any] = {}
+
+    # ---------- recording ----------
+    def inc(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float, status: Any = None) -> None:
+        with self._lock:
+            h = self.hists.get(name)
+            if h is None:
+                h = self.hists[name] = Histogram()
+            h.observe(seconds, status)
+
+    def request(self, service: str, status: Any, seconds: float, op: str = "") -> None:
+        """One HTTP call: latency per service (and per service:op) with its status code."""
+        with self._lock:
+            for name in ((service, f"{service}:{op}") if op else (service,)):
+                h = self.hists.get(name)
+                if h is None:
+                    h = self.hists[name] = Histogram()
+                h.observe(seconds, status)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.time()
+        with self._lock:
+            st = self.stages.setdefault(name, {"runs": 0, "seconds": 0.0})
+            st["running_since"] = t0
+        for hook in self.stage_hooks:
+            hook(name, True)
+        try:
+            yield
+        finally:
+            for hook in self.stage_hooks:
+                hook(name, False)
+            with self._lock:
+                st["runs"] += 1
+                st["seconds"] += time.time() - t0
+                st.pop("running_since", None)
+
+    def progress(self, **fields: Any) -> None:
+        with self._lock:
+            self._progress.update(fields)
+
+    def service(self, **fields: Any) -> None:
+        """Process-level fields that survive start_run (e.g. the scheduler's next run)."""
+        with self._lock:
+            self._service.update(fields)
+
+    # ---------- runs ----------
+    def start_run(self, kind: str) -> None:
+        with self._lock:
+            self._reset(kind)
+
+    def finish_run(self, **summary: Any) -> Optional[str]:
+        """Write the JSON run report (if E2T_REPORT_DIR is set); returns its path."""
+        report = self.snapshot()
+        report.pop("service", None)
+        report.pop("last_runs", None)
+        report["summary"] = summary
+        path = None
+        if REPORT_DIR:
+            try:
+                os.makedirs(REPORT_DIR, exist_ok=True)
+                stamp = datetime.fromtimestamp(self.run_started, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+                path = os.path.join(REPORT_DIR, f"{self.kind}-{stamp}.json")
+                with open(path, "w") as f:
+                    json.dump(report, f, indent=2, default=str)
+                print(f"[METRICS] Run report → {path}")
+                self._prune_reports()
+            except Exception as e:
+                print(f"[METRICS] Could not write run report: {str(e)[:160]}")
+                path = None
+        with self._lock:
+            self.last_runs[self.kind] = {"started_at": report["started_at"], "elapsed_sec": report["elapsed_sec"],
+                                         "summary": summary, "report": path}
+        return path
+
+    def _prune_reports(self) -> None:
+        # names sort by start time (UTC stamp), so the oldest come first
+        if REPORT_KEEP <= 0:
+            return
+        prefix = f"{self.kind}-"
+        names = sorted(n for n in os.listdir(REPORT_DIR) if n.startswith(prefix) and n.endswith(".json"))
+        for name in names[:-REPORT_KEEP]:
+            try:
+                os.remove(os.path.join(REPORT_DIR, name))
+            except OSError:
+                pass
+
+    # ---------- reading ----------
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            stages = {}
+            for name, st in self.stages.items():
+                secs = st["seconds"] + (now - st["running_since"] if "running_since" in st else 0.0)
+                stages[name] = {"runs": st["runs"], "seconds": round(secs, 3), "running": "running_since" in st}
+            return {
+                "kind": self.kind,
+                "started_at": datetime.fromtimestamp(self.run_started, timezone.utc).isoformat(),
+                "elapsed_sec": round(now - self.run_started, 3),
+                "progress": dict(self._progress),
+                "counters": dict(sorted(self.counters.items())),
+                "stages": stages,
+                "latency": {name: h.summary() for name, h in sorted(self.hists.items())},
+                "service": dict(self._service),
+                "last_runs": {k: dict(v) for k, v in self.last_runs.items()},
+            }
+
+    def prometheus(self) -> str:
+        snap = self.snapshot()
+        lines: List[str] = []
+        kind = _label(snap["kind"])
+        lines.append(f'e2t_run_elapsed_seconds{{kind="{kind}"}} {snap["elapsed_sec"]}')
+        for name, v in snap["counters"].items():
+            lines.append(f'e2t_{_metric(name)}_total{{kind="{kind}"}} {v}')
+        for name, v in snap["progress"].items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                lines.append(f'e2t_progress_{_metric(name)}{{kind="{kind}"}} {v}')
+        for name, st in snap["stages"].items():
+            lines.append(f'e2t_stage_seconds{{kind="{kind}",stage="{_label(name)}"}} {st["seconds"]}')
+        with self._lock:
+            hists = [(n, h.counts[:], h.n, h.total, dict(h.status)) for n, h in self.hists.items()]
+        for name, counts, n, total, status in sorted(hists):
+            lbl = f'kind="{kind}",series="{_label(name)}"'
+            acc = 0
+            for bound, c in zip(BUCKETS, counts):
+                acc += c
+                lines.append(f'e2t_request_seconds_bucket{{{lbl},le="{bound:.4f}"}} {acc}')
+            lines.append(f'e2t_request_seconds_bucket{{{lbl},le="+Inf"}} {n}')
+            lines.append(f"e2t_request_seconds_sum{{{lbl}}} {total:.6f}")
+            lines.append(f"e2t_request_seconds_count{{{lbl}}} {n}")
+            for code, c in sorted(status.items()):
+                lines.append(f'e2t_requests_total{{{lbl},status="{_label(code)}"}} {c}')
+        return "\n".join(lines) + "\n"
+
+
+def _metric(name: str) -> str:
+    return "".join(ch if ch.isalnum() else "_" for ch in name).lower()
+
+def _label(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+METRICS = Metrics()
+
+
+# ---------- optional HTTP endpoint ----------
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *a):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body, ctype = METRICS.prometheus().encode(), "text/plain; version=0.0.4"
+        elif path in ("/progress", "/"):
+            body, ctype = json.dumps(METRICS.snapshot(), default=str).encode(), "application/json"
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+def serve_metrics(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Start the /metrics + /progress endpoint once per process (no-op when port is 0)."""
+    global _server
+    if _server is not None or not port:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _Handler)
+        _server.daemon_threads = True
+    except OSError as e:
+        print(f"[METRICS] Could not listen on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[METRICS] Serving /metrics and /progress on http://{host}:{port}")
+    return _server
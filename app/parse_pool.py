@@ -0,0 +1,123 @@
+# app/parse_pool.py  (PARSE PROCESS POOL)
+"""
+Moves CPU-bound response parsing off the fetch threads into worker processes.
+
+Fetchers hand over (key, raw body) pairs with submit(). They are grouped into
+batches (by count and bytes) so each round trip to a process carries many
+bodies and returns many small results, which keeps pickling / IPC overhead
+low. At most 2 x procs batches are in flight; submit() blocks beyond that, so
+a slow parser side throttles the fetchers instead of buffering bodies.
+
+Results are delivered one by one to on_result(item) on a single delivery
+thread. If a whole batch fails (e.g. a parser process died), on_error(key,
+exc) is called for every key in it.
+"""
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, List, Sequence, Tuple
+
+Item = Tuple[str, bytes]
+
+_END = object()
+
+
+def _context():
+    # not fork: the parent runs fetch / writer threads whose locks a forked child would inherit
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class ParsePool:
+    def __init__(self, fn: Callable[..., List[Any]], on_result: Callable[[Any], None],
+                 on_error: Callable[[str, BaseException], None], *, procs: int,
+                 batch: int = 32, max_bytes: int = 8 << 20, args: Sequence[Any] = ()):
+        self.fn = fn
+        self.args = tuple(args)
+        self.on_result = on_result
+        self.on_error = on_error
+        self.procs = max(1, procs)
+        self.batch = max(1, batch)
+        self.max_bytes = max_bytes
+        self.stats = {"batches": 0, "items": 0, "failed_batches": 0}
+        self._ex = ProcessPoolExecutor(max_workers=self.procs, mp_context=_context())
+        self._slots = threading.BoundedSemaphore(self.procs * 2)
+        self._buf: List[Item] = []
+        self._buf_bytes = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition()
+        self._in_flight = 0
+        self._done: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._deliver, name="parse-deliver", daemon=True)
+        self._thread.start()
+
+    # ---------- producer side ----------
+    def submit(self, key: str, body: bytes) -> None:
+        with self._lock:
+            self._buf.append((key, body))
+            self._buf_bytes += len(body)
+            if len(self._buf) < self.batch and self._buf_bytes < self.max_bytes:
+                return
+            items, self._buf, self._buf_bytes = self._buf, [], 0
+        self._send(items)
+
+    def _send(self, items: List[Item]) -> None:
+        self._slots.acquire()
+        with self._idle:
+            self._in_flight += 1
+        fut = self._ex.submit(self.fn, items, *self.args)
+        fut.add_done_callback(lambda f, items=items: self._done.put((items, f)))
+
+    def drain(self) -> None:
+        """Send the partial batch and wait until every submitted body has been delivered."""
+        with self._lock:
+            items, self._buf, self._buf_bytes = self._buf, [], 0
+        if items:
+            self._send(items)
+        with self._idle:
+            self._idle.wait_for(lambda: self._in_flight == 0)
+
+    def close(self) -> dict:
+        self.drain()
+        self._done.put(_END)
+        self._thread.join()
+        self._ex.shutdown()
+        return self.stats
+
+    def __enter__(self) -> "ParsePool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ---------- delivery ----------
+    def _deliver(self) -> None:
+        while True:
+            got = self._done.get()
+            if got is _END:
+                return
+            items, fut = got
+            try:
+                self._deliver_one(items, fut)
+            except Exception as e:   # keep delivering; drain() must not hang on a bad callback
+                print(f"[PARSE] delivery error: {str(e)[:160]}")
+            finally:
+                self._slots.release()
+                with self._idle:
+                    self._in_flight -= 1
+                    self._idle.notify_all()
+
+    def _deliver_one(self, items: List[Item], fut: Future) -> None:
+        self.stats["batches"] += 1
+        try:
+            results = fut.result()
+        except BaseException as e:
+            self.stats["failed_batches"] += 1
+            print(f"[PARSE] batch of {len(items)} failed: {(str(e) or type(e).__name__)[:160]}")
+            for key, _ in items:
+                self.on_error(key, e)
+            return
+        self.stats["items"] += len(results)
+        for res in results:
+            self.on_result(res)
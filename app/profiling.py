@@ -0,0 +1,231 @@
+# app/profiling.py  (OPT-IN RUN PROFILING)
+"""
+Env-activated profiling of one worker / CRM run, written to a directory per run.
+
+    E2T_PROFILE=cpu,mem,timeline   (or "all"; empty = off, nothing is installed)
+
+cpu       one cProfile per thread (threads started during the run included):
+          cpu.prof (all threads merged, for pstats / snakeviz), cpu-<thread>.prof
+          per thread group (MainThread, e2t-planner, e2t-writer, ThreadPoolExecutor …)
+          and cpu.txt with the top functions by own and cumulative time.
+mem       tracemalloc from run start: mem.txt with the top allocators at the end,
+          growth since the start, and traced memory entering / leaving each stage.
+timeline  a sampler thread reads every thread's stack every E2T_PROFILE_SAMPLE_MS:
+          timeline.jsonl (one line per second: running stages, busiest functions per
+          thread) and stacks.collapsed (wall-clock flame graph input, I/O waits included).
+
+Stages are the METRICS.stage() names (plan, fetch, retry, write, aggregate, snapshot, sync).
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .config import getenv_float, getenv_int
+from .metrics import METRICS
+
+PROFILE        = {x.strip().lower() for x in os.environ.get("E2T_PROFILE", "").split(",") if x.strip()}
+PROFILE_DIR    = os.environ.get("E2T_PROFILE_DIR", ".cache/profiles")
+PROFILE_TOP    = getenv_int("E2T_PROFILE_TOP", 30)                     # rows in cpu.txt / mem.txt
+SAMPLE_MS      = getenv_float("E2T_PROFILE_SAMPLE_MS", 20)             # timeline sampling interval
+TRACE_FRAMES   = getenv_int("E2T_PROFILE_TRACE_FRAMES", 1)             # tracemalloc frames per allocation
+if "all" in PROFILE:
+    PROFILE = {"cpu", "mem", "timeline"}
+
+
+def _thread_group(name: str) -> str:
+    # "ThreadPoolExecutor-0_3" → "ThreadPoolExecutor", "Thread-4 (_reader)" → "Thread", "e2t-writer" stays
+    return re.sub(r"[-_]\d+(_\d+)?( \(.*\))?$", "", name) or "thread"
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RunProfiler:
+    def __init__(self, kind: str, modes=None, out_dir: str = PROFILE_DIR):
+        self.modes = set(PROFILE if modes is None else modes)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self.dir = os.path.join(out_dir, f"{kind}-{stamp}")
+        self._lock = threading.Lock()
+        self._profiles: List[Tuple[str, cProfile.Profile]] = []
+        self._main: Optional[cProfile.Profile] = None
+        self._mem_start: Optional[tracemalloc.Snapshot] = None
+        self._mem_stages: Dict[str, Dict[str, int]] = {}
+        self._stage_enter: Dict[Tuple[str, int], int] = {}
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ---------- cpu ----------
+    def _bootstrap(self, frame, event, arg):
+        # first profile event in a new thread: give it its own profiler (replaces this hook)
+        prof = cProfile.Profile()
+        with self._lock:
+            self._profiles.append((threading.current_thread().name, prof))
+        prof.enable()
+
+    def _stop_cpu(self) -> None:
+        threading.setprofile(None)
+        self._main.disable()
+        merged: Optional[pstats.Stats] = None
+        groups: Dict[str, pstats.Stats] = {}
+        with self._lock:
+            profiles = list(self._profiles)
+        for name, prof in profiles:
+            try:
+                st = pstats.Stats(prof)
+            except TypeError:
+                continue   # thread never made a call while profiled
+            g = _thread_group(name)
+            if g in groups:
+                groups[g].add(st)
+            else:
+                groups[g] = st
+            if merged is None:
+                merged = pstats.Stats(prof)
+            else:
+                merged.add(st)
+        sys.setprofile(None)   # pstats.Stats(prof) disables profiling in the calling thread only
+        if merged is None:
+            return
+        merged.dump_stats(os.path.join(self.dir, "cpu.prof"))
+        for g, st in groups.items():
+            st.dump_stats(os.path.join(self.dir, f"cpu-{g}.prof"))
+        buf = io.StringIO()
+        for key in ("tottime", "cumulative"):
+            buf.write(f"===== all threads, by {key} =====\n")
+            pstats.Stats(os.path.join(self.dir, "cpu.prof"), stream=buf).sort_stats(key).print_stats(PROFILE_TOP)
+        for g in sorted(groups):
+            buf.write(f"===== {g}, by tottime =====\n")
+            pstats.Stats(os.path.join(self.dir, f"cpu-{g}.prof"), stream=buf).sort_stats("tottime").print_stats(PROFILE_TOP)
+        with open(os.path.join(self.dir, "cpu.txt"), "w") as f:
+            f.write(buf.getvalue())
+
+    # ---------- mem ----------
+    def _on_stage(self, name: str, entering: bool) -> None:
+        cur, peak = tracemalloc.get_traced_memory()
+        key = (name, threading.get_ident())
+        with self._lock:
+            st = self._mem_stages.setdefault(name, {"runs": 0, "delta": 0, "max_current": 0, "peak": 0})
+            st["max_current"] = max(st["max_current"], cur)
+            st["peak"] = max(st["peak"], peak)
+            if entering:
+                self._stage_enter[key] = cur
+            else:
+                st["runs"] += 1
+                st["delta"] += cur - self._stage_enter.pop(key, cur)
+
+    def _stop_mem(self) -> None:
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        cur, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        mb = lambda b: f"{b / 2**20:10.2f} MB"
+        lines = [f"traced now {mb(cur)} | peak {mb(peak)}", "",
+                 f"===== top {PROFILE_TOP} allocators still live at the end =====", ""]
+        group = "traceback" if TRACE_FRAMES > 1 else "lineno"
+        for stat in snap.statistics(group)[:PROFILE_TOP]:
+            lines.append(f"{mb(stat.size)} {stat.count:>10,} blocks  {stat.traceback.format()[-1].strip()}")
+        lines += ["", f"===== top {PROFILE_TOP} growth since run start =====", ""]
+        for stat in snap.compare_to(self._mem_start, group)[:PROFILE_TOP]:
+            lines.append(f"{mb(stat.size_diff)} {stat.count_diff:>+10,} blocks  {stat.traceback.format()[-1].strip()}")
+        lines += ["", "===== traced memory per stage (delta = leaving − entering, summed over runs) =====", ""]
+        for name, st in self._mem_stages.items():
+            lines.append(f"{name:<12} runs={st['runs']:<6} delta={mb(st['delta'])} "
+                         f"max={mb(st['max_current'])} peak={mb(st['peak'])}")
+        with open(os.path.join(self.dir, "mem.txt"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    # ---------- timeline ----------
+    def _sample_loop(self) -> None:
+        me = threading.get_ident()
+        interval = max(SAMPLE_MS, 1.0) / 1e3
+        t0 = time.perf_counter()
+        stacks: Counter = Counter()
+        second, per_thread = 0, defaultdict(Counter)
+        with open(os.path.join(self.dir, "timeline.jsonl"), "w") as out:
+            def flush(sec: int) -> None:
+                stages = sorted(n for n, st in METRICS.snapshot()["stages"].items() if st["running"])
+                out.write(json.dumps({"t": sec, "stages": stages, "threads": {
+                    name: dict(c.most_common(3)) for name, c in sorted(per_thread.items())}}) + "\n")
+                per_thread.clear()
+
+            while not self._stop.wait(interval):
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    name = names.get(ident, str(ident))
+                    per_thread[name][_frame_label(frame.f_code)] += 1
+                    path = []
+                    while frame is not None:
+                        path.append(_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    stacks[_thread_group(name) + ";" + ";".join(reversed(path))] += 1
+                sec = int(time.perf_counter() - t0)
+                if sec != second:
+                    flush(second)
+                    second = sec
+            flush(second)
+        with open(os.path.join(self.dir, "stacks.collapsed"), "w") as f:
+            for stack, n in stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+    # ---------- run ----------
+    def start(self) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        print(f"[PROFILE] {','.join(sorted(self.modes))} → {self.dir}")
+        if "mem" in self.modes:
+            tracemalloc.start(max(TRACE_FRAMES, 1))
+            self._mem_start = tracemalloc.take_snapshot()
+            METRICS.stage_hooks.append(self._on_stage)
+        if "timeline" in self.modes:
+            self._sampler = threading.Thread(target=self._sample_loop, name="e2t-profiler", daemon=True)
+            self._sampler.start()
+        if "cpu" in self.modes:
+            self._main = cProfile.Profile()
+            self._profiles.append((threading.current_thread().name, self._main))
+            threading.setprofile(self._bootstrap)
+            self._main.enable()
+
+    def stop(self) -> None:
+        for mode, step in (("cpu", self._stop_cpu), ("timeline", self._stop_timeline), ("mem", self._stop_mem)):
+            if mode not in self.modes:
+                continue
+            try:
+                step()
+            except Exception as e:
+                print(f"[PROFILE] {mode} output failed: {str(e)[:160]}")
+        if self._on_stage in METRICS.stage_hooks:
+            METRICS.stage_hooks.remove(self._on_stage)
+        print(f"[PROFILE] Wrote {', '.join(sorted(os.listdir(self.dir)))} to {self.dir}")
+
+    def _stop_timeline(self) -> None:
+        self._stop.set()
+        self._sampler.join()
+
+
+@contextmanager
+def profile_run(kind: str) -> Iterator[Optional[RunProfiler]]:
+    """Profile the enclosed run when E2T_PROFILE is set; a plain pass-through otherwise."""
+    if not PROFILE:
+        yield None
+        return
+    prof = RunProfiler(kind)
+    prof.start()
+    try:
+        yield prof
+    finally:
+        prof.stop()
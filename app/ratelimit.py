@@ -0,0 +1,111 @@
+# app/ratelimit.py  (ADAPTIVE TOKEN BUCKET)
+"""
+Shared request-rate limiter for Sirix.
+
+Every caller takes a token before sending a request and reports the response
+back. The refill rate grows additively while calls succeed and is cut
+multiplicatively on 429/503 (or any response carrying Retry-After), so the
+workers settle at the highest rate Sirix accepts. Thread-safe; the async
+engine uses acquire_async() on the same bucket.
+"""
+import time
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional
+
+from .config import SIRIX_RATE_START, SIRIX_RATE_MIN, SIRIX_RATE_MAX, SIRIX_RATE_BURST
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After is either delta-seconds or an HTTP date; returns seconds to wait."""
+    if not value:
+        return None
+    v = str(value).strip()
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(v)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+class AdaptiveTokenBucket:
+    def __init__(self, rate: float, *, min_rate: float, max_rate: float, burst: float = 10.0,
+                 increase: float = 1.0, decrease: float = 0.5, cooldown: float = 1.0):
+        self.min_rate = max(0.01, min_rate)
+        self.max_rate = max(self.min_rate, max_rate)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.burst = max(1.0, burst)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.throttled = 0
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._last_cut = 0.0
+        self._ok_since_raise = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take one token (possibly on credit) and return how long the caller must wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1.0
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def acquire(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._ok_since_raise += 1
+            # roughly one additive step per second's worth of successful calls
+            if self._ok_since_raise >= self.rate:
+                self._ok_since_raise = 0
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            self._ok_since_raise = 0
+            # a burst of in-flight 429s should only count as one congestion signal
+            if now - self._last_cut >= self.cooldown:
+                self._last_cut = now
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+    def feedback(self, status: int, retry_after: Optional[str] = None) -> None:
+        """Report one HTTP response. Other statuses (4xx, 500/502/504) leave the rate alone;
+        network errors never reach here, they are retried by the worker without a rate signal."""
+        ra = parse_retry_after(retry_after)
+        if status in THROTTLE_STATUSES or ra is not None:
+            self.on_throttle(ra)
+        elif 200 <= status < 300:
+            self.on_success()
+
+
+SIRIX_LIMITER = AdaptiveTokenBucket(
+    SIRIX_RATE_START, min_rate=SIRIX_RATE_MIN, max_rate=SIRIX_RATE_MAX, burst=SIRIX_RATE_BURST,
+)
@@ -0,0 +1,66 @@
+# app/refresh.py  (INCREMENTAL REFRESH PLANNER)
+"""
+Decides which known accounts are worth re-fetching from Sirix.
+
+Tiers, in fetch order:
+  0  not in e2t_active yet (never fetched)
+  1  hot: created in the CRM skim recently, or had an Initial Balance recently,
+     and not checked within the hot age
+  2  stale: not checked within the max age
+Everything else keeps its stored plan. Within a tier the longest-unchecked
+accounts go first, so a capped run still makes progress on the oldest data.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple, Callable
+
+TIER_NEW, TIER_HOT, TIER_STALE = 0, 1, 2
+_EPOCH = datetime.min
+
+
+def plan_refresh(todo: List[str],
+                 existing: Dict[str, Dict[str, Any]],
+                 crm_loaded_at: Dict[str, Optional[datetime]],
+                 *, now: datetime, parse_ts: Callable[[Any], Optional[datetime]],
+                 max_age: timedelta, hot_age: timedelta, hot_window: timedelta,
+                 limit: int = 0) -> Tuple[List[str], Dict[str, int]]:
+    """
+    todo           : unique account_ids eligible for processing (CRM minus excluded)
+    existing       : account_id -> {"last_checked_at", "last_tx_time"} from e2t_active
+    crm_loaded_at  : account_id -> src_loaded_at from the CRM skim (first time we saw it)
+    Returns (ids ordered by priority, per-tier counts incl. "fresh" = skipped).
+    """
+    stats = {"new": 0, "hot": 0, "stale": 0, "fresh": 0, "capped": 0}
+    ranked: List[Tuple[int, datetime, str]] = []
+    naive_now = now.replace(tzinfo=None)
+
+    for aid in todo:
+        meta = existing.get(aid)
+        if meta is None:
+            ranked.append((TIER_NEW, _EPOCH, aid))
+            stats["new"] += 1
+            continue
+
+        checked = parse_ts(meta.get("last_checked_at"))
+        checked_n = checked.replace(tzinfo=None) if checked else _EPOCH
+        age = naive_now - checked_n
+
+        created = crm_loaded_at.get(aid)
+        last_tx = parse_ts(meta.get("last_tx_time"))
+        hot = (created is not None and now - created <= hot_window) or \
+              (last_tx is not None and now - last_tx <= hot_window)
+
+        if hot and age >= hot_age:
+            ranked.append((TIER_HOT, checked_n, aid))
+            stats["hot"] += 1
+        elif age >= max_age:
+            ranked.append((TIER_STALE, checked_n, aid))
+            stats["stale"] += 1
+        else:
+            stats["fresh"] += 1
+
+    ranked.sort(key=lambda x: (x[0], x[1]))
+    ids = [aid for _, _, aid in ranked]
+    if limit and len(ids) > limit:
+        stats["capped"] = len(ids) - limit
+        ids = ids[:limit]
+    return ids, stats
@@ -1,10 +1,46 @@
 # app/scheduler.py
-import os, time, requests
+"""
+Runs the pipeline jobs on cron schedules (Europe/London wall clock by default):
+
+    nightly       E2T_SCHED_NIGHTLY      "0 0 * * *"      CRM sync (RUN_CRM) → worker
+    incremental   E2T_SCHED_INCREMENTAL  ""  (off)        worker in incremental refresh mode, e.g. "30 7-22 * * *"
+    crm_delta     E2T_SCHED_CRM_DELTA    ""  (off)        CRM CDC delta (RUN_CRM) → worker (new accounts)
+
+An empty schedule disables the job. Each job is an ordered list of steps run one
+after the other; a failed step skips the rest. Steps never overlap: each one
+consumes the previous one's output (the worker plans from the CRM mirror the
+sync just wrote) and each starts its own METRICS run.
+
+Jobs never overlap: one job runs at a time in this process, and a file lock
+(E2T_SCHED_LOCK_PATH) keeps a second scheduler on the same host from running
+alongside. A job whose slot passes while another job runs starts right after
+it, once; a job that overruns its own next slot skips it (logged and counted).
+
+When each job last ran with every step ok is kept in e2t_sync_state (Q12), so
+after a restart a missed or failed slot is caught up once (E2T_SCHED_CATCH_UP)
+instead of being lost or repeated; nightly also runs at start when it has no
+record yet or the run journal holds an interrupted run. Each firing is delayed
+by up to E2T_SCHED_JITTER_SEC.
+
+The Netlify build hook (E2T_NOTIFY_NETLIFY) is fired by the worker itself when a
+run queued accounts, so it is not a separate step here.
+"""
+import os, time, random, threading
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
+from typing import Any, Callable, Dict, List, Optional
 
-from .worker import run_once
-from .config import TZ_LABEL, E2T_NOTIFY_NETLIFY, NETLIFY_BUILD_HOOK_URL
+from .worker import run_once, REFRESH_MODE, REFRESH_MODES, JOURNAL_ENABLED, JOURNAL_PATH
+from .config import TZ_LABEL, TABLE_SYNC_STATE, getenv_float
+from .cron import Cron
+from .journal import RunJournal
+from .metrics import METRICS, serve_metrics
+from .supa import pg_select, upsert_many
+
+try:
+    import fcntl
+except ImportError:   # Windows: in-process exclusion only
+    fcntl = None
 
 # Optional: import CRM loader
 try:
@@ -13,65 +49,216 @@ except Exception:
     crm_sync = None
 
 RUN_CRM = os.environ.get("RUN_CRM", "false").lower() in ("1","true","yes","y")
-LONDON = ZoneInfo("Europe/London")
+# Boot run picks up an interrupted run from the journal (e.g. after a dyno restart)
+RESUME_ON_BOOT = os.environ.get("E2T_RESUME_ON_BOOT", "true").lower() in ("1","true","yes","y")
 
-def next_midnight_london(now_utc: datetime) -> datetime:
-    now_ldn = now_utc.astimezone(LONDON)
-    next_day = now_ldn.date() + timedelta(days=1)
-    target_ldn = datetime.combine(next_day, datetime.min.time(), tzinfo=LONDON)
-    return target_ldn.astimezone(timezone.utc)
+SCHED_TZ          = os.environ.get("E2T_SCHED_TZ", "Europe/London")
+SCHED_NIGHTLY     = os.environ.get("E2T_SCHED_NIGHTLY", "0 0 * * *").strip()
+SCHED_NIGHTLY_MODE = os.environ.get("E2T_SCHED_NIGHTLY_MODE", "").strip().lower() or REFRESH_MODE
+if SCHED_NIGHTLY_MODE not in REFRESH_MODES:
+    raise SystemExit(f"[FATAL] E2T_SCHED_NIGHTLY_MODE={SCHED_NIGHTLY_MODE!r} is not one of: {', '.join(REFRESH_MODES)}")
+SCHED_INCREMENTAL = os.environ.get("E2T_SCHED_INCREMENTAL", "").strip()        # e.g. "30 7-22 * * *"
+SCHED_CRM_DELTA   = os.environ.get("E2T_SCHED_CRM_DELTA", "").strip()        # needs CRM_CDC_* set up
+JITTER_SEC        = getenv_float("E2T_SCHED_JITTER_SEC", 60)                # random delay added to each firing
+CATCH_UP          = os.environ.get("E2T_SCHED_CATCH_UP", "true").lower() in ("1","true","yes","y")
+RUN_ON_BOOT       = os.environ.get("E2T_SCHED_RUN_ON_BOOT", "false").lower() in ("1","true","yes","y")  # nightly at every start
+LOCK_PATH         = os.environ.get("E2T_SCHED_LOCK_PATH", ".cache/scheduler.lock")
+STATE_KIND        = "schedule"                                                # e2t_sync_state.kind of job rows
 
-def trigger_netlify():
-    if E2T_NOTIFY_NETLIFY and NETLIFY_BUILD_HOOK_URL:
-        try:
-            requests.post(NETLIFY_BUILD_HOOK_URL, timeout=10)
-            print("[SCHED] Triggered Netlify build hook.")
-        except Exception as e:
-            print(f"[SCHED] Netlify hook failed: {e}")
+# ---------- jobs ----------
+@dataclass
+class Step:
+    name: str
+    fn: Callable[[], Any]
 
-def main():
-    print(f"[SCHED] Starting daily scheduler. Local TZ={TZ_LABEL} (Europe/London used for timing).")
+@dataclass
+class Job:
+    name: str
+    cron: Cron
+    steps: List[Step]
+    boot: bool = False                     # run at start when there is no record of a previous run
+    next_slot: Optional[datetime] = None   # scheduled time (UTC) of the next firing
+    fire_at: Optional[datetime] = None     # next_slot + jitter, or now for a catch-up
+
+_resume_pending = RESUME_ON_BOOT   # only the first worker step after start resumes a journaled run
+
+def _worker_step(mode: str) -> Callable[[], Any]:
+    def run():
+        global _resume_pending
+        resume, _resume_pending = _resume_pending, False
+        run_once(resume=resume, refresh_mode=mode)
+    return run
+
+def build_jobs() -> List[Job]:
+    crm = RUN_CRM and crm_sync is not None
+    if not crm:
+        print("[SCHED] RUN_CRM is false or CRM loader unavailable → jobs run without the CRM refresh.")
+    jobs = []
+    if SCHED_NIGHTLY:
+        steps = [Step("crm_sync", crm_sync)] if crm else []
+        steps += [Step("worker", _worker_step(SCHED_NIGHTLY_MODE))]   # the worker fires the Netlify hook itself
+        jobs.append(Job("nightly", Cron(SCHED_NIGHTLY, SCHED_TZ), steps, boot=True))
+    if SCHED_INCREMENTAL:
+        jobs.append(Job("incremental", Cron(SCHED_INCREMENTAL, SCHED_TZ), [Step("worker", _worker_step("incremental"))]))
+    if SCHED_CRM_DELTA and crm:
+        jobs.append(Job("crm_delta", Cron(SCHED_CRM_DELTA, SCHED_TZ), [
+            Step("crm_sync", lambda: crm_sync(cdc=True)),
+            Step("worker", _worker_step("skip")),
+        ]))
+    return jobs
 
-    # Boot run
-    if RUN_CRM and crm_sync:
-        print("[SCHED] CRM → lv_tpaccount_skim refresh starting…")
+def run_steps(job: Job) -> Dict[str, str]:
+    """Run a job's steps in order; returns {step: ok | failed | skipped}."""
+    status: Dict[str, str] = {}
+    for st in job.steps:
+        if any(v != "ok" for v in status.values()):
+            status[st.name] = "skipped"
+            continue
+        print(f"[SCHED] {job.name}/{st.name} starting…")
         try:
-            crm_sync()
+            st.fn()
+            status[st.name] = "ok"
         except Exception as e:
-            print(f"[SCHED] CRM refresh FAILED: {e}")
-    else:
-        print("[SCHED] RUN_CRM is false or CRM loader unavailable → skipping CRM refresh.")
+            print(f"[SCHED] {job.name}/{st.name} FAILED: {e}")
+            METRICS.service(last_error=f"{job.name}/{st.name}: {str(e)[:200]}")
+            status[st.name] = "failed"
+    return status
 
+
+# ---------- state (per job: start of its last completed run; every slot up to it is done) ----------
+def load_covered(job: str) -> Optional[datetime]:
     try:
-        print("[SCHED] Boot run starting now.")
-        run_once()
-        trigger_netlify()
+        rows = pg_select(TABLE_SYNC_STATE, "hwm,kind", filters={"name": f"eq.schedule:{job}"})
     except Exception as e:
-        print(f"[SCHED] Boot run error: {e}")
+        print(f"[SCHED] {TABLE_SYNC_STATE} read failed ({str(e)[:120]}) → no catch-up for {job}")
+        return None
+    if not rows or rows[0].get("kind") != STATE_KIND or not rows[0].get("hwm"):
+        return None
+    return datetime.fromisoformat(rows[0]["hwm"])
 
-    while True:
-        now_utc = datetime.now(timezone.utc)
-        target_utc = next_midnight_london(now_utc)
-        secs = max(5, int((target_utc - now_utc).total_seconds()))
-        hh = secs // 3600; mm = (secs % 3600) // 60; ss = secs % 60
-        print(f"[SCHED] Sleeping until next London midnight: {target_utc.isoformat()} (in {hh:02d}:{mm:02d}:{ss:02d}).")
-        time.sleep(secs)
-
-        if RUN_CRM and crm_sync:
-            print("[SCHED] CRM → lv_tpaccount_skim refresh starting…")
+def save_covered(job: str, until: datetime) -> None:
+    row = {"name": f"schedule:{job}", "hwm": until.isoformat(), "kind": STATE_KIND, "rows_synced": None,
+           "updated_at": datetime.now(timezone.utc).isoformat()}
+    try:
+        if not all(res.ok for res in upsert_many(TABLE_SYNC_STATE, [row], on_conflict="name")):
+            print(f"[SCHED] Could not record the {job} run (a restart may catch it up again)")
+    except Exception as e:
+        print(f"[SCHED] Could not record the {job} run: {str(e)[:120]}")
+
+
+# ---------- run lock ----------
+class RunLock:
+    """Exclusive lock across scheduler processes on this host (flock), plus in-process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.Lock()
+        self._fh = None
+
+    def __enter__(self):
+        self._local.acquire()
+        if fcntl is None:
+            return self
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._fh = open(self.path, "a+")
+        waited = False
+        while True:
             try:
-                crm_sync()
-            except Exception as e:
-                print(f"[SCHED] CRM refresh FAILED: {e}")
-        else:
-            print("[SCHED] RUN_CRM is false or CRM loader unavailable → skipping CRM refresh.")
+                fcntl.flock(self._fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return self
+            except BlockingIOError:
+                if not waited:
+                    print(f"[SCHED] Another run holds {self.path} → waiting for it to finish")
+                    waited = True
+                time.sleep(30)
 
-        try:
-            print("[SCHED] Midnight run starting.")
-            run_once()
-            trigger_netlify()
-        except Exception as e:
-            print(f"[SCHED] Midnight run error: {e}")
+    def __exit__(self, *exc):
+        if self._fh is not None:
+            fcntl.flock(self._fh, fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
+        self._local.release()
+
+
+# ---------- loop ----------
+def _jitter() -> timedelta:
+    return timedelta(seconds=random.uniform(0, max(JITTER_SEC, 0.0)))
+
+def plan_first_runs(jobs: List[Job], now: datetime) -> None:
+    unfinished = None
+    if JOURNAL_ENABLED and RESUME_ON_BOOT:
+        j = RunJournal(JOURNAL_PATH)
+        unfinished = j.unfinished()
+        j.close()
+    for job in jobs:
+        covered = load_covered(job.name)
+        nxt = job.cron.next_after(covered or now)
+        job.next_slot, job.fire_at = nxt, nxt + _jitter()
+        if job.boot and (RUN_ON_BOOT or unfinished or covered is None):
+            why = ("E2T_SCHED_RUN_ON_BOOT" if RUN_ON_BOOT else
+                   f"unfinished run {unfinished[0]} in the journal" if unfinished else "no previous run recorded")
+            print(f"[SCHED] {job.name}: running at start ({why})")
+            job.next_slot, job.fire_at = now, now
+        elif nxt <= now:
+            if CATCH_UP:
+                print(f"[SCHED] {job.name}: missed slot {nxt.isoformat()} → catching up now")
+                job.fire_at = now
+            else:
+                job.next_slot = job.cron.next_after(now)
+                job.fire_at = job.next_slot + _jitter()
+
+def main():
+    print(f"[SCHED] Starting scheduler. Local TZ={TZ_LABEL} ({SCHED_TZ} used for timing).")
+    serve_metrics()
+    METRICS.service(scheduler_started_at=datetime.now(timezone.utc).isoformat())
+
+    jobs = build_jobs()
+    if not jobs:
+        raise SystemExit("[FATAL] No scheduled jobs (set E2T_SCHED_NIGHTLY / E2T_SCHED_INCREMENTAL / E2T_SCHED_CRM_DELTA)")
+    for job in jobs:
+        print(f"[SCHED] Job {job.name:<12} {job.cron.expr:<16} steps: " + " → ".join(st.name for st in job.steps))
+    plan_first_runs(jobs, datetime.now(timezone.utc))
+    lock = RunLock(LOCK_PATH)
+    overruns: Dict[str, int] = {}
+
+    while True:
+        job = min(jobs, key=lambda j: j.fire_at)   # ties: earlier in the list (nightly first)
+        now = datetime.now(timezone.utc)
+        if job.fire_at > now:
+            secs = int((job.fire_at - now).total_seconds())
+            hh = secs // 3600; mm = (secs % 3600) // 60; ss = secs % 60
+            print(f"[SCHED] Next: {job.name} at {job.fire_at.isoformat()} (in {hh:02d}:{mm:02d}:{ss:02d}).")
+            METRICS.service(state="sleeping", next_job=job.name, next_run_at=job.fire_at.isoformat())
+            while datetime.now(timezone.utc) < job.fire_at:   # short naps: robust to clock jumps
+                time.sleep(min(60.0, max(0.5, (job.fire_at - datetime.now(timezone.utc)).total_seconds())))
+
+        slot = job.next_slot
+        with lock:
+            started = datetime.now(timezone.utc)
+            METRICS.service(state=job.name)
+            status = run_steps(job)
+            elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+        ok = all(v == "ok" for v in status.values())
+        print(f"[SCHED] {job.name} {'done' if ok else 'finished with errors'} in {elapsed / 60:0.1f} min: "
+              + ", ".join(f"{k}={v}" for k, v in status.items()))
+        METRICS.service(**{f"last_{job.name}": {"slot": slot.isoformat(), "elapsed_sec": round(elapsed, 1),
+                                                "steps": status}})
+        if ok:
+            save_covered(job.name, max(slot, started))
+        else:   # the slot stays uncovered: a restart catches it up
+            print(f"[SCHED] {job.name} slot {slot.isoformat()} not recorded as covered")
+
+        now = datetime.now(timezone.utc)
+        nxt = job.cron.next_after(max(slot, started))
+        if nxt <= now:
+            overruns[job.name] = overruns.get(job.name, 0) + 1
+            print(f"[SCHED] {job.name} overran its next slot {nxt.isoformat()} → skipped")
+            METRICS.service(overruns=dict(overruns))
+            nxt = job.cron.next_after(now)
+        job.next_slot, job.fire_at = nxt, nxt + _jitter()
+        for other in jobs:
+            if other is not job and started < other.next_slot <= now:
+                print(f"[SCHED] {other.name} slot {other.next_slot.isoformat()} passed during {job.name} → running it next")
 
 if __name__ == "__main__":
     main()
@@ -3,6 +3,7 @@ import math
 import requests
 from typing import Optional, Dict, Any
 from .config import SIRIX_API_URL, SIRIX_TOKEN
+from .ratelimit import SIRIX_LIMITER
 
 def _norm_id(v: Any) -> Optional[str]:
     if v is None or (isinstance(v, float) and math.isnan(v)):
@@ -30,7 +31,9 @@ def fetch_country_and_plan(user_id: Any) -> Optional[Dict[str, Any]]:
             "GetClosePositions": False,
             "GetMonetaryTransactions": True,
         }
+        SIRIX_LIMITER.acquire()
         resp = requests.post(SIRIX_API_URL, headers=headers, json=payload, timeout=25)
+        SIRIX_LIMITER.feedback(resp.status_code, resp.headers.get("Retry-After"))
         if resp.status_code != 200:
             print(f"[SIRIX] {resp.status_code} for {uid}")
             return None
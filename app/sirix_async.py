@@ -0,0 +1,120 @@
+# app/sirix_async.py  (ASYNC SIRIX ENGINE)
+"""
+asyncio fetch engine for Sirix GetUserTransactions.
+
+One event loop drives up to `concurrency` requests in flight over a single
+aiohttp connector, so connections (TCP + TLS) are kept alive and reused
+instead of being re-opened for every account.
+
+Results follow the same contract as worker.fetch_country_and_plan:
+    {"account_id", "country", "plan"}  or  {"__error__", "account_id"[, "__parse__"]}
+
+parse and on_result run on one delivery thread, never on the loop: parsing a
+large body, a cache write or a blocked hand-off (a full upsert queue, a busy
+parse pool) only holds the request that produced the result, while every other
+request in flight keeps going.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import aiohttp
+
+from .metrics import METRICS
+from .ratelimit import AdaptiveTokenBucket
+
+ResultFn = Callable[[Optional[Dict[str, Any]]], None]
+
+
+async def _fetch_one(http: aiohttp.ClientSession, url: str, aid: str,
+                     make_payload: Callable[[str], Dict[str, Any]],
+                     limiter: Optional[AdaptiveTokenBucket]) -> Tuple[Optional[Dict[str, Any]], bytes]:
+    """(error result, b"") or (None, body of a 200)."""
+    t0 = None
+    try:
+        if limiter:
+            await limiter.acquire_async()
+        t0 = time.perf_counter()
+        async with http.post(url, json=make_payload(aid)) as r:
+            if limiter:
+                limiter.feedback(r.status, r.headers.get("Retry-After"))
+            body = await r.read()  # non-200 too: drain so the connection goes back to the pool
+            METRICS.request("sirix", r.status, time.perf_counter() - t0)
+            t0 = None
+            if r.status != 200:
+                return {"__error__": f"{r.status}", "account_id": aid}, b""
+    except Exception as e:
+        if t0 is not None:
+            METRICS.request("sirix", "error", time.perf_counter() - t0)
+        return {"__error__": (str(e) or type(e).__name__)[:160], "account_id": aid}, b""
+    return None, body
+
+
+def _parse_and_deliver(parse: Callable[[str, bytes], Dict[str, Any]], on_result: ResultFn,
+                       aid: str, body: bytes) -> None:
+    # delivery thread: the CPU-bound parse (and any cache write in it) never runs on the loop
+    try:
+        res = parse(aid, body)
+    except Exception as e:   # the body arrived; fetching it again would not parse any better
+        res = {"__error__": (str(e) or type(e).__name__)[:160], "__parse__": True, "account_id": aid}
+    on_result(res)
+
+
+async def _run(ids: Iterable[str], url: str, headers: Dict[str, str],
+               make_payload, parse, on_result: ResultFn, limiter: Optional[AdaptiveTokenBucket],
+               concurrency: int, timeout: float, keepalive: float) -> None:
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency,
+                                     keepalive_timeout=keepalive, ttl_dns_cache=300)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def producer():
+        # `ids` may block (e.g. fed by an upstream pipeline stage), so pull it off-loop in small chunks
+        loop = asyncio.get_running_loop()
+        it = iter(ids)
+        while True:
+            chunk = await loop.run_in_executor(None, lambda: list(islice(it, 64)))
+            if not chunk:
+                break
+            for aid in chunk:
+                await queue.put(aid)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def consumer(http, loop):
+        while True:
+            aid = await queue.get()
+            if aid is None:
+                return
+            err, body = await _fetch_one(http, url, aid, make_payload, limiter)
+            if err is not None:
+                await loop.run_in_executor(delivery, on_result, err)
+            else:
+                await loop.run_in_executor(delivery, _parse_and_deliver, parse, on_result, aid, body)
+
+    delivery = ThreadPoolExecutor(max_workers=1, thread_name_prefix="e2t-deliver")
+    try:
+        async with aiohttp.ClientSession(connector=connector, headers=headers, timeout=client_timeout) as http:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(producer(), *(consumer(http, loop) for _ in range(concurrency)))
+    finally:
+        delivery.shutdown(wait=True)
+
+
+def fetch_all(ids: Iterable[str], *, url: str, headers: Dict[str, str],
+              make_payload: Callable[[str], Dict[str, Any]],
+              parse: Callable[[str, bytes], Dict[str, Any]],
+              on_result: ResultFn, limiter: Optional[AdaptiveTokenBucket] = None,
+              concurrency: int = 200,
+              timeout: float = 25.0, keepalive: float = 30.0) -> None:
+    """
+    Fetch every id in `ids` and call on_result(res) for each completion
+    (in completion order, one at a time on a delivery thread). Blocks until all are done.
+    parse(aid, body) gets the raw response bytes of every 200; it runs on the
+    delivery thread right before on_result, never on the event loop.
+    When a limiter is given every request takes a token from it first.
+    """
+    concurrency = max(1, int(concurrency))
+    asyncio.run(_run(ids, url, headers, make_payload, parse, on_result, limiter, concurrency, timeout, keepalive))
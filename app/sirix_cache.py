@@ -0,0 +1,113 @@
+# app/sirix_cache.py  (LOCAL SIRIX RESPONSE CACHE)
+"""
+On-disk cache of parsed Sirix responses, keyed by account_id.
+
+Only what the plan needs is stored: the country and the raw (Time, Amount)
+pairs of the "Initial Balance" transactions. The plan itself is recomputed on
+read, so changing E2T_PLAN_START_AT never serves a stale total.
+
+A hit also returns when the entry was fetched from Sirix, so callers can stamp
+results with the age of the data rather than the time of the read.
+
+Entries expire after their TTL; when the table grows past max_entries the
+least recently used rows are evicted. Safe to share between threads.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, List, Optional, Tuple
+
+CachedEntry = Tuple[Optional[str], List[List[Any]], float]   # (country, [[time, amount], ...], fetched_at)
+
+_SCHEMA = """
+create table if not exists sirix_cache (
+  account_id  text primary key,
+  country     text,
+  txs         text not null,
+  fetched_at  real not null,
+  expires_at  real not null,
+  accessed_at real not null
+);
+create index if not exists idx_sirix_cache_accessed on sirix_cache(accessed_at);
+"""
+
+
+class SirixCache:
+    def __init__(self, path: str, *, ttl_sec: float, max_entries: int, commit_every: int = 200):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.path = path
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.commit_every = max(1, commit_every)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        self._db.executescript(_SCHEMA)
+        self._db.execute("begin")
+
+    def _tick(self) -> None:
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._db.execute("commit")
+            self._db.execute("begin")
+            self._pending = 0
+
+    def get(self, account_id: str) -> Optional[CachedEntry]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "select country, txs, expires_at, fetched_at from sirix_cache where account_id = ?", (account_id,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row[2] < now:
+                self.misses += 1
+                self.expired += 1
+                return None
+            self._db.execute("update sirix_cache set accessed_at = ? where account_id = ?", (now, account_id))
+            self._tick()
+            self.hits += 1
+        return row[0], json.loads(row[1]), row[3]
+
+    def put(self, account_id: str, country: Optional[str], txs: List[List[Any]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "insert or replace into sirix_cache(account_id, country, txs, fetched_at, expires_at, accessed_at) "
+                "values (?, ?, ?, ?, ?, ?)",
+                (account_id, country, json.dumps(txs, separators=(",", ":")), now, now + self.ttl_sec, now),
+            )
+            self._tick()
+
+    def evict(self) -> int:
+        """Drop expired rows, then LRU rows above max_entries. Returns rows removed."""
+        with self._lock:
+            removed = self._db.execute("delete from sirix_cache where expires_at < ?", (time.time(),)).rowcount
+            n = self._db.execute("select count(*) from sirix_cache").fetchone()[0]
+            over = n - self.max_entries
+            if over > 0:
+                removed += self._db.execute(
+                    "delete from sirix_cache where account_id in "
+                    "(select account_id from sirix_cache order by accessed_at asc limit ?)", (over,)
+                ).rowcount
+            self.evicted += removed
+            self._db.execute("commit")
+            self._db.execute("begin")
+            self._pending = 0
+        return removed
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.execute("commit")
+            self._db.close()
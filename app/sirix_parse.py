@@ -0,0 +1,131 @@
+# app/sirix_parse.py  (SIRIX RESPONSE PARSING)
+"""
+Pull the two things the plan needs out of a GetUserTransactions body:
+UserData.UserDetails.Country and the raw [Time, Amount] of every transaction
+whose Comment starts with "Initial Balance".
+
+extract_country_and_txs() works on the decoded dict. scan_country_and_txs()
+works on the raw body and never builds the full document: it decodes only the
+(small) UserData value, finds candidate Comments with one C-level regex scan,
+and decodes just the transaction records that carry them. Everything else in
+the body, typically thousands of deposits / withdrawals, is skipped without
+allocating a dict.
+
+The scan is only trusted when it is sure to give the same answer as the full
+decode. Whenever a body looks unusual (escaped or non-ASCII Comment prefixes,
+repeated top-level keys, nested records, a non-object document) it returns
+None and country_and_txs() falls back to json.loads.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+CountryTxs = Tuple[Optional[str], List[List[Any]]]
+
+_PREFIX = "initial balance"
+
+_DECODER = json.JSONDecoder()
+_TOP_KEYS = re.compile(r'"(UserData|MonetaryTransactions)"\s*:\s*')
+# the first `]` followed by `,` / `}` after the MonetaryTransactions key: its
+# closing bracket at the latest (earlier only if a string or record holds one)
+_ARRAY_END = re.compile(r'\]\s*[,}]')
+# Comment values after the leading spaces (a raw JSON string cannot hold any
+# other unescaped whitespace): group 1 = candidate, group 2 = one the regex
+# cannot judge, i.e. an escape or a non-ASCII char where strip()/lower() see
+# more than the raw bytes show (the caller then falls back to json.loads)
+_COMMENT = re.compile(r'"Comment"\s*:\s*" *(?:(' + _PREFIX + r')|(\\|[^\x00-\x7f]))',
+                      re.IGNORECASE | re.ASCII)
+
+
+def extract_country_and_txs(data: Dict[str, Any]) -> CountryTxs:
+    """Pull the country and the raw [Time, Amount] of every "Initial Balance" transaction."""
+    country = (data.get("UserData") or {}).get("UserDetails", {}).get("Country")
+    txs = []
+    for t in (data.get("MonetaryTransactions") or []):
+        comment = str(t.get("Comment", "")).strip().lower()
+        if comment.startswith(_PREFIX):
+            txs.append([t.get("Time"), t.get("Amount")])
+    return country, txs
+
+
+def _record_at(text: str, pos: int, lo: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+    """Decode the array element holding the key at `pos`; None unless it is a flat record."""
+    start = text.rfind("{", lo, pos)
+    if start < 0:
+        return None
+    i = start - 1
+    while i > lo and text[i] in " \t\r\n":
+        i -= 1
+    if text[i] not in "[,":
+        return None
+    try:
+        obj, end = _DECODER.raw_decode(text, start)
+    except ValueError:
+        return None
+    if not isinstance(obj, dict) or end <= pos:
+        return None   # the `{` opened a nested value inside the record
+    return start, obj
+
+
+def scan_country_and_txs(body: bytes) -> Optional[CountryTxs]:
+    """
+    Same result as extract_country_and_txs(json.loads(body)) without decoding
+    the whole body, or None when the shortcut cannot be trusted for this body.
+    """
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    if not text.lstrip().startswith("{") or not text.rstrip().endswith("}"):
+        return None
+
+    # top-level keys are expected exactly once; anything else goes the slow way
+    user, monetary = [], []
+    for m in _TOP_KEYS.finditer(text):
+        (user if m.group(1) == "UserData" else monetary).append(m.end())
+    if len(user) > 1 or len(monetary) > 1:
+        return None
+
+    country = None
+    if user:
+        try:
+            user_data, _ = _DECODER.raw_decode(text, user[0])
+        except ValueError:
+            return None
+        try:
+            country = (user_data or {}).get("UserDetails", {}).get("Country")
+        except AttributeError:
+            return None
+
+    txs: List[List[Any]] = []
+    if not monetary:
+        return country, txs
+    lo = monetary[0]
+    if not text.startswith("[", lo):
+        return (country, txs) if text.startswith("null", lo) else None
+    end = _ARRAY_END.search(text, lo)
+    hi = end.start() if end else len(text)
+    last = -1
+    for c in _COMMENT.finditer(text, lo):
+        if c.group(2) is not None or c.start() > hi:
+            return None
+        rec = _record_at(text, c.start(), lo)
+        if rec is None:
+            return None
+        start, t = rec
+        if start == last:
+            continue   # same record matched twice (repeated key)
+        if not str(t.get("Comment", "")).strip().lower().startswith(_PREFIX):
+            return None   # the match was not this record's Comment
+        txs.append([t.get("Time"), t.get("Amount")])
+        last = start
+    return country, txs
+
+
+def country_and_txs(body: bytes, fast: bool = True) -> CountryTxs:
+    """(country, [[time, amount], ...]) from a raw GetUserTransactions body."""
+    if fast:
+        res = scan_country_and_txs(body)
+        if res is not None:
+            return res
+    return extract_country_and_txs(json.loads(body) or {})
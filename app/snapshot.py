@@ -0,0 +1,147 @@
+# app/snapshot.py  (ALLOCATION SNAPSHOT)
+"""
+Static, precompressed copy of the country allocation for the dashboard, written
+as the worker's last stage so page loads never touch the database:
+
+    allocation.v1.json       {"version", "generated_at", "etag", "rows": [...]}
+    allocation.v1.json.gz    same bytes, gzip (the dashboard inflates it itself)
+
+Rows carry the fields CountryAllocation.js renders (country, total_plan,
+pct_goal, is_qualified, status), sorted by pct_goal desc then country. They
+are read from v_e2t_country_allocation (Q15), the view the dashboard's live
+fallback queries, so both paths show the same numbers; nothing is recomputed here.
+
+The etag hashes everything except generated_at, so it only changes when the
+numbers do. The last published etag is kept in e2t_sync_state
+('snapshot:allocation'); an unchanged snapshot is not re-uploaded and browsers
+holding it keep getting 304s.
+
+Targets: a public Supabase Storage bucket (E2T_SNAPSHOT_BUCKET, see Q14) and/or
+a local directory (E2T_SNAPSHOT_DIR) for any static host.
+"""
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .config import VIEW_ALLOC, TABLE_SYNC_STATE, getenv_bool, getenv_int
+from .supa import pg_select_all, pg_select, upsert_many, storage_upload, storage_public_url
+from .metrics import METRICS
+
+SNAPSHOT_ENABLED = getenv_bool("E2T_SNAPSHOT", True)
+SNAPSHOT_SOURCE  = os.environ.get("E2T_SNAPSHOT_SOURCE", VIEW_ALLOC).strip()       # view with the dashboard's columns
+SNAPSHOT_BUCKET  = os.environ.get("E2T_SNAPSHOT_BUCKET", "").strip()               # "" = no Storage upload
+SNAPSHOT_PREFIX  = os.environ.get("E2T_SNAPSHOT_PREFIX", "e2t/").strip()           # object path prefix in the bucket
+SNAPSHOT_DIR     = os.environ.get("E2T_SNAPSHOT_DIR", ".cache/snapshot").strip()   # "" = no local copy
+SNAPSHOT_MAX_AGE = getenv_int("E2T_SNAPSHOT_MAX_AGE", 60)                          # Cache-Control max-age (s)
+
+SCHEMA_VERSION = 1
+NAME = f"allocation.v{SCHEMA_VERSION}.json"
+STATE_NAME = "snapshot:allocation"
+STATE_KIND = "snapshot"
+SOURCE_COLS = "country,total_plan,pct_goal,is_qualified,status"
+
+
+def build_rows(source: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """View rows → dashboard rows (JSON-friendly types, stable order); the values are the view's."""
+    out = [{
+        "country": r.get("country") or "Unknown",
+        "total_plan": round(float(r.get("total_plan") or 0), 2),
+        "pct_goal": float(r.get("pct_goal") or 0),
+        "is_qualified": bool(r.get("is_qualified")),
+        "status": r.get("status"),
+    } for r in source]
+    out.sort(key=lambda x: (-x["pct_goal"], x["country"]))
+    return out
+
+
+def build_snapshot(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    content = {"version": SCHEMA_VERSION, "rows": rows}
+    digest = hashlib.sha256(json.dumps(content, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+    return {"version": SCHEMA_VERSION,
+            "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "etag": f"v{SCHEMA_VERSION}-{digest[:20]}",
+            "rows": rows}
+
+
+def encode(snap: Dict[str, Any]) -> Dict[str, bytes]:
+    """{file suffix: bytes}; the .gz variant holds the exact bytes of the plain one."""
+    raw = json.dumps(snap, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return {"": raw, ".gz": gzip.compress(raw, compresslevel=9, mtime=0)}
+
+
+_CONTENT_TYPES = {"": "application/json", ".gz": "application/gzip"}
+
+def _write_local(files: Dict[str, bytes], etag: str) -> None:
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    for suffix, body in files.items():
+        path = os.path.join(SNAPSHOT_DIR, NAME + suffix)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)   # a static server never sees a half-written file
+    with open(os.path.join(SNAPSHOT_DIR, NAME + ".etag"), "w") as f:
+        f.write(etag + "\n")
+
+def _upload(files: Dict[str, bytes]) -> None:
+    # the plain object goes last: clients probing .gz never get ahead of it
+    for suffix in sorted(files, key=lambda s: s == ""):
+        storage_upload(SNAPSHOT_BUCKET, SNAPSHOT_PREFIX + NAME + suffix, files[suffix],
+                       content_type=_CONTENT_TYPES[suffix], cache_control=f"max-age={SNAPSHOT_MAX_AGE}")
+
+
+def _published_etag() -> Optional[str]:
+    try:
+        rows = pg_select(TABLE_SYNC_STATE, "hwm,kind", filters={"name": f"eq.{STATE_NAME}"})
+    except Exception as e:
+        print(f"[SNAPSHOT] {TABLE_SYNC_STATE} read failed ({str(e)[:120]}) → publishing")
+        return None
+    return rows[0].get("hwm") if rows and rows[0].get("kind") == STATE_KIND else None
+
+def _save_etag(etag: str, n_rows: int) -> None:
+    row = {"name": STATE_NAME, "hwm": etag, "kind": STATE_KIND, "rows_synced": n_rows,
+           "updated_at": datetime.now(timezone.utc).isoformat()}
+    try:
+        if not all(res.ok for res in upsert_many(TABLE_SYNC_STATE, [row], on_conflict="name")):
+            print("[SNAPSHOT] Could not record the published etag (next run re-uploads)")
+    except Exception as e:
+        print(f"[SNAPSHOT] Could not record the published etag: {str(e)[:120]}")
+
+
+def publish_allocation_snapshot(force: bool = False) -> Optional[Dict[str, Any]]:
+    """Build and publish the snapshot; returns it (None when disabled). Never raises."""
+    if not SNAPSHOT_ENABLED or not (SNAPSHOT_BUCKET or SNAPSHOT_DIR):
+        return None
+    with METRICS.stage("snapshot"):
+        try:
+            snap = build_snapshot(build_rows(pg_select_all(SNAPSHOT_SOURCE, SOURCE_COLS)))
+            files = encode(snap)
+            sizes = " ".join(f"{s or 'json'}={len(b):,}B" for s, b in files.items())
+            if SNAPSHOT_DIR:
+                _write_local(files, snap["etag"])
+            if SNAPSHOT_BUCKET:
+                if not force and _published_etag() == snap["etag"]:
+                    print(f"[SNAPSHOT] Unchanged ({snap['etag']}, {len(snap['rows'])} countries) → not re-uploaded")
+                    METRICS.inc("snapshot_unchanged")
+                    return snap
+                _upload(files)
+                _save_etag(snap["etag"], len(snap["rows"]))
+                print(f"[SNAPSHOT] Published {snap['etag']} ({len(snap['rows'])} countries, {sizes}) → "
+                      f"{storage_public_url(SNAPSHOT_BUCKET, SNAPSHOT_PREFIX + NAME)}")
+            else:
+                print(f"[SNAPSHOT] Wrote {snap['etag']} ({len(snap['rows'])} countries, {sizes}) → {SNAPSHOT_DIR}")
+            METRICS.inc("snapshot_published")
+            return snap
+        except Exception as e:
+            print(f"[SNAPSHOT] Failed (dashboard keeps the previous snapshot): {str(e)[:200]}")
+            METRICS.inc("snapshot_failed")
+            return None
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Publish the country allocation snapshot for the dashboard")
+    ap.add_argument("--force", action="store_true", help="upload even if the etag is unchanged")
+    publish_allocation_snapshot(force=ap.parse_args().force)
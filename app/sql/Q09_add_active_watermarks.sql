@@ -0,0 +1,6 @@
+-- Q09: per-account refresh watermarks used by the worker's incremental mode
+alter table public.e2t_active
+  add column if not exists last_checked_at timestamptz,   -- when Sirix was last asked about this account
+  add column if not exists last_tx_time    timestamptz;   -- newest qualifying "Initial Balance" tx seen
+
+create index if not exists idx_e2t_active_last_checked on public.e2t_active(last_checked_at);
@@ -0,0 +1,29 @@
+-- Q10: same rebuild as Q06, as one transactional function callable via PostgREST
+--      POST /rest/v1/rpc/refresh_country_allocation  → number of country rows written
+create or replace function public.refresh_country_allocation()
+returns integer
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  n integer;
+begin
+  -- delete (not truncate) so concurrent readers keep seeing the old totals until commit
+  delete from public.e2t_country_allocation where true;
+
+  insert into public.e2t_country_allocation (country, total_plan, updated_at)
+  select
+    coalesce(nullif(trim(country), ''), 'Unknown') as country,
+    sum(coalesce(plan,0)) as total_plan,
+    now()
+  from public.e2t_active
+  group by 1;
+
+  get diagnostics n = row_count;
+  return n;
+end;
+$$;
+
+revoke all on function public.refresh_country_allocation() from public, anon, authenticated;
+grant execute on function public.refresh_country_allocation() to service_role;
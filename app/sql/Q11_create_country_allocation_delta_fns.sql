@@ -0,0 +1,60 @@
+-- Q11: incremental maintenance of e2t_country_allocation from per-country deltas
+--      POST /rest/v1/rpc/apply_country_allocation_deltas {"deltas": [{"country": "UK", "delta": 1500}, ...]}
+--      Every country touched by the run is sent (delta may be 0) so new countries get a row
+--      and countries left without any active account are removed, matching a full rebuild.
+create or replace function public.apply_country_allocation_deltas(deltas jsonb)
+returns integer
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  n integer;
+begin
+  insert into public.e2t_country_allocation as a (country, total_plan, updated_at)
+  select d.country, sum(d.delta), now()
+  from jsonb_to_recordset(deltas) as d(country text, delta numeric)
+  group by d.country
+  on conflict (country) do update
+    set total_plan = a.total_plan + excluded.total_plan,
+        updated_at = now();
+
+  get diagnostics n = row_count;
+
+  delete from public.e2t_country_allocation a
+  using (select distinct d.country from jsonb_to_recordset(deltas) as d(country text, delta numeric)) t
+  where a.country = t.country
+    and not exists (
+      select 1 from public.e2t_active x
+      where coalesce(nullif(trim(x.country), ''), 'Unknown') = a.country
+    );
+
+  return n;
+end;
+$$;
+
+-- Rows where the stored totals disagree with a full rebuild (empty = consistent)
+create or replace function public.country_allocation_drift(tolerance numeric default 0.005)
+returns table (country text, stored numeric, expected numeric)
+language sql
+stable
+security definer
+set search_path = public
+as $$
+  with expected as (
+    select coalesce(nullif(trim(country), ''), 'Unknown') as country,
+           sum(coalesce(plan,0)) as total_plan
+    from public.e2t_active
+    group by 1
+  )
+  select coalesce(a.country, e.country), a.total_plan, e.total_plan
+  from public.e2t_country_allocation a
+  full outer join expected e on e.country = a.country
+  where a.country is null or e.country is null
+     or abs(a.total_plan - e.total_plan) > tolerance;
+$$;
+
+revoke all on function public.apply_country_allocation_deltas(jsonb) from public, anon, authenticated;
+revoke all on function public.country_allocation_drift(numeric) from public, anon, authenticated;
+grant execute on function public.apply_country_allocation_deltas(jsonb) to service_role;
+grant execute on function public.country_allocation_drift(numeric) to service_role;
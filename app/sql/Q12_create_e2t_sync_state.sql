@@ -0,0 +1,11 @@
+-- Q12: high-water marks for incremental (CDC) syncs, one row per source
+create table if not exists public.e2t_sync_state (
+  name        text primary key,     -- e.g. 'crm_lv_tpaccount'
+  hwm         text,                 -- rowversion as bigint, or ISO timestamp
+  kind        text,                 -- 'rowversion' | 'timestamp'
+  rows_synced bigint,               -- rows moved by the run that set this mark
+  updated_at  timestamptz default now()
+);
+
+alter table public.e2t_sync_state enable row level security;
+revoke all on public.e2t_sync_state from anon;
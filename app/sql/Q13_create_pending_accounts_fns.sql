@@ -0,0 +1,114 @@
+-- Q13: server-side planning for the worker, so it no longer downloads whole tables
+--      at startup just to work out which accounts still need a Sirix call.
+--
+--      POST /rest/v1/rpc/sync_e2t_excluded     {"rules": [["audition","audition"], ...]}
+--           → upserts every skim row whose TempName matches a rule into e2t_excluded
+--      POST /rest/v1/rpc/e2t_pending_accounts  {"after_name": null, "page_size": 5000, "rules": [...], "skip_active": true}
+--           → {"next": <cursor or null>, "ids": [...], "scanned": n, "excluded": n, "skipped": n}
+--
+--      Rules are the worker's E2T_EXCLUSION_RULES as [pattern, reason] pairs: a row is
+--      excluded when lower(lv_tempname) contains a pattern, and its reason lists the
+--      matched reasons in rule order (same labels as app/classify.py).
+--      Account ids are normalised like the worker's _norm_id for plain digit strings
+--      (trimmed, leading zeros dropped); other names are only trimmed.
+
+-- case-insensitive regex matching any rule pattern literally (lets pg_trgm's GIN index prefilter)
+create or replace function public.e2t_rules_regex(rules jsonb)
+returns text
+language sql
+immutable
+as $$
+  select coalesce(string_agg(regexp_replace(r.value->>0, '([.^$*+?()\[\]{}|\\])', '\\\1', 'g'), '|'), '$^')
+  from jsonb_array_elements(rules) as r
+  where coalesce(r.value->>0, '') <> '';
+$$;
+
+create or replace function public.sync_e2t_excluded(
+  rules jsonb default '[["audition","audition"],["free trial","free trial"]]'
+)
+returns integer
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  n integer;
+begin
+  insert into public.e2t_excluded as e (account_id, reason, tempname, updated_at)
+  select distinct on (trim(s.lv_name)) trim(s.lv_name), m.reason, s.lv_tempname, now()
+  from public.lv_tpaccount_skim s
+  cross join lateral (
+    select string_agg(c.code, ',' order by c.first_rule) as reason
+    from (
+      select r.value->>1 as code, min(r.ord) as first_rule
+      from jsonb_array_elements(rules) with ordinality as r(value, ord)
+      where coalesce(r.value->>0, '') <> ''
+        and strpos(lower(s.lv_tempname), lower(r.value->>0)) > 0
+      group by 1
+    ) c
+  ) m
+  where s.lv_tempname ~* public.e2t_rules_regex(rules)   -- trigram index (Q01)
+    and m.reason is not null
+    and trim(s.lv_name) <> ''
+  order by trim(s.lv_name), s.lv_name
+  on conflict (account_id) do update
+    set reason = excluded.reason,
+        tempname = excluded.tempname,
+        updated_at = now();
+
+  get diagnostics n = row_count;
+  return n;
+end;
+$$;
+
+-- One keyset page over the skim primary key; `next` is the last lv_name scanned
+-- (null once the table is exhausted). A page may hold fewer ids than page_size,
+-- even none, when its rows are excluded or already active.
+create or replace function public.e2t_pending_accounts(
+  after_name  text    default null,
+  page_size   integer default 5000,
+  rules       jsonb   default '[["audition","audition"],["free trial","free trial"]]',
+  skip_active boolean default true
+)
+returns jsonb
+language sql
+stable
+security definer
+set search_path = public
+as $$
+  with page as (
+    select s.lv_name,
+           case when trim(s.lv_name) ~ '^[0-9]+$'
+                then coalesce(nullif(ltrim(trim(s.lv_name), '0'), ''), '0')
+                else trim(s.lv_name) end as account_id,
+           exists (
+             select 1 from jsonb_array_elements(rules) as r
+             where coalesce(r.value->>0, '') <> ''
+               and strpos(lower(coalesce(s.lv_tempname, '')), lower(r.value->>0)) > 0
+           ) as excluded
+    from public.lv_tpaccount_skim s
+    where after_name is null or s.lv_name > after_name
+    order by s.lv_name
+    limit greatest(page_size, 1)
+  ),
+  flagged as (
+    select p.*,
+           (not p.excluded and p.account_id <> '' and skip_active
+            and exists (select 1 from public.e2t_active a where a.account_id = p.account_id)) as active
+    from page p
+  )
+  select jsonb_build_object(
+    'next',     case when count(*) >= greatest(page_size, 1) then max(lv_name) end,
+    'ids',      coalesce(jsonb_agg(account_id order by lv_name)
+                           filter (where not excluded and not active and account_id <> ''), '[]'::jsonb),
+    'scanned',  count(*),
+    'excluded', count(*) filter (where excluded),
+    'skipped',  count(*) filter (where active)
+  )
+  from flagged;
+$$;
+
+revoke all on function public.sync_e2t_excluded(jsonb) from public, anon, authenticated;
+revoke all on function public.e2t_pending_accounts(text, integer, jsonb, boolean) from public, anon, authenticated;
+grant execute on function public.sync_e2t_excluded(jsonb) to service_role;
+grant execute on function public.e2t_pending_accounts(text, integer, jsonb, boolean) to service_role;
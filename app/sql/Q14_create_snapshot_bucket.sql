@@ -0,0 +1,8 @@
+-- Q14: public Storage bucket for the dashboard's allocation snapshot (app/snapshot.py)
+-- Objects: e2t/allocation.v1.json (+ .gz), written by the worker with the service role.
+insert into storage.buckets (id, name, public)
+values ('e2t-public', 'e2t-public', true)
+on conflict (id) do update set public = true;
+
+-- Public buckets are readable by anyone over /storage/v1/object/public/...;
+-- only the service role (which bypasses RLS) writes, so no insert/update policies are added.
@@ -0,0 +1,20 @@
+-- Q15: dashboard view with goal progress (CountryAllocation.js, app/snapshot.py)
+-- Replaces the Q05/Q08 view: reads the maintained totals table (Q04, kept current by
+-- Q10/Q11) instead of grouping e2t_active on every read, and adds the goal columns
+-- the dashboard renders. Goal: US$1,000,000 per country (shown as "of US$1,000,000").
+-- Dropped and recreated because the column list changes.
+drop view if exists public.v_e2t_country_allocation;
+
+create view public.v_e2t_country_allocation as
+select
+  a.country,
+  a.total_plan,
+  round(a.total_plan / g.goal_usd * 100, 2)                           as pct_goal,
+  a.total_plan >= g.goal_usd                                          as is_qualified,
+  case when a.total_plan >= g.goal_usd then 'Qualified' else 'Pending' end as status
+from public.e2t_country_allocation a
+cross join (select 1000000::numeric as goal_usd) g
+order by pct_goal desc, a.country;
+
+-- Re-grant after the drop (Q07)
+grant select on public.v_e2t_country_allocation to anon;
@@ -1,11 +1,20 @@
-# app/supa.py
+# app/supa.py  (SHARED POSTGREST CLIENT)
+import os
+import json
 import time
+import queue
 import random
+import threading
 import requests
-from typing import Any, Dict, List, Optional
-from .config import SUPABASE_URL, SUPABASE_KEY
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+from .config import SUPABASE_URL, SUPABASE_KEY, KEYSET_COLUMNS, getenv_int
+from .metrics import METRICS
 
 BASE_REST = f"{SUPABASE_URL}/rest/v1".rstrip("/")
+BASE_STORAGE = f"{SUPABASE_URL}/storage/v1".rstrip("/")
 HEADERS = {
     "apikey": SUPABASE_KEY,
     "Authorization": f"Bearer {SUPABASE_KEY}",
@@ -15,90 +24,406 @@ HEADERS = {
     "Content-Profile": "public",
 }
 
-def _retryable(msg: str) -> bool:
-    for k in ("RemoteProtocolError", "ConnectionReset", "ServerDisconnected", "ReadTimeout",
-              "EOF", "temporarily unavailable", "timeout", "pool"):
-        if k.lower() in (msg or "").lower():
-            return True
-    return False
+# knobs (env overrides)
+POOL_SIZE       = getenv_int("SUPA_POOL_SIZE", 32)                        # keep-alive connections per host
+MAX_ATTEMPTS    = getenv_int("SUPA_MAX_ATTEMPTS", 6)                      # shared retry policy
+UPSERT_MAX_ROWS = getenv_int("SUPA_UPSERT_MAX_ROWS", 1000)                # rows per bulk POST
+UPSERT_MAX_BYTES = getenv_int("SUPA_UPSERT_MAX_BYTES", 2000000)           # body bytes per bulk POST
+IN_CHUNK        = getenv_int("SUPA_IN_CHUNK", 300)                        # values per in.(...) filter (URL length)
+READ_WORKERS    = getenv_int("SUPA_READ_WORKERS", 6)                      # concurrent range readers (1 = sequential)
+READ_PARTITIONS = getenv_int("SUPA_READ_PARTITIONS", 0)                   # key ranges per table (0 = 2 x workers)
+
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+@dataclass
+class BatchResult:
+    ok: bool
+    rows: int
+    status: int = 0
+    error: str = ""
+    elapsed: float = 0.0
+    timed_out: bool = False   # the request timed out (no status to go by)
+
+
+def get_session() -> requests.Session:
+    """One pooled keep-alive session shared by every caller (threads included)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                s.headers.update(HEADERS)
+                _session = s
+    return _session
+
+class RetryableStatus(requests.HTTPError):
+    pass
+
+def _retryable(e: BaseException) -> bool:
+    """By type, never by message: an HTTPError's text includes the response body."""
+    if isinstance(e, RetryableStatus):
+        return True
+    if isinstance(e, requests.HTTPError):
+        return False
+    return isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                          ConnectionError, TimeoutError))
 
 def _backoff_sleep(backoff: float) -> float:
     time.sleep(backoff * (1.0 + random.random() * 0.3))
     return min(backoff * 2.0, 10.0)
 
+
+def _request(method: str, path: str, *, params: Any = None, data: Any = None, json_body: Any = None,
+             headers: Optional[Dict[str, str]] = None, timeout: float = 30,
+             ok: Sequence[int] = (200, 201, 204, 206), what: str = "",
+             attempts: Optional[int] = None, base: str = BASE_REST,
+             service: str = "postgrest") -> requests.Response:
+    """
+    Shared retry policy: network errors and 408/429/5xx are retried with jittered
+    exponential backoff (MAX_ATTEMPTS total unless `attempts` is given); other
+    statuses raise immediately.
+    """
+    backoff = 0.5
+    attempts = max(1, attempts or MAX_ATTEMPTS)
+    op = f"{method} {path.split('?', 1)[0]}"
+    for attempt in range(1, attempts + 1):
+        t0 = time.perf_counter()
+        try:
+            try:
+                r = get_session().request(method, f"{base}/{path}", params=params, data=data, json=json_body,
+                                          headers=headers, timeout=timeout)
+            except Exception:
+                METRICS.request(service, "error", time.perf_counter() - t0, op)
+                raise
+            METRICS.request(service, r.status_code, time.perf_counter() - t0, op)
+            if r.status_code in ok:
+                return r
+            if r.status_code in RETRY_STATUSES:
+                raise RetryableStatus(f"RetryableStatus {r.status_code}: {r.text[:160]}", response=r)
+            raise requests.HTTPError(f"{r.status_code} {r.reason}: {r.text[:200]}", response=r)
+        except Exception as e:
+            msg = str(e)
+            if attempt == attempts or not _retryable(e):
+                print(f"[ERROR] {what or method} {path}: {msg[:200]}")
+                raise
+            backoff = _backoff_sleep(backoff)
+    raise RuntimeError("unreachable")
+
+def _status_of(e: Exception) -> int:
+    r = getattr(e, "response", None)
+    return r.status_code if r is not None else 0
+
+def chunked(seq: Iterable[Any], n: int) -> Iterator[List[Any]]:
+    buf = []
+    for x in seq:
+        buf.append(x)
+        if len(buf) >= n:
+            yield buf
+            buf = []
+    if buf: yield buf
+
+def pg_quote(v: Any) -> str:
+    """Double-quote a value for in.(...) lists and and=(...)/or=(...) trees, so reserved characters
+    (, . : ( ) ") are taken literally. Not for top-level `col=op.value` filters: there the quotes are data."""
+    return '"' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def pg_in(values: Iterable[Any]) -> str:
+    """PostgREST in.(...) filter with every value double-quoted (safe for commas, dots, parens)."""
+    return "in.(" + ",".join(pg_quote(v) for v in values) + ")"
+
 def pg_select(table: str, select: str, *, filters: Optional[Dict[str,str]] = None,
               order: Optional[str] = None, desc: bool=False,
-              limit: Optional[int]=None, offset: Optional[int]=None) -> List[Dict[str, Any]]:
+              limit: Optional[int]=None, offset: Optional[int]=None, timeout: float = 60) -> List[Dict[str, Any]]:
     params: Dict[str, Any] = {"select": select}
     if filters: params.update(filters)
     if order:   params["order"] = f"{order}.{'desc' if desc else 'asc'}"
     if limit is not None:  params["limit"] = limit
     if offset is not None: params["offset"] = offset
 
-    backoff = 0.5
-    for attempt in range(1, 7):
-        try:
-            r = requests.get(f"{BASE_REST}/{table}", headers=HEADERS, params=params, timeout=30)
-            if r.status_code in (200, 206):
-                return r.json() or []
-            if r.status_code == 406:
-                return []
-            r.raise_for_status()
-        except Exception as e:
-            msg = str(e)
-            if attempt == 6 or not _retryable(msg):
-                print(f"[ERROR] pg_select {table}: {msg[:200]}")
-                raise
-            backoff = _backoff_sleep(backoff)
-    return []
+    r = _request("GET", table, params=params, ok=(200, 206, 406), timeout=timeout, what="pg_select")
+    if r.status_code == 406:
+        return []
+    return r.json() or []
 
-def pg_select_all(table: str, select: str, *, filters: Optional[Dict[str, str]]=None,
-                  order: Optional[str]=None, desc: bool=False, page_size: int=1000) -> List[Dict[str, Any]]:
-    out: List[Dict[str, Any]] = []
-    offset = 0
+def pg_iter_pages(table: str, select: str, *, filters: Optional[Dict[str, str]]=None,
+                  order: Optional[str]=None, desc: bool=False, page_size: int=1000,
+                  keyset: Optional[str]=None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield a table page by page. With `keyset` (default: KEYSET_COLUMNS for the
+    large tables, when no explicit order is asked for) each page is
+    `key > last_seen order by key` — linear in table size and stable under
+    concurrent writes. Otherwise falls back to limit/offset.
+    """
+    if keyset is None and order is None:
+        keyset = KEYSET_COLUMNS.get(table)
+
+    if not keyset:
+        offset = 0
+        while True:
+            chunk = pg_select(table, select, filters=filters, order=order, desc=desc, limit=page_size, offset=offset)
+            if not chunk:
+                break
+            yield chunk
+            if len(chunk) < page_size:
+                break
+            offset += page_size
+        return
+
+    if filters and keyset in filters:
+        raise ValueError(f"keyset column {keyset!r} cannot also be filtered")
+    cols = [c.strip() for c in select.split(",")]
+    strip_key = select != "*" and keyset not in cols
+    sel = f"{select},{keyset}" if strip_key else select
+    last = None
     while True:
-        chunk = pg_select(table, select, filters=filters, order=order, desc=desc, limit=page_size, offset=offset)
+        f = dict(filters or {})
+        if last is not None:
+            # quoted values are only unquoted inside in.(...) and and=(...): a top-level
+            # `key=gt."…"` would compare against the quote characters too
+            f = _and_filter(f, [f"{keyset}.gt.{pg_quote(last)}"])
+        chunk = pg_select(table, sel, filters=f, order=keyset, limit=page_size)
         if not chunk:
             break
-        out.extend(chunk)
+        last = chunk[-1][keyset]
+        if strip_key:
+            for r in chunk:
+                r.pop(keyset, None)
+        yield chunk
         if len(chunk) < page_size:
             break
-        offset += page_size
+
+def _and_filter(filters: Optional[Dict[str, str]], conds: List[str]) -> Dict[str, str]:
+    """Add `col.op.value` conditions to `filters` through PostgREST's and=(...) (merged with any existing one)."""
+    f = dict(filters or {})
+    if conds:
+        prev = f.pop("and", "").strip()
+        f["and"] = "(" + ",".join(([prev[1:-1]] if prev else []) + conds) + ")"
+    return f
+
+def _range_filters(filters: Optional[Dict[str, str]], key: str,
+                   lo: Optional[str], hi: Optional[str]) -> Dict[str, str]:
+    """Add lo <= key < hi to `filters`."""
+    conds = []
+    if lo is not None: conds.append(f"{key}.gte.{pg_quote(lo)}")
+    if hi is not None: conds.append(f"{key}.lt.{pg_quote(hi)}")
+    return _and_filter(filters, conds)
+
+def _range_bounds(table: str, key: str, filters: Optional[Dict[str, str]], total: int, parts: int) -> List[str]:
+    """Sample the key at evenly spaced offsets (one tiny request each) to get range boundaries."""
+    bounds: List[str] = []
+    for i in range(1, parts):
+        row = pg_select(table, key, filters=filters, order=key, limit=1, offset=(total * i) // parts)
+        if row and (not bounds or row[0][key] != bounds[-1]):  # probes come back in DB key order
+            bounds.append(row[0][key])
+    return bounds
+
+def _plan_ranges(table: str, key: str, filters: Optional[Dict[str, str]], page_size: int,
+                 workers: int, partitions: int) -> Optional[List[tuple]]:
+    """Key ranges for a concurrent read, or None when a plain sequential read is the better deal."""
+    total = count_rows(table, key, filters=filters)
+    if workers <= 1 or total < 0 or total <= page_size * 2:
+        return None
+    bounds = _range_bounds(table, key, filters, total, partitions or workers * 2)
+    return list(zip([None] + bounds, bounds + [None]))
+
+def pg_select_all_parallel(table: str, select: str, *, key: Optional[str]=None,
+                           filters: Optional[Dict[str, str]]=None, page_size: int=1000,
+                           workers: int=READ_WORKERS, partitions: int=READ_PARTITIONS) -> List[Dict[str, Any]]:
+    """
+    Full-table read split into key ranges fetched concurrently over the pooled
+    session. The row count (Prefer: count=exact) and evenly spaced key samples
+    give the boundaries; each range is keyset-paged on its own; results are
+    concatenated in key order.
+    """
+    key = key or KEYSET_COLUMNS.get(table)
+    if not key:
+        raise ValueError(f"no keyset column for {table}")
+    ranges = _plan_ranges(table, key, filters, page_size, workers, partitions)
+    if ranges is None:
+        return pg_select_all(table, select, filters=filters, page_size=page_size, keyset=key)
+
+    def read(rng):
+        out: List[Dict[str, Any]] = []
+        for chunk in pg_iter_pages(table, select, filters=_range_filters(filters, key, *rng),
+                                   page_size=page_size, keyset=key):
+            out.extend(chunk)
+        return out
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(ranges))) as ex:
+        pieces = list(ex.map(read, ranges))
+    return [r for piece in pieces for r in piece]
+
+def pg_iter_pages_parallel(table: str, select: str, *, key: Optional[str]=None,
+                           filters: Optional[Dict[str, str]]=None, page_size: int=1000,
+                           workers: int=READ_WORKERS, partitions: int=READ_PARTITIONS) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Like pg_select_all_parallel, but pages are yielded as the range readers
+    produce them (completion order, not key order) through a bounded queue,
+    so the caller can fold a big table into a compact structure without ever
+    holding all of its rows.
+    """
+    key = key or KEYSET_COLUMNS.get(table)
+    if not key:
+        raise ValueError(f"no keyset column for {table}")
+    ranges = _plan_ranges(table, key, filters, page_size, workers, partitions)
+    if ranges is None:
+        yield from pg_iter_pages(table, select, filters=filters, page_size=page_size, keyset=key)
+        return
+
+    q: "queue.Queue" = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    done = object()
+
+    def read(rng):
+        try:
+            for chunk in pg_iter_pages(table, select, filters=_range_filters(filters, key, *rng),
+                                       page_size=page_size, keyset=key):
+                if stop.is_set():
+                    return
+                q.put(chunk)
+        except BaseException as e:
+            q.put(e)
+        finally:
+            q.put(done)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(ranges))) as ex:
+        for rng in ranges:
+            ex.submit(read, rng)
+        left = len(ranges)
+        try:
+            while left:
+                item = q.get()
+                if item is done:
+                    left -= 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+            while left:   # unblock readers still waiting on a full queue
+                if q.get() is done:
+                    left -= 1
+
+def pg_select_all(table: str, select: str, *, filters: Optional[Dict[str, str]]=None,
+                  order: Optional[str]=None, desc: bool=False, page_size: int=1000,
+                  keyset: Optional[str]=None) -> List[Dict[str, Any]]:
+    if keyset is None and order is None and READ_WORKERS > 1 and table in KEYSET_COLUMNS:
+        return pg_select_all_parallel(table, select, filters=filters, page_size=page_size)
+    out: List[Dict[str, Any]] = []
+    for chunk in pg_iter_pages(table, select, filters=filters, order=order, desc=desc,
+                               page_size=page_size, keyset=keyset):
+        out.extend(chunk)
     return out
 
-def pg_upsert(table: str, row: dict, on_conflict: str) -> None:
-    params = {"on_conflict": on_conflict}
-    headers = {**HEADERS, "Prefer": "resolution=merge-duplicates"}
-    backoff = 0.5
-    for attempt in range(1, 7):
+def select_in(table: str, select: str, column: str, values: Sequence[Any], *,
+              chunk: int = IN_CHUNK) -> List[Dict[str, Any]]:
+    """Rows whose `column` is in `values`, looked up in URL-sized chunks."""
+    out: List[Dict[str, Any]] = []
+    for part in chunked(values, chunk):
+        out.extend(pg_select(table, select, filters={column: pg_in(part)}))
+    return out
+
+def count_rows(table: str, column: str = "*", *, filters: Optional[Dict[str, str]] = None) -> int:
+    """Exact row count via Content-Range; -1 if unavailable."""
+    try:
+        r = _request("GET", table, params={"select": column, **(filters or {})}, headers={"Prefer": "count=exact", "Range": "0-0"},
+                     what="count_rows")
+        cr = r.headers.get("Content-Range", "")
+        return int(cr.split("/")[-1]) if "/" in cr else -1
+    except Exception:
+        return -1
+
+def _json_batches(rows: Iterable[Dict[str, Any]], max_rows: int, max_bytes: int) -> Iterator[List[bytes]]:
+    """Serialise each row once and cut batches on row count or body size, whichever comes first."""
+    buf: List[bytes] = []
+    size = 2
+    for row in rows:
+        b = json.dumps(row, separators=(",", ":"), default=str).encode()
+        if buf and (len(buf) >= max_rows or size + len(b) + 1 > max_bytes):
+            yield buf
+            buf, size = [], 2
+        buf.append(b)
+        size += len(b) + 1
+    if buf:
+        yield buf
+
+def post_rows(table: str, body: bytes, n_rows: int, on_conflict: str, *, timeout: float = 90,
+              attempts: Optional[int] = None, resolution: str = "merge-duplicates") -> BatchResult:
+    """
+    POST one pre-serialised JSON array as an upsert on `on_conflict`.
+    resolution="ignore-duplicates" inserts only new keys (ON CONFLICT DO NOTHING).
+    """
+    headers = {"Prefer": f"resolution={resolution},return=minimal"}
+    t0 = time.time()
+    try:
+        r = _request("POST", table, params={"on_conflict": on_conflict}, data=body, headers=headers,
+                     timeout=timeout, what="upsert", attempts=attempts)
+        return BatchResult(True, n_rows, r.status_code, "", time.time() - t0)
+    except Exception as e:
+        return BatchResult(False, n_rows, _status_of(e), str(e)[:200], time.time() - t0,
+                           timed_out=isinstance(e, (requests.Timeout, TimeoutError)))
+
+def upsert_many(table: str, rows: Iterable[Dict[str, Any]], on_conflict: str, *,
+                max_rows: int = UPSERT_MAX_ROWS, max_bytes: int = UPSERT_MAX_BYTES,
+                timeout: float = 90) -> List[BatchResult]:
+    """Bulk upsert, chunked by row count and payload size. One BatchResult per POST."""
+    results: List[BatchResult] = []
+    for parts in _json_batches(rows, max(1, max_rows), max_bytes):
+        res = post_rows(table, b"[" + b",".join(parts) + b"]", len(parts), on_conflict, timeout=timeout)
+        if not res.ok:
+            print(f"[UPSERT ERR] table={table} rows={res.rows} status={res.status} sample={parts[0][:160]!r} {res.error[:160]}")
+        results.append(res)
+    return results
+
+def delete_in(table: str, column: str, values: Sequence[Any], *, chunk: int = IN_CHUNK) -> List[BatchResult]:
+    """DELETE rows whose `column` is in `values` (e.g. country=in.(...)), chunked to keep URLs short."""
+    results: List[BatchResult] = []
+    for part in chunked(values, chunk):
+        t0 = time.time()
         try:
-            r = requests.post(f"{BASE_REST}/{table}", headers=headers, params=params, json=row, timeout=30)
-            if r.status_code in (200, 201, 204):
-                return
-            r.raise_for_status()
+            r = _request("DELETE", table, params={column: pg_in(part)}, what="delete_in")
+            results.append(BatchResult(True, len(part), r.status_code, "", time.time() - t0))
         except Exception as e:
-            msg = str(e)
-            if attempt == 6 or not _retryable(msg):
-                print(f"[ERROR] pg_upsert {table}: {msg[:200]} | row={str(row)[:160]}")
-                return
-            backoff = _backoff_sleep(backoff)
+            results.append(BatchResult(False, len(part), _status_of(e), str(e)[:200], time.time() - t0))
+    return results
+
+def pg_upsert(table: str, row: dict, on_conflict: str) -> None:
+    upsert_many(table, [row], on_conflict, timeout=30)
 
 def pg_delete(table: str, filters: Dict[str, str]) -> None:
-    params = dict(filters)
-    backoff = 0.5
-    for attempt in range(1, 7):
-        try:
-            r = requests.delete(f"{BASE_REST}/{table}", headers=HEADERS, params=params, timeout=30)
-            if r.status_code in (200, 204):
-                return
-            r.raise_for_status()
-        except Exception as e:
-            msg = str(e)
-            if attempt == 6 or not _retryable(msg):
-                print(f"[ERROR] pg_delete {table}: {msg[:200]} | filters={filters}")
-                return
-            backoff = _backoff_sleep(backoff)
+    try:
+        _request("DELETE", table, params=dict(filters), what="pg_delete")
+    except Exception as e:
+        print(f"[ERROR] pg_delete {table}: {str(e)[:200]} | filters={filters}")
+
+def pg_rpc(fn: str, args: Optional[Dict[str, Any]] = None, *, timeout: int = 120,
+           attempts: Optional[int] = None) -> Any:
+    """Call a Postgres function via PostgREST (POST /rpc/<fn>). Raises on failure.
+    Pass attempts=1 for functions that are not idempotent."""
+    r = _request("POST", f"rpc/{fn}", json_body=args or {}, timeout=timeout, ok=(200, 204), what="pg_rpc",
+                 attempts=attempts)
+    return r.json() if r.content else None
 
 def pg_truncate(table: str) -> None:
     """No direct TRUNCATE via PostgREST; emulate by deleting all."""
     pg_delete(table, {})  # dangerous only if RLS is open; we use service role
+
+def storage_upload(bucket: str, path: str, body: bytes, *, content_type: str,
+                   cache_control: Optional[str] = None, timeout: float = 60) -> None:
+    """Create or overwrite one Supabase Storage object (POST /object/<bucket>/<path>, x-upsert). Raises on failure."""
+    headers = {"Content-Type": content_type, "x-upsert": "true"}
+    if cache_control:
+        headers["cache-control"] = cache_control
+    _request("POST", f"object/{bucket}/{path.lstrip('/')}", data=body, headers=headers, timeout=timeout,
+             ok=(200, 201), what="storage_upload", base=BASE_STORAGE, service="storage")
+
+def storage_public_url(bucket: str, path: str) -> str:
+    return f"{BASE_STORAGE}/object/public/{bucket}/{path.lstrip('/')}"
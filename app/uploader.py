@@ -0,0 +1,165 @@
+# app/uploader.py  (CONCURRENT BATCH UPSERTS)
+"""
+Bounded pool of upload workers for bulk PostgREST upserts.
+
+Rows are serialised once on submit() and cut into batches of the current
+target size; up to `workers` POSTs are in flight on the shared keep-alive
+session while at most 2 x workers batches wait in the queue (submit blocks
+beyond that, so memory stays bounded).
+
+The batch size adapts: it grows while POSTs come back well under the target
+latency, shrinks when they are slow, and halves on 413 / timeouts. A batch
+that fails with a row-level error is bisected and the halves are retried, so
+a single poison row costs ~log2(n) extra POSTs instead of failing the whole
+batch; rows that still fail alone are reported as poison.
+
+on_rows, if given, gets the rows of every batch that was stored (decoded again
+from the sent JSON), on the upload worker that sent it, so follow-up work only
+ever sees rows that are already in the table.
+"""
+import json
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .supa import BatchResult, post_rows, UPSERT_MAX_BYTES
+
+# failures worth splitting: payload too large, timeouts, row-level rejects
+BISECT_STATUSES = (400, 408, 409, 413, 422, 500, 504)
+SHRINK_STATUSES = (408, 413, 504)
+
+_END = object()
+
+
+class BatchUploader:
+    def __init__(self, table: str, on_conflict: str, *, workers: int = 4,
+                 batch_rows: int = 1000, min_rows: int = 50, max_rows: int = 5000,
+                 max_bytes: int = UPSERT_MAX_BYTES, target_sec: float = 5.0, timeout: float = 90,
+                 attempts: int = 3, sleep: float = 0.0, resolution: str = "merge-duplicates",
+                 on_batch: Optional[Callable[[BatchResult, Dict[str, Any]], None]] = None,
+                 on_rows: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+        self.table = table
+        self.on_conflict = on_conflict
+        self.min_rows = max(1, min_rows)
+        self.max_rows = max(self.min_rows, max_rows)
+        self.batch_rows = min(max(batch_rows, self.min_rows), self.max_rows)
+        self.max_bytes = max_bytes
+        self.target_sec = target_sec
+        self.timeout = timeout
+        self.attempts = attempts
+        self.sleep = sleep
+        self.resolution = resolution
+        self.on_batch = on_batch
+        self.on_rows = on_rows
+        self.stats: Dict[str, Any] = {"submitted": 0, "ok": 0, "fail": 0, "posts": 0, "splits": 0,
+                                      "batch_rows": self.batch_rows, "poison": []}
+        self._buf: List[bytes] = []
+        self._buf_bytes = 2
+        self._lock = threading.Lock()
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(1, workers) * 2)
+        self._threads = [threading.Thread(target=self._work, name=f"upload-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    # ---------- producer side ----------
+    def submit(self, rows: Iterable[Dict[str, Any]]) -> None:
+        for row in rows:
+            b = json.dumps(row, separators=(",", ":"), default=str).encode()
+            if self._buf and (len(self._buf) >= self.batch_rows or self._buf_bytes + len(b) + 1 > self.max_bytes):
+                self._put()
+            self._buf.append(b)
+            self._buf_bytes += len(b) + 1
+            self.stats["submitted"] += 1
+
+    def _put(self) -> None:
+        if self._buf:
+            self._q.put(self._buf)
+            self._buf, self._buf_bytes = [], 2
+
+    def flush(self) -> None:
+        """Send what is buffered and wait until every queued batch has been posted."""
+        self._put()
+        self._q.join()
+
+    def close(self) -> Dict[str, Any]:
+        self.flush()
+        for _ in self._threads:
+            self._q.put(_END)
+        for t in self._threads:
+            t.join()
+        return self.stats
+
+    def __enter__(self) -> "BatchUploader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ---------- workers ----------
+    def _work(self) -> None:
+        while True:
+            parts = self._q.get()
+            try:
+                if parts is _END:
+                    return
+                self._send(parts)
+                if self.sleep > 0:
+                    time.sleep(self.sleep)
+            finally:
+                self._q.task_done()
+
+    def _send(self, parts: List[bytes]) -> None:
+        body = b"[" + b",".join(parts) + b"]"
+        res = post_rows(self.table, body, len(parts), self.on_conflict,
+                        timeout=self.timeout, attempts=self.attempts, resolution=self.resolution)
+        self._adapt(res)
+        if res.status == 413:
+            # the server's body limit is below this size: cap future batches by bytes too
+            with self._lock:
+                self.max_bytes = max(4096, min(self.max_bytes, int(len(body) * 0.75)))
+        if res.ok:
+            self._record(res)
+            if self.on_rows:
+                try:
+                    self.on_rows([json.loads(p) for p in parts])
+                except Exception as e:   # never let a callback take an upload worker down
+                    print(f"[UPLOAD] on_rows callback failed for {len(parts)} rows: {str(e)[:160]}")
+            return
+        if len(parts) > 1 and (res.status in BISECT_STATUSES or res.timed_out):
+            with self._lock:
+                self.stats["splits"] += 1
+            mid = len(parts) // 2
+            self._send(parts[:mid])
+            self._send(parts[mid:])
+            return
+        if len(parts) == 1:
+            with self._lock:
+                if len(self.stats["poison"]) < 20:
+                    self.stats["poison"].append(parts[0][:200])
+            print(f"[UPLOAD] poison row in {self.table} status={res.status}: {parts[0][:160]!r} {res.error[:120]}")
+        else:
+            print(f"[UPLOAD ERR] table={self.table} rows={res.rows} status={res.status} {res.error[:160]}")
+        self._record(res)
+
+    def _adapt(self, res: BatchResult) -> None:
+        with self._lock:
+            self.stats["posts"] += 1
+            n = self.batch_rows
+            if not res.ok and (res.status in SHRINK_STATUSES or res.timed_out):
+                n = n // 2
+            elif res.ok and res.rows >= n // 2:
+                # only full-ish batches say anything about the size
+                if res.elapsed < self.target_sec * 0.5:
+                    n = int(n * 1.25) + 1
+                elif res.elapsed > self.target_sec:
+                    n = int(n * 0.7)
+            self.batch_rows = min(max(n, self.min_rows), self.max_rows)
+            self.stats["batch_rows"] = self.batch_rows
+
+    def _record(self, res: BatchResult) -> None:
+        with self._lock:
+            self.stats["ok" if res.ok else "fail"] += res.rows
+            if self.on_batch:
+                self.on_batch(res, self.stats)
@@ -1,20 +1,32 @@
 # app/worker.py  (FAST + VERBOSE)
 import os
 import time
-import math
-import random
 import requests
-from datetime import datetime, timezone
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta, timezone
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Optional, Tuple
 
 from .config import (
-    SUPABASE_URL, SUPABASE_KEY, SIRIX_TOKEN, RATE_DELAY_SEC, TZ_LABEL,
+    SUPABASE_URL, SUPABASE_KEY, SIRIX_TOKEN, TZ_LABEL,
     TABLE_CRM_SKIM, TABLE_EXCLUDED, TABLE_ACTIVE,
-    COL_LV_NAME, COL_LV_TEMPNAME, COL_LV_ACCNAME
+    COL_LV_NAME, COL_LV_TEMPNAME, COL_LV_ACCNAME, EXCLUSION_RULES,
+    getenv_float, getenv_int,
 )
-from .classify import split_excluded
-from .aggregate import recompute_country_totals
+from .classify import match_rules, exclusion_reasons, norm_account_id as _norm_id
+from .aggregate import update_country_totals, country_key
+from .supa import pg_select_all, pg_iter_pages, pg_iter_pages_parallel, pg_rpc, select_in, upsert_many
+from .ratelimit import SIRIX_LIMITER, THROTTLE_STATUSES
+from .sirix_cache import SirixCache
+from .sirix_parse import country_and_txs
+from .refresh import plan_refresh
+from .journal import RunJournal, FETCHED, UPSERTED, FAILED
+from .idset import IdSet
+from .parse_pool import ParsePool
+from .metrics import METRICS, serve_metrics
+from .profiling import profile_run
+from .snapshot import publish_allocation_snapshot
 
 # --- Netlify trigger ---
 from .config import E2T_NOTIFY_NETLIFY, NETLIFY_BUILD_HOOK_URL
@@ -31,10 +43,38 @@ def _trigger_netlify():
 
 
 # ---------- Tunables via env ----------
-MAX_WORKERS      = int(os.environ.get("E2T_MAX_WORKERS", "8"))         # threads for Sirix calls
-LOG_EVERY        = int(os.environ.get("E2T_LOG_EVERY", "500"))         # heartbeat interval
-UPSERT_BATCH     = int(os.environ.get("E2T_UPSERT_BATCH", "1000"))     # Supabase batch size
+MAX_WORKERS      = getenv_int("E2T_MAX_WORKERS", 8)                    # threads for Sirix calls
+LOG_EVERY        = getenv_int("E2T_LOG_EVERY", 500)                    # heartbeat interval
+UPSERT_BATCH     = getenv_int("E2T_UPSERT_BATCH", 1000)                # Supabase batch size
+UPSERT_QUEUE     = getenv_int("E2T_UPSERT_QUEUE", 4)                   # batches buffered ahead of the writer
 SKIP_EXISTING    = os.environ.get("E2T_SKIP_EXISTING", "true").lower() in ("1","true","yes","y")
+# skip = never re-fetch accounts already in e2t_active, all = re-fetch everyone,
+# incremental = re-fetch only stale/hot accounts (see app/refresh.py)
+REFRESH_MODES    = ("skip", "all", "incremental")
+REFRESH_MODE     = os.environ.get("E2T_REFRESH_MODE", "").strip().lower() or ("skip" if SKIP_EXISTING else "all")
+if REFRESH_MODE not in REFRESH_MODES:   # a typo must not quietly behave like "all"
+    raise SystemExit(f"[FATAL] E2T_REFRESH_MODE={REFRESH_MODE!r} is not one of: {', '.join(REFRESH_MODES)}")
+REFRESH_MAX_AGE_H = getenv_float("E2T_REFRESH_MAX_AGE_HOURS", 72)              # everyone re-checked at least this often
+REFRESH_HOT_AGE_H = getenv_float("E2T_REFRESH_HOT_AGE_HOURS", 6)               # hot accounts re-checked this often
+REFRESH_HOT_DAYS = getenv_float("E2T_REFRESH_HOT_DAYS", 14)                    # "hot" = created / funded within N days
+REFRESH_LIMIT    = getenv_int("E2T_REFRESH_LIMIT", 0)                          # cap per run (0 = no cap)
+# skip/all modes: ask Postgres for the todo list (Q13) instead of downloading skim + active keys
+PLAN_SERVER_SIDE = os.environ.get("E2T_PLAN_SERVER_SIDE", "true").lower() in ("1","true","yes","y")
+PLAN_PAGE        = getenv_int("E2T_PLAN_PAGE", 5000)                   # skim rows scanned per pending-accounts page
+RPC_PENDING      = "e2t_pending_accounts"
+RPC_SYNC_EXCLUDED = "sync_e2t_excluded"
+FETCH_ENGINE     = os.environ.get("E2T_FETCH_ENGINE", "threads").strip().lower()  # threads | async
+ASYNC_CONCURRENCY = getenv_int("E2T_ASYNC_CONCURRENCY", 200)           # in-flight Sirix calls (async engine)
+PARSE_PROCS      = getenv_int("E2T_PARSE_PROCS", 0)                    # >0 = parse bodies in N worker processes
+PARSE_BATCH      = getenv_int("E2T_PARSE_BATCH", 32)                   # bodies per round trip to a parser process
+RETRY_ROUNDS     = getenv_int("E2T_RETRY_ROUNDS", 2)                   # extra passes over throttled/failed accounts
+FAST_PARSE       = os.environ.get("E2T_FAST_PARSE", "true").lower() in ("1","true","yes","y")  # scan bodies instead of json.loads
+CACHE_ENABLED    = os.environ.get("E2T_CACHE_ENABLED", "true").lower() in ("1","true","yes","y")
+CACHE_PATH       = os.environ.get("E2T_CACHE_PATH", ".cache/sirix_cache.sqlite")
+CACHE_TTL_SEC    = getenv_float("E2T_CACHE_TTL_SEC", 86400)            # per-entry TTL (same-day re-runs hit)
+CACHE_MAX_ENTRIES = getenv_int("E2T_CACHE_MAX_ENTRIES", 1000000)       # LRU cap
+JOURNAL_ENABLED  = os.environ.get("E2T_JOURNAL_ENABLED", "true").lower() in ("1","true","yes","y")
+JOURNAL_PATH     = os.environ.get("E2T_JOURNAL_PATH", ".cache/run_journal.sqlite")  # checkpoint/resume journal
 # --------------------------------------
 
 # --- Plan cutoff (UTC). Only count "Initial Balance" tx at/after this instant ---
@@ -55,140 +95,193 @@ def _parse_iso_utc(s: Optional[str]) -> Optional[datetime]:
 _PLAN_CUTOFF_UTC = _parse_iso_utc(PLAN_CUTOFF_STR) or datetime(2025, 10, 1, 0, 0, 0, tzinfo=timezone.utc)
 
 
-# Supabase REST base and headers
-BASE_REST = f"{SUPABASE_URL.rstrip('/')}/rest/v1"
-HEADERS_BASE = {
-    "apikey": SUPABASE_KEY,
-    "Authorization": f"Bearer {SUPABASE_KEY}",
-    "Accept": "application/json",
-    "Content-Type": "application/json",
-}
+# Local Sirix response cache (opened per run by run_once; None = disabled)
+_cache: Optional[SirixCache] = None
 
 # ---------------- Sirix call (inlined; similar to app/sirix.py but no import overhead per-call) -------------
 SIRIX_API_URL = os.environ.get("SIRIX_API_URL", "https://restapi-real3.sirixtrader.com/api/UserStatus/GetUserTransactions").strip()
-def _norm_id(v: Any) -> Optional[str]:
-    if v is None or (isinstance(v, float) and math.isnan(v)): return None
-    s = str(v).strip()
-    try: return str(int(float(s)))
-    except Exception: return s
+def _sirix_headers() -> Dict[str, str]:
+    return {"Authorization": f"Bearer {SIRIX_TOKEN}", "Content-Type": "application/json", "Accept": "application/json"}
+
+def _sirix_payload(aid: str) -> Dict[str, Any]:
+    return {
+        "UserID": aid,
+        "GetOpenPositions": False,
+        "GetPendingPositions": False,
+        "GetClosePositions": False,
+        "GetMonetaryTransactions": True,
+    }
+
+def plan_from_txs(txs):
+    """Returns (plan, last_tx_time) over the qualifying "Initial Balance" transactions."""
+    # SUM all qualifying "Initial Balance" transactions at/after the cutoff.
+    total_amt = 0.0
+    found_any = False
+    last_tx = None
+
+    for tstamp, amt in txs:
+        tstamp = _parse_iso_utc(tstamp)
+        if tstamp is None or tstamp < _PLAN_CUTOFF_UTC:
+            continue
 
-def fetch_country_and_plan(uid: Any) -> Optional[Dict[str, Any]]:
+        try:
+            amt = float(amt)
+        except (TypeError, ValueError):
+            continue
+
+        if amt is None:
+            continue
+
+        total_amt += amt
+        found_any = True
+        if last_tx is None or tstamp > last_tx:
+            last_tx = tstamp
+
+    return (total_amt if found_any else None), last_tx
+
+def build_result(aid: str, country: Optional[str], txs, fetched_at: Optional[float] = None) -> Dict[str, Any]:
+    """fetched_at (epoch seconds) is when Sirix returned txs; None = just now."""
+    plan, last_tx = plan_from_txs(txs)
+    checked = datetime.fromtimestamp(fetched_at, timezone.utc) if fetched_at is not None else datetime.now(timezone.utc)
+    return {
+        "account_id": aid,
+        "country": country,
+        "plan": plan,
+        "last_tx_time": last_tx.isoformat() if last_tx else None,
+        "last_checked_at": checked.isoformat(),
+    }
+
+def parse_country_and_plan(aid: str, body: bytes) -> Dict[str, Any]:
+    """Turn a raw GetUserTransactions body into the {account_id, country, plan, ...} result."""
+    country, txs = country_and_txs(body, fast=FAST_PARSE)
+    if _cache is not None:
+        _cache.put(aid, country, txs)
+    return build_result(aid, country, txs)
+
+def parse_batch(items: List[Any], fast: bool = True) -> List[Any]:
+    """
+    Parser-process side of E2T_PARSE_PROCS: [(aid, body), ...] → [(result, country, txs), ...].
+    country/txs ride along so the parent can fill the cache (the sqlite handle stays there).
+    """
+    out = []
+    for aid, body in items:
+        try:
+            country, txs = country_and_txs(body, fast=fast)
+            out.append((build_result(aid, country, txs), country, txs))
+        except Exception as e:
+            out.append((_parse_error(aid, e), None, None))
+    return out
+
+def _parse_error(aid: str, e: BaseException) -> Dict[str, Any]:
+    # "__parse__": the body arrived but could not be parsed; fetching it again would not help
+    return {"__error__": (str(e) or type(e).__name__)[:160], "__parse__": True, "account_id": aid}
+
+def _raw_body(aid: str, body: bytes) -> Dict[str, Any]:
+    return {"account_id": aid, "__body__": body}
+
+def fetch_raw(uid: Any) -> Optional[Dict[str, Any]]:
+    """Sirix call only: {"account_id", "__body__": bytes} or {"__error__", "account_id"}."""
     aid = _norm_id(uid)
     if not aid: return None
     try:
-        headers = {"Authorization": f"Bearer {SIRIX_TOKEN}", "Content-Type": "application/json", "Accept": "application/json"}
-        payload = {
-            "UserID": aid,
-            "GetOpenPositions": False,
-            "GetPendingPositions": False,
-            "GetClosePositions": False,
-            "GetMonetaryTransactions": True,
-        }
-        r = requests.post(SIRIX_API_URL, headers=headers, json=payload, timeout=25)
+        SIRIX_LIMITER.acquire()
+        t0 = time.perf_counter()
+        try:
+            r = requests.post(SIRIX_API_URL, headers=_sirix_headers(), json=_sirix_payload(aid), timeout=25)
+        except Exception:
+            METRICS.request("sirix", "error", time.perf_counter() - t0)
+            raise
+        METRICS.request("sirix", r.status_code, time.perf_counter() - t0)
+        SIRIX_LIMITER.feedback(r.status_code, r.headers.get("Retry-After"))
         if r.status_code != 200:
             return {"__error__": f"{r.status_code}", "account_id": aid}
-
-        data = r.json() or {}
-
-        country = (data.get("UserData") or {}).get("UserDetails", {}).get("Country")
-
-        # SUM all qualifying "Initial Balance" transactions at/after the cutoff.
-        total_amt = 0.0
-        found_any = False
-
-        for t in (data.get("MonetaryTransactions") or []):
-            comment = str(t.get("Comment", "")).strip().lower()
-            if not comment.startswith("initial balance"):
-                continue
-
-            tstamp = _parse_iso_utc(t.get("Time"))
-            if tstamp is None or tstamp < _PLAN_CUTOFF_UTC:
-                continue
-
-            amt = t.get("Amount")
-            try:
-                amt = float(amt)
-            except (TypeError, ValueError):
-                continue
-
-            if amt is None:
-                continue
-
-            total_amt += amt
-            found_any = True
-
-        plan = total_amt if found_any else None
-        return {"account_id": aid, "country": country, "plan": plan}
+        return _raw_body(aid, r.content)
 
     except Exception as e:
         return {"__error__": str(e)[:160], "account_id": aid}
+
+def fetch_country_and_plan(uid: Any) -> Optional[Dict[str, Any]]:
+    res = fetch_raw(uid)
+    if not res or "__body__" not in res:
+        return res
+    try:
+        return parse_country_and_plan(res["account_id"], res["__body__"])
+    except Exception as e:
+        return _parse_error(res["account_id"], e)
+
+def _is_retryable(res: Dict[str, Any]) -> bool:
+    """Throttled (429/503), other 5xx and network errors are worth another pass; 4xx and parse errors are not."""
+    if res.get("__parse__"):
+        return False
+    err = str(res.get("__error__") or "")
+    if not err.isdigit():
+        return True
+    status = int(err)
+    return status in THROTTLE_STATUSES or status >= 500
 # -----------------------------------------------------------------------------------------------------------
 
 # --------------- Supabase helpers (batch upsert + select existing keys) -----------------
-def make_supa_session() -> requests.Session:
-    s = requests.Session()
-    s.headers.update(HEADERS_BASE)
-    return s
-
-def supa_select_all(session: requests.Session, table: str, cols: str, page_size: int = 1000) -> List[Dict[str, Any]]:
-    out: List[Dict[str, Any]] = []
-    offset = 0
-    while True:
-        params = {"select": cols, "limit": page_size, "offset": offset}
-        r = session.get(f"{BASE_REST}/{table}", params=params, timeout=60)
-        if r.status_code not in (200,206): r.raise_for_status()
-        chunk = r.json() or []
-        if not chunk: break
-        out.extend(chunk)
-        if len(chunk) < page_size: break
-        offset += page_size
-    return out
-
-def supa_fetch_existing_active_keys(session: requests.Session) -> set:
-    keys = set()
-    offset = 0
-    page_size = 2000
-    while True:
-        params = {"select": "account_id", "limit": page_size, "offset": offset}
-        r = session.get(f"{BASE_REST}/{TABLE_ACTIVE}", params=params, timeout=60)
-        if r.status_code not in (200,206): break
-        rows = r.json() or []
-        if not rows: break
-        keys.update((str(x.get("account_id") or "").strip() for x in rows))
-        if len(rows) < page_size: break
-        offset += page_size
+def supa_select_all(table: str, cols: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+    return pg_select_all(table, cols, page_size=page_size)
+
+def supa_fetch_existing_active_keys() -> IdSet:
+    """
+    All e2t_active ids, folded page by page into a compact IdSet (no full row list).
+    Raises on a failed read: an empty set would make skip mode re-fetch every account.
+    """
+    keys = IdSet()
+    try:
+        for page in pg_iter_pages_parallel(TABLE_ACTIVE, "account_id", page_size=2000):
+            keys.add_many([str(x.get("account_id") or "").strip() for x in page])
+    except Exception as e:
+        raise RuntimeError(f"{TABLE_ACTIVE} key read failed, cannot skip existing accounts: {str(e)[:160]}") from e
     return keys
 
-def supa_upsert_batch(session: requests.Session, table: str, rows: List[Dict[str, Any]], on_conflict: str) -> bool:
-    if not rows: return True
-    params = {"on_conflict": on_conflict}
-    headers = {**HEADERS_BASE, "Prefer": "resolution=merge-duplicates"}
-    backoff = 0.5
-    for attempt in range(1, 6):
-        try:
-            r = session.post(f"{BASE_REST}/{table}", params=params, json=rows, headers=headers, timeout=90)
-            if r.status_code in (200,201,204): return True
-            if r.status_code == 400:
-                print(f"[UPSERT 400] table={table} sample={str(rows[0])[:180]} resp={r.text[:180]}")
-                return False
-            r.raise_for_status()
-        except Exception as e:
-            msg = str(e)
-            if attempt == 5 or "timeout" not in msg.lower():
-                print(f"[UPSERT ERR] table={table} {msg[:180]}")
-                return False
-            time.sleep(backoff * (1.0 + random.random() * 0.35))
-            backoff = min(backoff * 1.8, 8.0)
-    return False
-
-def chunked(seq, n):
-    buf = []
-    for x in seq:
-        buf.append(x)
-        if len(buf) >= n:
-            yield buf
-            buf = []
-    if buf: yield buf
+def iter_pending_pages(skip_active: bool):
+    """
+    The todo list from e2t_pending_accounts (Q13), one keyset page at a time:
+    {"ids", "scanned", "excluded", "skipped", "next"}. Only pending ids cross the wire.
+    """
+    rules = [list(r) for r in EXCLUSION_RULES]
+    after = None
+    while True:
+        page = pg_rpc(RPC_PENDING, {"after_name": after, "page_size": PLAN_PAGE,
+                                    "rules": rules, "skip_active": skip_active}) or {}
+        yield page
+        after = page.get("next")
+        if not after:
+            return
+
+def supa_sync_excluded() -> int:
+    """Upsert every excluded skim row into e2t_excluded in one statement (Q13); returns rows."""
+    return int(pg_rpc(RPC_SYNC_EXCLUDED, {"rules": [list(r) for r in EXCLUSION_RULES]}) or 0)
+
+def supa_fetch_active_by_ids(ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Current {account_id: {country, plan}} for the given ids."""
+    rows = select_in(TABLE_ACTIVE, "account_id,country,plan", "account_id", ids)
+    return {str(x.get("account_id") or "").strip(): x for x in rows}
+
+def fold_deltas(deltas: Dict[str, float], rows: List[Dict[str, Any]], prev: Dict[str, Dict[str, Any]]) -> None:
+    """Add (new plan − previous plan) per country; every touched country gets an entry."""
+    for r in rows:
+        old = prev.get(r["account_id"])
+        if old is not None:
+            c = country_key(old.get("country"))
+            deltas[c] = deltas.get(c, 0.0) - float(old.get("plan") or 0)
+        c = country_key(r.get("country"))
+        deltas[c] = deltas.get(c, 0.0) + float(r.get("plan") or 0)
+
+def supa_upsert_batch(table: str, rows: List[Dict[str, Any]], on_conflict: str) -> Tuple[List[Dict[str, Any]], int]:
+    """(rows stored, rows failed). upsert_many POSTs consecutive slices of `rows`, one BatchResult each."""
+    stored: List[Dict[str, Any]] = []
+    failed = i = 0
+    for res in upsert_many(table, rows, on_conflict, max_rows=UPSERT_BATCH):
+        if res.ok:
+            stored.extend(rows[i:i + res.rows])
+        else:
+            failed += res.rows
+        i += res.rows
+    return stored, failed
 # ---------------------------------------------------------------------------------------
 
 def assert_env():
@@ -199,127 +292,493 @@ def assert_env():
     if missing:
         raise SystemExit(f"[FATAL] Missing env vars: {', '.join(missing)}")
 
-def run_once():
+_END = object()   # end-of-stream marker between pipeline stages
+
+class _Cancelled(Exception):
+    """Raised inside the planner once the fetch stage has failed."""
+
+def _drain(q: "queue.Queue"):
+    """Iterate a stage queue until its end marker."""
+    while True:
+        item = q.get()
+        if item is _END:
+            return
+        yield item
+
+def run_once(resume: bool = False, refresh_mode: Optional[str] = None):
+    """
+    Streaming pipeline, each stage joined by a bounded queue (a full queue
+    blocks the stage feeding it):
+
+      CRM pages ─▶ classify/dedupe/skip ─▶ ids_q ─▶ Sirix fetch ─▶ buffer ─▶ upsert_q ─▶ writer
+                          └──────── excluded rows ────────────────────────────────▶ writer
+
+    Results are persisted every UPSERT_BATCH accounts while fetching continues,
+    so memory stays flat and a crash only loses the batch in flight.
+
+    In skip/all modes stage 1 pages through the e2t_pending_accounts RPC (Q13)
+    when it is deployed, so only pending ids are downloaded.
+
+    With E2T_PARSE_PROCS > 0 the fetch stage only downloads bodies; parsing
+    runs in a process pool (app/parse_pool.py) and results come back in batches.
+
+    Progress is checkpointed in the run journal; with resume=True an
+    unfinished previous run is continued instead of starting over.
+    refresh_mode overrides E2T_REFRESH_MODE for this run (skip | all | incremental).
+
+    E2T_PROFILE=cpu,mem,timeline profiles the whole run (app/profiling.py).
+    """
+    mode = (refresh_mode or REFRESH_MODE).strip().lower()
+    if mode not in REFRESH_MODES:
+        raise ValueError(f"unknown refresh mode {mode!r} (expected one of: {', '.join(REFRESH_MODES)})")
+    with profile_run("worker"):
+        return _run_once(resume, mode)
+
+def _run_once(resume: bool, refresh_mode: str):
+    global _cache
     started = time.time()
     print(f"[SERVICE] Starting run (TZ={TZ_LABEL})")
     assert_env()
-    session = make_supa_session()
-
-    # 1) Load CRM skim
-    cols = f"{COL_LV_NAME},{COL_LV_TEMPNAME},{COL_LV_ACCNAME}"
-    crm_rows = supa_select_all(session, TABLE_CRM_SKIM, cols)
-    total_crm = len(crm_rows)
-    if total_crm == 0:
-        print(f"[WARN] No rows in {TABLE_CRM_SKIM}. Populate this table first.")
-        return
-
-    # 2) Filter out audition/free trial
-    excluded, to_process_rows = split_excluded(crm_rows)
-    print(f"[INFO] Read {total_crm:,} CRM rows → Excluded: {len(excluded):,} | To process: {len(to_process_rows):,}")
-
-    # 2a) Upsert excluded in batch
-    excl_payload = [{"account_id": r["account_id"], "reason": r["reason"], "tempname": r["tempname"]} for r in excluded]
-    up_ok = 0
-    for batch in chunked(excl_payload, UPSERT_BATCH):
-        if supa_upsert_batch(session, TABLE_EXCLUDED, batch, on_conflict="account_id"):
-            up_ok += len(batch)
-    if excl_payload:
-        print(f"[INFO] Excluded upserts: {up_ok:,}")
-
-    # 3) Build account_id list to process (dedupe)
-    todo = []
-    seen = set()
-    for r in to_process_rows:
-        aid = _norm_id(r.get(COL_LV_NAME))
-        if not aid: continue
-        if aid in seen: continue
-        seen.add(aid)
-        todo.append(aid)
-    print(f"[INFO] Unique accounts to fetch from Sirix: {len(todo):,}")
-
-    # 3a) Optionally skip accounts already present in e2t_active
-    skipped_existing = 0
-    if SKIP_EXISTING:
-        existing = supa_fetch_existing_active_keys(session)
-        if existing:
-            before = len(todo)
-            todo = [x for x in todo if x not in existing]
-            skipped_existing = before - len(todo)
-            print(f"[INFO] SKIP_EXISTING enabled → skipped {skipped_existing:,} already in {TABLE_ACTIVE}; to fetch: {len(todo):,}")
-
-    if not todo:
-        print("[INFO] Nothing to fetch from Sirix.")
-        recompute_country_totals()
-        print("[DONE] Country allocation recomputed.")
-        return
+    serve_metrics()
+    METRICS.start_run("worker")
+
+    journal = RunJournal(JOURNAL_PATH) if JOURNAL_ENABLED else None
+    resumed = journal.unfinished() if (journal and resume) else None
+    resume_ids: Optional[List[str]] = None
+    already_done = IdSet()
+    if resumed:
+        run_id = journal.reopen(resumed[0])
+        if resumed[2]:   # todo snapshot was complete
+            resume_ids = journal.remaining()
+            print(f"[RESUME] Continuing run {run_id}: {len(resume_ids):,} accounts left")
+        else:
+            already_done = IdSet(journal.upserted())
+            print(f"[RESUME] Continuing run {run_id} (todo snapshot incomplete) → re-planning, "
+                  f"skipping {len(already_done):,} already upserted")
+    elif journal:
+        run_id = journal.start(refresh_mode)
+        print(f"[JOURNAL] Run {run_id}")
+
+    ids_q: queue.Queue = queue.Queue(maxsize=max(UPSERT_BATCH, ASYNC_CONCURRENCY, MAX_WORKERS) * 4)
+    upsert_q: queue.Queue = queue.Queue(maxsize=UPSERT_QUEUE)
+    stage_errors: List[BaseException] = []
+    plan_stats = {"crm": 0, "excluded": 0, "unique": 0, "skipped": 0, "queued": 0}
+    cancel = threading.Event()   # set when the fetch stage fails: nobody reads ids_q any more
+
+    def put(q: queue.Queue, item) -> None:
+        # planner-side put that gives up once the run is cancelled instead of blocking forever
+        while True:
+            if cancel.is_set():
+                raise _Cancelled()
+            try:
+                q.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
 
-    # 4) Parallel Sirix fetch
-    ok_results: List[Dict[str, Any]] = []
+    # ---- stage 1: CRM pages → classification → dedupe/skip → ids_q ----
+    def enqueue(ids: List[str]) -> None:
+        if journal:
+            journal.add_todo(ids)
+        for aid in ids:
+            plan_stats["queued"] += 1
+            put(ids_q, aid)
+        METRICS.progress(queued=plan_stats["queued"], crm_rows=plan_stats["crm"], excluded=plan_stats["excluded"])
+
+    def plan_server_side() -> bool:
+        """Todo list from Postgres (Q13). False, with nothing queued, when the functions are missing."""
+        pages = iter_pending_pages(skip_active=refresh_mode == "skip")
+        try:
+            up_stats["excl_ok"] += supa_sync_excluded()
+            page = next(pages)
+        except Exception as e:
+            print(f"[WARN] Server-side planning unavailable ({str(e)[:120]}) → planning from full tables")
+            return False
+        seen = IdSet()
+        while page is not None:
+            ids = [str(x) for x in page.get("ids") or []]
+            plan_stats["crm"] += int(page.get("scanned") or 0)
+            plan_stats["excluded"] += int(page.get("excluded") or 0)
+            active = int(page.get("skipped") or 0)
+            keep = seen.add_many(ids)
+            skip = keep & already_done.contains_many(ids)
+            plan_stats["unique"] += active + int(keep.sum())
+            plan_stats["skipped"] += active + int(skip.sum())
+            enqueue([aid for aid, k, sk in zip(ids, keep.tolist(), skip.tolist()) if k and not sk])
+            page = next(pages, None)
+        print(f"[INFO] Server-side plan over {plan_stats['crm']:,} CRM rows → Excluded: {plan_stats['excluded']:,} | "
+              f"Unique to process: {plan_stats['unique']:,} | skipped {plan_stats['skipped']:,} already done")
+        return True
+
+    def planner():
+        with METRICS.stage("plan"):
+            plan_ids()
+
+    def plan_ids():
+        try:
+            if resume_ids is not None:
+                for aid in resume_ids:
+                    plan_stats["queued"] += 1
+                    put(ids_q, aid)
+                return
+
+            if PLAN_SERVER_SIDE and refresh_mode in ("skip", "all") and plan_server_side():
+                if journal:
+                    journal.mark_todo_complete()
+                return
+
+            cols = f"{COL_LV_NAME},{COL_LV_TEMPNAME},{COL_LV_ACCNAME}"
+            if refresh_mode == "incremental":
+                cols += ",src_loaded_at"
+
+            existing = supa_fetch_existing_active_keys() if refresh_mode == "skip" else IdSet()
+            seen = IdSet()
+            held: List[str] = []               # incremental mode ranks the whole population first
+            crm_loaded_at: Dict[str, Any] = {}
+
+            for page in pg_iter_pages(TABLE_CRM_SKIM, cols):
+                page_ids: List[str] = []
+                plan_stats["crm"] += len(page)
+                # classify straight from the page's columns: no per-row dicts in or out
+                temps = [str(r.get(COL_LV_TEMPNAME) or "") for r in page]
+                names = [r.get(COL_LV_NAME) for r in page]
+                hits = match_rules(temps)
+                exc_idx, reasons = exclusion_reasons(hits)
+                if len(exc_idx):
+                    plan_stats["excluded"] += len(exc_idx)
+                    put(upsert_q, (TABLE_EXCLUDED, [
+                        {"account_id": str(names[i] or "").strip(), "reason": reason, "tempname": temps[i]}
+                        for i, reason in zip(exc_idx.tolist(), reasons)
+                    ]))
+                # dedupe + skip for the whole page at once (vectorised IdSet lookups)
+                aids, rows = [], []
+                for i in (~hits.any(axis=1)).nonzero()[0].tolist():
+                    aid = _norm_id(names[i])
+                    if aid:
+                        aids.append(aid)
+                        rows.append(i)
+                keep = seen.add_many(aids)
+                plan_stats["unique"] += int(keep.sum())
+                skip = keep & (existing.contains_many(aids) | already_done.contains_many(aids))
+                plan_stats["skipped"] += int(skip.sum())
+                for aid, i, k, sk in zip(aids, rows, keep.tolist(), skip.tolist()):
+                    if not k or sk:
+                        continue
+                    if refresh_mode == "incremental":
+                        held.append(aid)
+                        crm_loaded_at[aid] = _parse_iso_utc(page[i].get("src_loaded_at"))
+                        continue
+                    page_ids.append(aid)
+                enqueue(page_ids)
+
+            print(f"[INFO] Read {plan_stats['crm']:,} CRM rows → Excluded: {plan_stats['excluded']:,} | "
+                  f"Unique to process: {plan_stats['unique']:,}")
+            if refresh_mode == "skip" and existing:
+                print(f"[INFO] SKIP_EXISTING enabled → skipped {plan_stats['skipped']:,} already in {TABLE_ACTIVE}")
+            del existing, seen
+
+            if refresh_mode == "incremental":
+                meta_rows = supa_select_all(TABLE_ACTIVE, "account_id,last_checked_at,last_tx_time")
+                existing_meta = {str(x.get("account_id") or "").strip(): x for x in meta_rows}
+                ranked, tiers = plan_refresh(
+                    held, existing_meta, crm_loaded_at,
+                    now=datetime.now(timezone.utc), parse_ts=_parse_iso_utc,
+                    max_age=timedelta(hours=REFRESH_MAX_AGE_H), hot_age=timedelta(hours=REFRESH_HOT_AGE_H),
+                    hot_window=timedelta(days=REFRESH_HOT_DAYS), limit=REFRESH_LIMIT,
+                )
+                plan_stats["skipped"] = len(held) - len(ranked)
+                del meta_rows, existing_meta, crm_loaded_at, held
+                print(f"[INFO] Incremental refresh → new={tiers['new']:,} hot={tiers['hot']:,} stale={tiers['stale']:,} "
+                      f"fresh(skipped)={tiers['fresh']:,} capped={tiers['capped']:,}; to fetch: {len(ranked):,}")
+                enqueue(ranked)
+            if journal:
+                journal.mark_todo_complete()
+        except _Cancelled:
+            pass
+        except BaseException as e:
+            stage_errors.append(e)
+        finally:
+            if cancel.is_set():
+                try:
+                    ids_q.put_nowait(_END)
+                except queue.Full:
+                    pass
+            else:
+                ids_q.put(_END)
+
+    # ---- stage 3: writer (excluded + active upserts, per-country deltas) ----
+    up_stats = {"excl_ok": 0, "ok": 0, "fail": 0}
+    deltas: Optional[Dict[str, float]] = {}
+
+    def writer():
+        nonlocal deltas
+        for table, rows in _drain(upsert_q):
+            with METRICS.stage("write"):
+                try:
+                    if table == TABLE_EXCLUDED:
+                        up_stats["excl_ok"] += sum(res.rows for res in upsert_many(TABLE_EXCLUDED, rows, "account_id") if res.ok)
+                        continue
+                    try:
+                        prev = supa_fetch_active_by_ids([r["account_id"] for r in rows])
+                    except Exception as e:
+                        if deltas is not None:
+                            print(f"[WARN] Could not read previous plans ({str(e)[:120]}) → full aggregation this run")
+                        prev, deltas = {}, None
+                    # a partly stored batch still counts (and folds) the chunks that landed
+                    stored, failed = supa_upsert_batch(TABLE_ACTIVE, rows, on_conflict="account_id")
+                    if stored:
+                        up_stats["ok"] += len(stored)
+                        if journal:
+                            journal.mark([r["account_id"] for r in stored], UPSERTED)
+                        if deltas is not None:
+                            fold_deltas(deltas, stored, prev)
+                    if failed:
+                        up_stats["fail"] += failed
+                        print(f"[WARN] Active upsert failed for {failed:,} of {len(rows):,} rows")
+                except Exception as e:
+                    up_stats["fail"] += len(rows)
+                    print(f"[WARN] Writer batch error on {table}: {str(e)[:160]}")
+                finally:
+                    METRICS.progress(upserted_ok=up_stats["ok"], upserted_fail=up_stats["fail"],
+                                     excluded_ok=up_stats["excl_ok"])
+
+    # ---- stage 2: Sirix fetch (throttled by the shared adaptive limiter; failures queue for retry) ----
     fails = 0
     null_plan = 0
     processed = 0
-
-    def task(uid):
-        res = fetch_country_and_plan(uid)
-        return res
-
-    print(f"[SIRIX] Fetching with {MAX_WORKERS} workers …")
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        futures = [ex.submit(task, uid) for uid in todo]
-        for i, fut in enumerate(as_completed(futures), start=1):
-            res = fut.result()
+    sirix_ok = 0
+    retry_queue: List[str] = []
+    buffer: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+
+    def handle(res):
+        nonlocal processed, fails, null_plan, sirix_ok, buffer
+        with lock:
             processed += 1
-            if res is None or "__error__" in res:
+            if res is None:
                 fails += 1
+            elif "__error__" in res:
+                if _is_retryable(res):
+                    retry_queue.append(res["account_id"])
+                else:
+                    fails += 1
+                    if journal:
+                        journal.mark([res["account_id"]], FAILED)
             else:
+                sirix_ok += 1
                 if res.get("plan") is None: null_plan += 1
-                ok_results.append(res)
-
+                buffer.append(res)
+                if len(buffer) >= UPSERT_BATCH:
+                    full, buffer = buffer, []
+                    if journal:
+                        journal.mark([r["account_id"] for r in full], FETCHED)
+                    upsert_q.put((TABLE_ACTIVE, full))   # blocks while the writer is UPSERT_QUEUE batches behind
+
+            METRICS.progress(processed=processed, sirix_ok=sirix_ok, sirix_failed=fails,
+                             retry_queue=len(retry_queue), null_plan=null_plan, sirix_rate=round(SIRIX_LIMITER.rate, 2))
             if LOG_EVERY and (processed % LOG_EVERY == 0):
-                pct = processed * 100.0 / max(len(todo), 1)
-                print(f"[SIRIX] Progress: {processed:,}/{len(todo):,} ({pct:0.1f}%) | ok≈{len(ok_results):,} fail≈{fails:,} nullPlan≈{null_plan:,}")
-
-            if RATE_DELAY_SEC > 0:
-                # very light throttle to be nice; still concurrent
-                time.sleep(RATE_DELAY_SEC / max(MAX_WORKERS,1))
+                print(f"[SIRIX] Progress: {processed:,}/{plan_stats['queued']:,} queued | ok≈{sirix_ok:,} "
+                      f"fail≈{fails:,} retryQ≈{len(retry_queue):,} nullPlan≈{null_plan:,} rate≈{SIRIX_LIMITER.rate:0.1f}/s")
+
+    def cache_misses(ids):
+        # Serve cached accounts straight away; only misses go out to Sirix. A hit keeps the
+        # time it was fetched as last_checked_at, so incremental mode still sees its real age.
+        # Incremental candidates were picked because their data is stale or hot: always re-fetch.
+        if _cache is None or refresh_mode == "incremental":
+            yield from ids
+            return
+        for aid in ids:
+            hit = _cache.get(aid)
+            if hit is None:
+                yield aid
+            else:
+                METRICS.inc("cache_hits")
+                handle(build_result(aid, *hit))
+
+    parser: Optional[ParsePool] = None
+
+    def parsed(item) -> None:
+        # parser-process result: fill the cache here (the sqlite handle lives in this process)
+        res, country, txs = item
+        if _cache is not None and "__error__" not in res:
+            _cache.put(res["account_id"], country, txs)
+        handle(res)
+
+    def deliver(res) -> None:
+        # raw bodies go to the parse pool; errors (and empty ids) go straight to handle()
+        if res and "__body__" in res:
+            parser.submit(res["account_id"], res["__body__"])
+        else:
+            handle(res)
+
+    def fetch_pass(ids) -> None:
+        ids = cache_misses(ids)
+        if FETCH_ENGINE == "async":
+            from .sirix_async import fetch_all
+            fetch_all(ids, url=SIRIX_API_URL, headers=_sirix_headers(), make_payload=_sirix_payload,
+                      parse=_raw_body if parser else parse_country_and_plan,
+                      on_result=deliver if parser else handle, limiter=SIRIX_LIMITER, concurrency=ASYNC_CONCURRENCY)
+        else:
+            fetch, done_fn = (fetch_raw, deliver) if parser else (fetch_country_and_plan, handle)
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+                in_flight = set()
+                for uid in ids:
+                    in_flight.add(ex.submit(fetch, uid))
+                    if len(in_flight) >= MAX_WORKERS * 2:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            done_fn(fut.result())
+                for fut in as_completed(in_flight):
+                    done_fn(fut.result())
+        if parser:
+            parser.drain()   # retry rounds need every result of this pass
+
+    if CACHE_ENABLED:
+        _cache = SirixCache(CACHE_PATH, ttl_sec=CACHE_TTL_SEC, max_entries=CACHE_MAX_ENTRIES)
+    if PARSE_PROCS > 0:
+        # started before the pipeline threads; a failed parse batch fails its accounts (not retried)
+        parser = ParsePool(parse_batch, parsed, lambda aid, e: handle(_parse_error(aid, e)),
+                           procs=PARSE_PROCS, batch=PARSE_BATCH, args=(FAST_PARSE,))
+
+    planner_t = threading.Thread(target=planner, name="e2t-planner", daemon=True)
+    writer_t = threading.Thread(target=writer, name="e2t-writer", daemon=True)
+    planner_t.start()
+    writer_t.start()
+
+    fetch_started = time.time()
+    if FETCH_ENGINE == "async":
+        print(f"[SIRIX] Fetching with async engine (concurrency={ASYNC_CONCURRENCY}) …")
+    else:
+        print(f"[SIRIX] Fetching with {MAX_WORKERS} workers …")
+    if parser:
+        print(f"[SIRIX] Parsing in {PARSE_PROCS} processes (batch={PARSE_BATCH})")
+
+    def close_stores() -> None:
+        # failure paths: commit what the journal has (resume needs it) and release the sqlite handles
+        global _cache
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+        if journal:
+            journal.close()
+
+    fetch_error: Optional[BaseException] = None
+    try:
+        with METRICS.stage("fetch"):
+            fetch_pass(_drain(ids_q))
+
+        retried = 0
+        for round_no in range(1, RETRY_ROUNDS + 1):
+            if not retry_queue:
+                break
+            ids, retry_queue = retry_queue, []
+            retried += len(ids)
+            METRICS.inc("sirix_retried", len(ids))
+            print(f"[SIRIX] Retry round {round_no}/{RETRY_ROUNDS}: {len(ids):,} accounts (rate≈{SIRIX_LIMITER.rate:0.1f}/s)")
+            with METRICS.stage("retry"):
+                fetch_pass(ids)
+        fails += len(retry_queue)
+    except BaseException as e:
+        cancel.set()   # the planner may be blocked on a full ids_q that nobody reads now
+        fetch_error = e
+        raise
+    finally:
+        if parser:
+            parser.close()
+        planner_t.join()   # before the writer's end marker: the planner also feeds upsert_q
+        if buffer:
+            if journal:
+                journal.mark([r["account_id"] for r in buffer], FETCHED)
+            upsert_q.put((TABLE_ACTIVE, buffer))
+            buffer = []
+        upsert_q.put(_END)
+        writer_t.join()
+        if fetch_error is not None:
+            close_stores()
+            METRICS.finish_run(error=(str(fetch_error) or type(fetch_error).__name__)[:200])
+    fetch_elapsed = time.time() - fetch_started
+    if stage_errors:
+        close_stores()
+        METRICS.finish_run(error=str(stage_errors[0])[:200])
+        raise stage_errors[0]
+
+    cache_stats = None
+    if _cache is not None:
+        _cache.evict()
+        _cache.close()
+        cache_stats = (_cache.hits, _cache.misses, _cache.expired, _cache.evicted)
+        _cache = None
+
+    if journal:
+        journal.finish()
+        journal.close()
+
+    if plan_stats["crm"] == 0 and resume_ids is None:
+        print(f"[WARN] No rows in {TABLE_CRM_SKIM}. Populate this table first.")
+        METRICS.finish_run(crm_rows=0)
+        return
 
-    print(f"[SIRIX] Done. ok={len(ok_results):,} fail={fails:,} nullPlan={null_plan:,}")
+    print(f"[SIRIX] Done. ok={sirix_ok:,} fail={fails:,} nullPlan={null_plan:,} "
+          f"in {fetch_elapsed:0.1f}s ({processed / max(fetch_elapsed, 1e-6):0.1f} acc/s, engine={FETCH_ENGINE}"
+          f"{f', parse procs={PARSE_PROCS}' if PARSE_PROCS > 0 else ''})")
+    if plan_stats["excluded"]:
+        print(f"[INFO] Excluded upserts: {up_stats['excl_ok']:,}")
+    print(f"[INFO] Active upserts ~ ok={up_stats['ok']:,}, fail={up_stats['fail']:,}")
 
-    # 5) Batch upsert to e2t_active
-    up_ok = up_fail = 0
-    for batch in chunked(ok_results, UPSERT_BATCH):
-        if supa_upsert_batch(session, TABLE_ACTIVE, batch, on_conflict="account_id"):
-            up_ok += len(batch)
-        else:
-            up_fail += len(batch)
-    print(f"[INFO] Active upserts ~ ok={up_ok:,}, fail={up_fail:,}")
+    # 4) Totals
+    update_country_totals(deltas)
+    print("[DONE] Country allocation updated.")
 
-    # 6) Totals
-    recompute_country_totals()
-    print("[DONE] Country allocation recomputed.")
+    # 4a) Static allocation snapshot for the dashboard (re-uploaded only when the totals changed)
+    snap = publish_allocation_snapshot()
 
-    # 6a) Notify Netlify (optional)
-    _trigger_netlify()
+    # 4b) Notify Netlify (optional)
+    if plan_stats["queued"]:
+        _trigger_netlify()
 
-    # 7) Summary
+    # 5) Summary
     elapsed = time.time() - started
     mm, ss = divmod(int(elapsed), 60)
     print("\n===== WORKER SUMMARY =====")
-    print(f"CRM rows read        : {total_crm:,}")
-    print(f"Excluded             : {len(excluded):,}")
-    print(f"To process (unique)  : {len(todo) + skipped_existing:,}")
-    if SKIP_EXISTING:
-        print(f"Skipped existing     : {skipped_existing:,}")
-    print(f"Sirix ok             : {len(ok_results):,}")
+    print(f"CRM rows read        : {plan_stats['crm']:,}")
+    print(f"Excluded             : {plan_stats['excluded']:,}")
+    print(f"To process (unique)  : {plan_stats['unique']:,}")
+    print(f"Refresh mode         : {refresh_mode}")
+    if resumed:
+        print(f"Resumed run          : {resumed[0]}")
+    if refresh_mode != "all":
+        print(f"Skipped existing     : {plan_stats['skipped']:,}")
+    print(f"Sirix ok             : {sirix_ok:,}")
     print(f"Sirix failed         : {fails:,}")
+    print(f"Sirix retried        : {retried:,}")
+    print(f"Sirix throttled      : {SIRIX_LIMITER.throttled:,} (final rate≈{SIRIX_LIMITER.rate:0.1f}/s)")
+    print(f"Fetch engine         : {FETCH_ENGINE}")
+    if cache_stats:
+        print(f"Cache hits / misses  : {cache_stats[0]:,} / {cache_stats[1]:,} (expired {cache_stats[2]:,}, evicted {cache_stats[3]:,})")
     print(f"Plan missing (null)  : {null_plan:,}")
-    print(f"Upserted active ok   : {up_ok:,}")
-    print(f"Upserted active fail : {up_fail:,}")
+    print(f"Upserted active ok   : {up_stats['ok']:,}")
+    print(f"Upserted active fail : {up_stats['fail']:,}")
+    if snap:
+        print(f"Allocation snapshot  : {snap['etag']} ({len(snap['rows'])} countries)")
     print(f"Duration             : {mm:02d}:{ss:02d} (mm:ss)")
     print("===== END =====")
+    METRICS.finish_run(
+        refresh_mode=refresh_mode, fetch_engine=FETCH_ENGINE, crm_rows=plan_stats["crm"],
+        excluded=plan_stats["excluded"], unique=plan_stats["unique"], skipped=plan_stats["skipped"],
+        queued=plan_stats["queued"], sirix_ok=sirix_ok, sirix_failed=fails, sirix_retried=retried,
+        sirix_throttled=SIRIX_LIMITER.throttled, null_plan=null_plan,
+        upserted_ok=up_stats["ok"], upserted_fail=up_stats["fail"], excluded_ok=up_stats["excl_ok"],
+        cache=dict(zip(("hits", "misses", "expired", "evicted"), cache_stats)) if cache_stats else None,
+        snapshot_etag=snap["etag"] if snap else None,
+        fetch_sec=round(fetch_elapsed, 3), elapsed_sec=round(elapsed, 3),
+    )
 
 if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="E2T worker: CRM skim → Sirix → e2t_active → country totals")
+    ap.add_argument("--resume", action="store_true", help="continue the last unfinished run from the journal")
+    args = ap.parse_args()
     try:
-        run_once()
+        run_once(resume=args.resume)
     except KeyboardInterrupt:
         print("\n[EXIT] Stopped by user.")
@@ -0,0 +1,230 @@
+# bench/bench_e2e.py  (END-TO-END THROUGHPUT BENCHMARK)
+"""
+Runs worker.run_once and crm_loader_local.main against the local stand-ins
+(bench/fake_sirix.py, bench/fake_postgrest.py) at several account counts and
+reports accounts/sec, peak RSS, and per-endpoint request counts, status codes
+and p50/p99 latency as seen by the stand-ins.
+
+    python -m bench.bench_e2e                                  # worker + crm at 10k
+    python -m bench.bench_e2e --scales 10000,100000,1000000 --scenarios worker
+    E2T_MAX_WORKERS=32 E2T_UPSERT_BATCH=2000 python -m bench.bench_e2e --sirix-latency-ms 120
+
+The app's own tunables (E2T_*, CRM_*, SUPA_*) are taken from the environment,
+so one invocation per setting compares them. The Sirix limiter is the
+exception: SIRIX_RATE_* come from --sirix-rate (start = max), so a short run
+measures the pipeline rather than the limiter's ramp-up. Reports, snapshots,
+profiles, journals and caches all go to the run's work directory.
+
+Every run gets fresh server processes and a fresh interpreter, so module-level
+env reads apply and RSS is the run's alone (parse-pool children not included).
+Servers run in their own processes and do not share the GIL with the app.
+The CRM source is a SQLite file attached as `dbo` in place of MSSQL.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+from app.config import TABLE_ACTIVE, TABLE_CRM_SKIM, TABLE_EXCLUDED
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _http(method: str, url: str, headers: Optional[Dict[str, str]] = None):
+    req = urllib.request.Request(url, method=method, headers=headers or {}, data=b"" if method == "POST" else None)
+    with urllib.request.urlopen(req, timeout=30) as r:
+        return r.status, dict(r.headers), r.read()
+
+
+def _stats(port: int) -> Dict[str, Any]:
+    return json.loads(_http("GET", f"http://127.0.0.1:{port}/__stats")[2] or b"{}")
+
+
+def _count(pg_port: int, table: str) -> int:
+    _, hdr, _ = _http("GET", f"http://127.0.0.1:{pg_port}/rest/v1/{table}?select=*",
+                      {"Prefer": "count=exact", "Range": "0-0"})
+    return int(hdr.get("Content-Range", "/0").split("/")[-1] or 0)
+
+
+class _Server:
+    """A stand-in server in its own process; waits until it answers /__stats."""
+
+    def __init__(self, module: str, port: int, args: List[str], log_dir: str):
+        self.port = port
+        self._log = open(os.path.join(log_dir, module.rsplit(".", 1)[-1] + ".log"), "w")
+        self.proc = subprocess.Popen([sys.executable, "-m", module, "--port", str(port), *args],
+                                     cwd=ROOT, stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.time() + 600    # seeding 1M rows takes a while
+        while True:
+            try:
+                _stats(port)
+                return
+            except OSError:
+                if self.proc.poll() is not None or time.time() > deadline:
+                    raise RuntimeError(f"{module} did not start (see {self._log.name})")
+                time.sleep(0.2)
+
+    def stop(self) -> None:
+        self.proc.terminate()
+        self.proc.wait(timeout=30)
+        self._log.close()
+
+
+def make_crm_source(path: str, n: int, excluded_every: int = 10) -> None:
+    """SQLite stand-in for dbo.Lv_tpaccount with n accounts (same shape as fake_postgrest.seed_crm)."""
+    if os.path.exists(path):
+        os.remove(path)
+    con = sqlite3.connect(path)
+    con.execute("create table Lv_tpaccount (Lv_name text, Lv_TempName text, lv_accountidName text)")
+    con.executemany("insert into Lv_tpaccount values (?, ?, ?)", (
+        (str(10_000_000 + i), "Audition 50K" if excluded_every and i % excluded_every == 0 else "E2T 25K", f"acc-{i}")
+        for i in range(n)))
+    con.commit()
+    con.close()
+
+
+# ---------- child side (fresh interpreter per run) ----------
+def _child(scenario: str, out: str) -> None:
+    t0 = time.perf_counter()
+    if scenario == "worker":
+        from app import worker
+        worker.run_once()
+    else:
+        from sqlalchemy import create_engine, event
+        from app import crm_loader_local
+
+        def sqlite_engine():
+            engine = create_engine("sqlite://")
+
+            @event.listens_for(engine, "connect")
+            def _attach(conn, _rec):
+                conn.execute(f"attach database '{os.environ['BENCH_CRM_DB']}' as dbo")
+            return engine
+
+        crm_loader_local.make_mssql_engine = sqlite_engine
+        crm_loader_local.main()
+    elapsed = time.perf_counter() - t0
+    with open(out, "w") as f:
+        json.dump({"elapsed": elapsed, "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}, f)
+
+
+# ---------- parent side ----------
+def run_one(scenario: str, n: int, args, work: str) -> Dict[str, Any]:
+    pg_port, sirix_port = _free_port(), _free_port()
+    servers = []
+    try:
+        pg = _Server("bench.fake_postgrest", pg_port,
+                     ["--seed-crm", str(n)] if scenario == "worker" else [], work)
+        servers.append(pg)
+        env = dict(os.environ)
+        env.update(
+            SUPABASE_URL=f"http://127.0.0.1:{pg_port}", SUPABASE_SERVICE_ROLE_KEY="bench",
+            E2T_NOTIFY_NETLIFY="false", MSSQL_ODBC_DSN="bench",
+            E2T_CACHE_PATH=os.path.join(work, "sirix_cache.sqlite"),
+            E2T_JOURNAL_PATH=os.path.join(work, "run_journal.sqlite"),
+            CRM_DIFF_PATH=os.path.join(work, "crm_fingerprints"),
+            E2T_REPORT_DIR=os.path.join(work, "reports"),
+            E2T_SNAPSHOT_DIR=os.path.join(work, "snapshot"), E2T_SNAPSHOT_BUCKET="",
+            E2T_PROFILE_DIR=os.path.join(work, "profiles"),
+            SIRIX_RATE_START=str(args.sirix_rate), SIRIX_RATE_MAX=str(args.sirix_rate),
+            SIRIX_RATE_MIN="2", SIRIX_RATE_BURST=str(max(20.0, args.sirix_rate / 10)),
+        )
+        if scenario == "worker":
+            sirix = _Server("bench.fake_sirix", sirix_port, [
+                "--latency-ms", str(args.sirix_latency_ms), "--jitter-ms", str(args.sirix_jitter_ms),
+                "--tx", str(args.sirix_tx), "--error-rate", str(args.sirix_error_rate),
+                "--throttle-rate", str(args.sirix_throttle_rate)], work)
+            servers.append(sirix)
+            env.update(SIRIX_API_URL=f"http://127.0.0.1:{sirix_port}/api/UserStatus/GetUserTransactions",
+                       SIRIX_TOKEN="bench")
+        else:
+            env["BENCH_CRM_DB"] = os.path.join(work, "crm_source.sqlite")
+            make_crm_source(env["BENCH_CRM_DB"], n)
+
+        out = os.path.join(work, f"{scenario}-{n}.json")
+        with open(os.path.join(work, f"{scenario}-{n}.log"), "w") as log:
+            rc = subprocess.call([sys.executable, "-m", "bench.bench_e2e", "--child", scenario, "--out", out],
+                                 cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if rc != 0 or not os.path.exists(out):
+            raise RuntimeError(f"{scenario} run failed (exit {rc}); see {log.name}")
+        with open(out) as f:
+            res = json.load(f)
+        res.update(scenario=scenario, accounts=n, stages={})
+        for srv in servers:
+            res["stages"].update(_stats(srv.port))
+        res["rows"] = {t: _count(pg_port, t) for t in ((TABLE_ACTIVE, TABLE_EXCLUDED) if scenario == "worker"
+                                                       else (TABLE_CRM_SKIM,))}
+        return res
+    finally:
+        for srv in servers:
+            srv.stop()
+
+
+def report(res: Dict[str, Any]) -> None:
+    n, el = res["accounts"], res["elapsed"]
+    print(f"\n===== {res['scenario'].upper()} @ {n:,} accounts =====")
+    print(f"Elapsed              : {el:0.1f}s")
+    print(f"Accounts / sec       : {n / max(el, 1e-9):,.0f}")
+    print(f"Peak RSS             : {res['rss_mb']:,.0f} MB")
+    for table, rows in res["rows"].items():
+        print(f"{'Rows in ' + table:<21}: {rows:,}")
+    print(f"{'stage':<46} {'requests':>9} {'p50 ms':>9} {'p99 ms':>9}  status")
+    for key, st in res["stages"].items():
+        codes = " ".join(f"{c}×{k:,}" for c, k in st["status"].items())
+        print(f"{key[:46]:<46} {st['n']:>9,} {st['p50_ms']:>9.1f} {st['p99_ms']:>9.1f}  {codes}")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="End-to-end throughput against local Sirix / PostgREST stand-ins")
+    ap.add_argument("--scales", default="10000", help="comma-separated account counts, e.g. 10000,100000,1000000")
+    ap.add_argument("--scenarios", default="worker,crm", help="worker and/or crm")
+    ap.add_argument("--sirix-latency-ms", type=float, default=50)
+    ap.add_argument("--sirix-jitter-ms", type=float, default=20)
+    ap.add_argument("--sirix-tx", type=int, default=50, help="filler transactions per Sirix body")
+    ap.add_argument("--sirix-error-rate", type=float, default=0.0)
+    ap.add_argument("--sirix-throttle-rate", type=float, default=0.0)
+    ap.add_argument("--sirix-rate", type=float, default=5000, help="limiter start/max rate (req/s) for the worker")
+    ap.add_argument("--json", help="also write all results to this file")
+    ap.add_argument("--keep", action="store_true", help="keep the work directory (logs, journals)")
+    ap.add_argument("--child", choices=("worker", "crm"), help=argparse.SUPPRESS)
+    ap.add_argument("--out", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        _child(args.child, args.out)
+        return 0
+
+    work = tempfile.mkdtemp(prefix="e2t-bench-")
+    print(f"[BENCH] work dir {work}")
+    results = []
+    for n in (int(x) for x in args.scales.split(",") if x.strip()):
+        for scenario in (s.strip() for s in args.scenarios.split(",") if s.strip()):
+            print(f"[BENCH] {scenario} @ {n:,} …", flush=True)
+            res = run_one(scenario, n, args, work)
+            report(res)
+            results.append(res)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if not args.keep:
+        shutil.rmtree(work, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
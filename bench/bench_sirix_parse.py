@@ -0,0 +1,112 @@
+# bench/bench_sirix_parse.py  (SIRIX PARSE MICRO-BENCHMARK)
+"""
+Compare the body scan (app.sirix_parse.scan_country_and_txs) with the full
+json.loads + extract_country_and_txs path on GetUserTransactions bodies.
+
+    python -m bench.bench_sirix_parse                     # synthetic payloads
+    python -m bench.bench_sirix_parse dumps/*.json        # recorded bodies
+
+Every body is checked for identical (country, txs) before it is timed, and
+the report says how many bodies the scan had to hand back to json.loads.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+from app.sirix_parse import extract_country_and_txs, scan_country_and_txs
+
+COMMENTS = ["Deposit", "Withdrawal", "Commission", "Swap", "Transfer to 41882", "Bonus", "Fee adjustment"]
+
+
+def synthetic_body(n_tx: int, n_initial: int, rnd: random.Random) -> bytes:
+    """A GetUserTransactions-shaped body with n_tx records, n_initial of them "Initial Balance"."""
+    t0 = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    initial = set(rnd.sample(range(n_tx), min(n_initial, n_tx)))
+    txs = []
+    for i in range(n_tx):
+        ts = t0 + timedelta(minutes=37 * i + rnd.randrange(30))
+        txs.append({
+            "TransactionID": 9_000_000 + i,
+            "Time": ts.isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "Amount": round(rnd.uniform(-5000, 5000), 2),
+            "Comment": ("Initial Balance " + str(rnd.choice([5, 10, 25, 50])) + "K") if i in initial
+                       else rnd.choice(COMMENTS),
+            "TransactionType": rnd.randrange(1, 8),
+            "Balance": round(rnd.uniform(0, 1e5), 2),
+        })
+    doc = {
+        "UserData": {"UserDetails": {"UserID": "140123", "Country": rnd.choice(["UK", "France", "Nigeria"]),
+                                     "Name": "Test User", "Group": "E2T"},
+                     "AccountBalance": {"Balance": 1234.5, "Equity": 1234.5}},
+        "OpenPositions": None,
+        "PendingPositions": None,
+        "ClosedPositions": None,
+        "MonetaryTransactions": txs,
+    }
+    return json.dumps(doc).encode()
+
+
+def _best_of(fn, bodies: List[bytes], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for b in bodies:
+            fn(b)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(named: List[Tuple[str, List[bytes]]], repeat: int) -> int:
+    def full(b):
+        return extract_country_and_txs(json.loads(b) or {})
+
+    bad = 0
+    print(f"{'payload':<24} {'bodies':>6} {'MB':>7} {'json.loads':>11} {'scan':>9} {'speedup':>8} {'fallback':>8}")
+    for name, bodies in named:
+        fallback = 0
+        for b in bodies:
+            res = scan_country_and_txs(b)
+            if res is None:
+                fallback += 1
+            elif res != full(b):
+                bad += 1
+                print(f"[BENCH] MISMATCH in {name}: scan={res!r:.200}")
+        mb = sum(map(len, bodies)) / 1e6
+        t_full = _best_of(full, bodies, repeat)
+        t_scan = _best_of(scan_country_and_txs, bodies, repeat)
+        print(f"{name:<24} {len(bodies):>6} {mb:>7.2f} {t_full * 1e3:>9.1f}ms {t_scan * 1e3:>7.1f}ms "
+              f"{t_full / max(t_scan, 1e-9):>7.1f}x {fallback:>8}")
+    return bad
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("files", nargs="*", help="recorded GetUserTransactions bodies (raw JSON)")
+    ap.add_argument("--repeat", type=int, default=5, help="timing rounds (best is reported)")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args(argv)
+
+    if args.files:
+        bodies = []
+        for path in args.files:
+            with open(path, "rb") as f:
+                bodies.append(f.read())
+        named = [("recorded", bodies)]
+    else:
+        rnd = random.Random(args.seed)
+        named = [
+            ("small (20 tx)", [synthetic_body(20, 1, rnd) for _ in range(200)]),
+            ("medium (500 tx)", [synthetic_body(500, 2, rnd) for _ in range(40)]),
+            ("large (20k tx)", [synthetic_body(20_000, 3, rnd) for _ in range(3)]),
+        ]
+    bad = run(named, args.repeat)
+    print("OK" if not bad else f"{bad} mismatching bodies")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
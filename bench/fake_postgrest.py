@@ -0,0 +1,401 @@
+# bench/fake_postgrest.py  (POSTGREST STAND-IN)
+"""
+In-memory stand-in for the Supabase PostgREST endpoints the app uses.
+
+Covers what app/supa.py sends:
+  GET    select=, column filters (eq/neq/gt/gte/lt/lte/in, and=(...)),
+         order=col.asc|desc, limit/offset, Range, Prefer: count=exact → Content-Range
+  POST   upserts with on_conflict (merge- or ignore-duplicates; a key twice in one body
+         is a 400 like Postgres' "cannot affect row a second time"), rpc/<fn>
+  DELETE with the same filters
+
+Tables mirror app/sql (primary key per table); views are computed per request. Lookups by primary key (in.(...)
+and keyset ranges ordered by the key) use a dict / sorted key index, so 1M-row
+tables page in O(page) like the real thing; anything else is a full scan.
+
+    python -m bench.fake_postgrest --port 8766 --seed-crm 100000
+
+GET /__stats returns request counts and server-side latency per (method, path);
+POST /__reset clears them.
+"""
+import argparse
+import bisect
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlparse
+
+from app.config import TABLE_ACTIVE, TABLE_ALLOC, TABLE_CRM_SKIM, TABLE_EXCLUDED, TABLE_SYNC_STATE, VIEW_ALLOC
+
+from .stats import RequestStats
+
+PRIMARY_KEYS = {
+    TABLE_CRM_SKIM: "lv_name",
+    TABLE_ACTIVE: "account_id",
+    TABLE_EXCLUDED: "account_id",
+    TABLE_ALLOC: "country",
+    TABLE_SYNC_STATE: "name",
+}
+
+Row = Dict[str, Any]
+Cond = Tuple[str, str, Any]          # (column, op, value)
+
+
+class Table:
+    def __init__(self, pk: str):
+        self.pk = pk
+        self.rows: Dict[str, Row] = {}
+        self._sorted: Optional[List[str]] = None
+
+    def keys_sorted(self) -> List[str]:
+        if self._sorted is None:
+            self._sorted = sorted(self.rows)
+        return self._sorted
+
+    def upsert(self, rows: List[Row]) -> None:
+        new = False
+        for r in rows:
+            key = str(r[self.pk])
+            cur = self.rows.get(key)
+            if cur is None:
+                self.rows[key] = dict(r)
+                new = True
+            else:
+                cur.update(r)
+        if new:
+            self._sorted = None
+
+    def delete(self, keys: List[str]) -> None:
+        for k in keys:
+            self.rows.pop(k, None)
+        if keys:
+            self._sorted = None
+
+
+TABLES: Dict[str, Table] = {name: Table(pk) for name, pk in PRIMARY_KEYS.items()}
+RPC: Dict[str, Callable[..., Any]] = {}
+LOCK = threading.RLock()
+STATS = RequestStats()
+
+
+# ---------- filters ----------
+def _unquote(v: str) -> str:
+    v = v.strip()
+    if len(v) >= 2 and v[0] == '"' and v[-1] == '"':
+        return v[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return v
+
+def _split_list(s: str) -> List[str]:
+    """Split a PostgREST list on commas outside double quotes."""
+    return [m.group(0) for m in re.finditer(r'(?:"(?:[^"\\]|\\.)*"|[^,])+', s)]
+
+def _cond(col: str, expr: str, in_tree: bool = False) -> Cond:
+    # Like PostgREST, double quotes are only syntax inside in.(...) lists and
+    # and=(...) trees; a top-level `col=gt."x"` compares against the quotes too.
+    op, _, arg = expr.partition(".")
+    if op == "in":
+        inner = arg.strip()[1:-1]
+        return col, "in", {_unquote(x) for x in _split_list(inner)} if inner else set()
+    if op == "is":
+        return col, "is", None
+    return col, op, _unquote(arg) if in_tree else arg
+
+def parse_filters(q: List[Tuple[str, str]]) -> List[Cond]:
+    conds = []
+    for k, v in q:
+        if k in ("select", "limit", "offset", "order", "on_conflict", "columns"):
+            continue
+        if k == "and":
+            for part in _split_list(v.strip()[1:-1]):
+                col, _, rest = part.partition(".")
+                conds.append(_cond(col, rest, in_tree=True))
+        else:
+            conds.append(_cond(k, v))
+    return conds
+
+_OPS = {"eq": lambda x, a: x == a, "neq": lambda x, a: x != a, "gt": lambda x, a: x > a,
+        "gte": lambda x, a: x >= a, "lt": lambda x, a: x < a, "lte": lambda x, a: x <= a}
+
+def _match(r: Row, conds: List[Cond]) -> bool:
+    for col, op, a in conds:
+        v = r.get(col)
+        if op == "is":
+            if v is not None:
+                return False
+        elif v is None:
+            return False
+        elif op == "in":
+            if str(v) not in a:
+                return False
+        elif not _OPS[op](str(v), a):
+            return False
+    return True
+
+
+def query(t: Table, conds: List[Cond], order: Optional[str]) -> List[Row]:
+    """Rows matching conds, in `order` ("col.asc|desc"). Uses the key index where it can."""
+    col, _, dirn = (order or "").partition(".")
+    desc = dirn.startswith("desc")
+    key_conds = [c for c in conds if c[0] == t.pk]
+    rest = [c for c in conds if c[0] != t.pk]
+    ins = [c for c in key_conds if c[1] == "in"]
+    if ins:
+        keys = sorted(set.intersection(*(c[2] for c in ins)) & t.rows.keys())
+        rows = [t.rows[k] for k in keys]
+        rows = [r for r in rows if _match(r, key_conds + rest)]
+    elif all(op in ("gt", "gte", "lt", "lte", "eq") for _, op, _ in key_conds) and col in ("", t.pk):
+        keys = t.keys_sorted()
+        lo, hi = 0, len(keys)
+        for _, op, a in key_conds:
+            if op in ("gt", "gte", "eq"):
+                lo = max(lo, (bisect.bisect_right if op == "gt" else bisect.bisect_left)(keys, a))
+            if op in ("lt", "lte", "eq"):
+                hi = min(hi, (bisect.bisect_left if op == "lt" else bisect.bisect_right)(keys, a))
+        rows = [t.rows[k] for k in keys[lo:hi]]
+        if rest:
+            rows = [r for r in rows if _match(r, rest)]
+        if desc:
+            rows.reverse()
+        return rows
+    else:
+        rows = [r for r in t.rows.values() if _match(r, conds)]
+    if col:
+        rows.sort(key=lambda r: (r.get(col) is None, str(r.get(col))), reverse=desc)
+    return rows
+
+
+# ---------- RPCs (same results as app/sql/Q10, Q11) ----------
+def _country(c: Any) -> str:
+    return (str(c) if c is not None else "").strip() or "Unknown"
+
+def _totals() -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for r in TABLES[TABLE_ACTIVE].rows.values():
+        k = _country(r.get("country"))
+        out[k] = out.get(k, 0.0) + float(r.get("plan") or 0)
+    return out
+
+def refresh_country_allocation() -> int:
+    alloc = TABLES[TABLE_ALLOC]
+    alloc.rows.clear()
+    alloc.upsert([{"country": c, "total_plan": v} for c, v in _totals().items()])
+    return len(alloc.rows)
+
+def apply_country_allocation_deltas(deltas: List[Dict[str, Any]]) -> int:
+    alloc = TABLES[TABLE_ALLOC]
+    summed: Dict[str, float] = {}
+    for d in deltas:
+        summed[d["country"]] = summed.get(d["country"], 0.0) + float(d["delta"])
+    for c, v in summed.items():
+        cur = alloc.rows.get(c)
+        alloc.upsert([{"country": c, "total_plan": (float(cur["total_plan"]) if cur else 0.0) + v}])
+    live = {_country(r.get("country")) for r in TABLES[TABLE_ACTIVE].rows.values()}
+    alloc.delete([c for c in summed if c not in live])
+    return len(summed)
+
+def country_allocation_drift(tolerance: float = 0.005) -> List[Dict[str, Any]]:
+    expected = _totals()
+    stored = {c: float(r.get("total_plan") or 0) for c, r in TABLES[TABLE_ALLOC].rows.items()}
+    return [{"country": c, "stored": stored.get(c), "expected": expected.get(c)}
+            for c in sorted(set(expected) | set(stored))
+            if c not in expected or c not in stored or abs(expected[c] - stored[c]) > tolerance]
+
+# ---------- RPCs (same results as app/sql/Q13) ----------
+_DEFAULT_RULES = [["audition", "audition"], ["free trial", "free trial"]]
+
+def _reason(tempname: Any, rules: List[List[str]]) -> str:
+    t = str(tempname or "").lower()
+    codes = [code for pattern, code in rules if pattern and pattern.lower() in t]
+    return ",".join(dict.fromkeys(codes))
+
+def _account_id(name: Any) -> str:
+    s = str(name or "").strip()
+    return (s.lstrip("0") or "0") if s.isascii() and s.isdigit() else s
+
+def sync_e2t_excluded(rules: List[List[str]] = _DEFAULT_RULES) -> int:
+    rows = {}
+    for key in TABLES[TABLE_CRM_SKIM].keys_sorted():
+        r = TABLES[TABLE_CRM_SKIM].rows[key]
+        reason, name = _reason(r.get("lv_tempname"), rules), str(r["lv_name"]).strip()
+        if reason and name and name not in rows:
+            rows[name] = {"account_id": name, "reason": reason, "tempname": r.get("lv_tempname")}
+    TABLES[TABLE_EXCLUDED].upsert(list(rows.values()))
+    return len(rows)
+
+def e2t_pending_accounts(after_name: Optional[str] = None, page_size: int = 5000,
+                         rules: List[List[str]] = _DEFAULT_RULES, skip_active: bool = True) -> Dict[str, Any]:
+    skim, active = TABLES[TABLE_CRM_SKIM], TABLES[TABLE_ACTIVE].rows
+    keys = skim.keys_sorted()
+    lo = bisect.bisect_right(keys, after_name) if after_name is not None else 0
+    page = keys[lo: lo + max(page_size, 1)]
+    ids, excluded, skipped = [], 0, 0
+    for key in page:
+        r = skim.rows[key]
+        aid = _account_id(r["lv_name"])
+        if _reason(r.get("lv_tempname"), rules):
+            excluded += 1
+        elif aid and skip_active and aid in active:
+            skipped += 1
+        elif aid:
+            ids.append(aid)
+    return {"next": page[-1] if len(page) >= max(page_size, 1) else None, "ids": ids,
+            "scanned": len(page), "excluded": excluded, "skipped": skipped}
+
+# ---------- views (same columns as app/sql/Q15) ----------
+GOAL_USD = 1_000_000.0
+
+def v_country_allocation() -> Table:
+    view = Table("country")
+    for r in TABLES[TABLE_ALLOC].rows.values():
+        total = float(r.get("total_plan") or 0)
+        ok = total >= GOAL_USD
+        view.upsert([{"country": r["country"], "total_plan": total,
+                      "pct_goal": round(total / GOAL_USD * 100, 2), "is_qualified": ok,
+                      "status": "Qualified" if ok else "Pending"}])
+    return view
+
+VIEWS: Dict[str, Callable[[], Table]] = {VIEW_ALLOC: v_country_allocation}
+
+RPC.update(refresh_country_allocation=refresh_country_allocation,
+           apply_country_allocation_deltas=apply_country_allocation_deltas,
+           country_allocation_drift=country_allocation_drift,
+           sync_e2t_excluded=sync_e2t_excluded,
+           e2t_pending_accounts=e2t_pending_accounts)
+
+
+# ---------- HTTP ----------
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024    # the fetch side opens many connections at once
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *a):
+        pass
+
+    def _send(self, code: int, body: Any = None, headers: Optional[Dict[str, str]] = None) -> None:
+        b = b"" if body is None else json.dumps(body, default=str).encode()
+        self._code = code
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def _route(self) -> Tuple[str, List[Tuple[str, str]]]:
+        u = urlparse(self.path)
+        return u.path.split("/rest/v1/", 1)[-1], parse_qsl(u.query, keep_blank_values=True)
+
+    def _timed(self, fn) -> None:
+        name, q = self._route()
+        if name == "/__stats":
+            return self._send(200, STATS.snapshot())
+        if name == "/__reset":
+            STATS.reset()
+            return self._send(204)
+        t0 = time.perf_counter()
+        self._code = 0
+        try:
+            fn(name, q)
+        finally:
+            STATS.record(f"{self.command} {name}", time.perf_counter() - t0, self._code)
+
+    def do_GET(self):
+        self._timed(self._get)
+
+    def do_POST(self):
+        self._timed(self._post)
+
+    def do_DELETE(self):
+        self._timed(self._delete)
+
+    def _get(self, name: str, q: List[Tuple[str, str]]) -> None:
+        t = TABLES.get(name)
+        if t is None and name not in VIEWS:
+            return self._send(404, {"message": f"relation \"public.{name}\" does not exist"})
+        d = dict(q)
+        with LOCK:
+            rows = query(t if t is not None else VIEWS[name](), parse_filters(q), d.get("order"))
+        total = len(rows)
+        off = int(d.get("offset", 0))
+        lim = int(d["limit"]) if "limit" in d else None
+        rng = self.headers.get("Range")
+        if rng:
+            a, _, b = rng.partition("-")
+            off, lim = int(a), int(b) - int(a) + 1
+        rows = rows[off: off + lim if lim is not None else None]
+        cols = d.get("select", "*").split(",")
+        if cols != ["*"]:
+            rows = [{c: r.get(c) for c in cols} for r in rows]
+        hdr = {}
+        if "count=exact" in (self.headers.get("Prefer") or ""):
+            hdr["Content-Range"] = f"{off}-{off + len(rows) - 1}/{total}" if rows else f"*/{total}"
+        self._send(200, rows, hdr)
+
+    def _post(self, name: str, q: List[Tuple[str, str]]) -> None:
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = json.loads(raw or b"null")
+        if name.startswith("rpc/"):
+            fn = RPC.get(name[4:])
+            if fn is None:
+                return self._send(404, {"message": f"function {name[4:]} not found"})
+            with LOCK:
+                return self._send(200, fn(**(body or {})))
+        t = TABLES.get(name)
+        if t is None:
+            return self._send(404, {"message": f"relation \"public.{name}\" does not exist"})
+        rows = body if isinstance(body, list) else [body]
+        keys = [str(r.get(t.pk)) for r in rows]
+        if len(set(keys)) != len(keys):
+            return self._send(400, {"code": "21000",
+                                    "message": "ON CONFLICT DO UPDATE command cannot affect row a second time"})
+        with LOCK:
+            if "resolution=ignore-duplicates" in (self.headers.get("Prefer") or ""):
+                rows = [r for r in rows if str(r.get(t.pk)) not in t.rows]
+            t.upsert(rows)
+        self._send(201)
+
+    def _delete(self, name: str, q: List[Tuple[str, str]]) -> None:
+        t = TABLES.get(name)
+        if t is None:
+            return self._send(404, {"message": f"relation \"public.{name}\" does not exist"})
+        with LOCK:
+            t.delete([str(r[t.pk]) for r in query(t, parse_filters(q), None)])
+        self._send(204)
+
+
+def seed_crm(n: int, excluded_every: int = 10) -> None:
+    """n CRM skim rows with numeric lv_names; every `excluded_every`-th one has an excluded TempName."""
+    TABLES[TABLE_CRM_SKIM].upsert([{
+        "lv_name": str(10_000_000 + i),
+        "lv_tempname": "Audition 50K" if excluded_every and i % excluded_every == 0 else "E2T 25K",
+        "lv_accountidname": f"acc-{i}",
+    } for i in range(n)])
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    srv = Server((host, port), Handler)
+    threading.Thread(target=srv.serve_forever, name="fake-postgrest", daemon=True).start()
+    return srv
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="In-memory PostgREST stand-in")
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--seed-crm", type=int, default=0, help=f"synthetic rows in {TABLE_CRM_SKIM}")
+    args = ap.parse_args(argv)
+    seed_crm(args.seed_crm)
+    srv = Server(("127.0.0.1", args.port), Handler)
+    print(f"[FAKE-PG] listening on :{args.port} ({len(TABLES[TABLE_CRM_SKIM].rows):,} CRM rows)", flush=True)
+    srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# bench/fake_sirix.py  (SIRIX STAND-IN)
+"""
+Stand-in for Sirix POST .../GetUserTransactions.
+
+Each account gets a deterministic body (country, `--initial` "Initial Balance"
+records after the plan cutoff, `--tx` filler deposits / withdrawals), so two
+runs over the same ids produce the same plans. Per request the server sleeps
+`--latency-ms` (± `--jitter-ms`) and answers 500 / 429 (with Retry-After) at
+the given rates, so the limiter and retry rounds see realistic pressure.
+
+    python -m bench.fake_sirix --port 8765 --latency-ms 80 --tx 300 --throttle-rate 0.02
+
+GET /__stats returns request counts, status codes and server-side latency;
+POST /__reset clears them.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+from .stats import RequestStats
+
+COUNTRIES = ("United Kingdom", "France", "Nigeria", "India", "Germany", "Brazil", "South Africa", "Spain")
+COMMENTS = ("Deposit", "Withdrawal", "Commission", "Swap", "Transfer", "Bonus")
+
+STATS = RequestStats()
+
+
+class Profile:
+    def __init__(self, latency_ms: float = 50, jitter_ms: float = 20, tx: int = 50, initial: int = 1,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, seed: int = 7):
+        self.latency = latency_ms / 1e3
+        self.jitter = jitter_ms / 1e3
+        self.initial = initial
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        rnd = random.Random(seed)
+        # filler records are rendered once; only the per-account part is built per request
+        self.filler = b",".join(json.dumps({
+            "TransactionID": 5_000_000 + i,
+            "Time": f"2025-0{1 + i % 9}-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:00.000Z",
+            "Amount": round(rnd.uniform(-2500, 2500), 2),
+            "Comment": rnd.choice(COMMENTS),
+            "TransactionType": 1 + i % 6,
+        }, separators=(",", ":")).encode() for i in range(tx))
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._rnd.random()
+
+    def delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self._rnd.uniform(-self.jitter, self.jitter))
+
+    def body(self, aid: str) -> bytes:
+        h = zlib.crc32(aid.encode())
+        initial = [json.dumps({
+            "TransactionID": h * 10 + k,
+            "Time": f"2025-10-{1 + (h + k) % 28:02d}T10:16:33.777Z",
+            "Amount": float((5, 10, 25, 50, 100)[(h >> 3) % 5] * 1000),
+            "Comment": f"Initial Balance {k + 1}",
+            "TransactionType": 1,
+        }, separators=(",", ":")).encode() for k in range(self.initial)]
+        user = json.dumps({"UserDetails": {"UserID": aid, "Country": COUNTRIES[h % len(COUNTRIES)],
+                                           "Group": "E2T"}}, separators=(",", ":")).encode()
+        txs = b",".join(x for x in (self.filler, *initial) if x)
+        return (b'{"UserData":' + user + b',"OpenPositions":null,"PendingPositions":null,'
+                b'"ClosedPositions":null,"MonetaryTransactions":[' + txs + b"]}")
+
+
+PROFILE = Profile()
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024    # the fetch side opens many connections at once
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *a):
+        pass
+
+    def _send(self, code: int, body: bytes, headers: Dict[str, str] = None) -> None:
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/__stats"):
+            return self._send(200, json.dumps(STATS.snapshot()).encode())
+        self._send(404, b"{}")
+
+    def do_POST(self):
+        t0 = time.perf_counter()
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.startswith("/__reset"):
+            STATS.reset()
+            return self._send(204, b"")
+        code = 200
+        try:
+            payload: Dict[str, Any] = json.loads(raw or b"{}")
+            aid = str(payload.get("UserID") or "")
+            time.sleep(PROFILE.delay())
+            r = PROFILE.roll()
+            if r < PROFILE.throttle_rate:
+                code = 429
+                self._send(429, b'{"message":"Too Many Requests"}', {"Retry-After": "1"})
+            elif r < PROFILE.throttle_rate + PROFILE.error_rate:
+                code = 500
+                self._send(500, b'{"message":"Internal Server Error"}')
+            else:
+                self._send(200, PROFILE.body(aid))
+        finally:
+            STATS.record("POST GetUserTransactions", time.perf_counter() - t0, code)
+
+
+def main(argv=None) -> None:
+    global PROFILE
+    ap = argparse.ArgumentParser(description="Sirix GetUserTransactions stand-in")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=50)
+    ap.add_argument("--jitter-ms", type=float, default=20)
+    ap.add_argument("--tx", type=int, default=50, help="filler transactions per account (payload size)")
+    ap.add_argument("--initial", type=int, default=1, help="Initial Balance records per account")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of 500 responses")
+    ap.add_argument("--throttle-rate", type=float, default=0.0, help="share of 429 responses")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args(argv)
+    PROFILE = Profile(args.latency_ms, args.jitter_ms, args.tx, args.initial,
+                      args.error_rate, args.throttle_rate, args.seed)
+    srv = Server(("127.0.0.1", args.port), Handler)
+    print(f"[FAKE-SIRIX] listening on :{args.port} (body≈{len(PROFILE.body('10000000')):,} B)", flush=True)
+    srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
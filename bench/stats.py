@@ -0,0 +1,42 @@
+# bench/stats.py  (REQUEST STATS)
+"""Per-endpoint request counts and latency percentiles, shared by the stand-in servers."""
+import math
+import threading
+from array import array
+from typing import Any, Dict
+
+
+def percentile(sorted_vals, q: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence (0 for an empty one)."""
+    if not len(sorted_vals):
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, math.ceil(q / 100.0 * len(sorted_vals)) - 1))
+    return float(sorted_vals[i])
+
+
+class RequestStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lat: Dict[str, array] = {}
+        self._status: Dict[str, Dict[int, int]] = {}
+
+    def record(self, key: str, seconds: float, status: int = 0) -> None:
+        with self._lock:
+            self._lat.setdefault(key, array("d")).append(seconds)
+            if status:
+                by = self._status.setdefault(key, {})
+                by[status] = by.get(status, 0) + 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._lat.clear()
+            self._status.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """{key: {n, p50_ms, p99_ms, max_ms, status: {code: n}}}"""
+        with self._lock:
+            items = [(k, sorted(v), dict(self._status.get(k, {}))) for k, v in self._lat.items()]
+        return {k: {"n": len(v), "p50_ms": round(percentile(v, 50) * 1e3, 2),
+                    "p99_ms": round(percentile(v, 99) * 1e3, 2), "max_ms": round(v[-1] * 1e3, 2) if v else 0.0,
+                    "status": {str(c): n for c, n in sorted(st.items())}}
+                for k, v, st in sorted(items)}
@@ -12,6 +12,50 @@ const SUPABASE_ANON = process.env.REACT_APP_SUPABASE_ANON_KEY;
 const SB_SELECT = "country,pct_goal,is_qualified,status";
 const SB_URL = `${SUPABASE_URL}/rest/v1/v_e2t_country_allocation?select=${encodeURIComponent(SB_SELECT)}&order=pct_goal.desc`;
 
+// ---- Static snapshot published by the worker (app/snapshot.py); the live view is the fallback.
+// e.g. https://<project>.supabase.co/storage/v1/object/public/e2t-public/e2t/allocation.v1.json
+const SNAPSHOT_URL = process.env.REACT_APP_ALLOCATION_SNAPSHOT_URL;
+const SNAPSHOT_VERSION = 1;
+const SNAPSHOT_CACHE_KEY = "e2t.allocation.snapshot";
+
+function readCachedSnapshot() {
+  try {
+    const snap = JSON.parse(window.localStorage.getItem(SNAPSHOT_CACHE_KEY) || "null");
+    return snap && snap.version === SNAPSHOT_VERSION && Array.isArray(snap.rows) ? snap : null;
+  } catch (e) {
+    return null;
+  }
+}
+
+// "no-cache" = always revalidate: the browser sends If-None-Match and an unchanged
+// snapshot comes back as a bodiless 304. The .gz copy is used where the browser can
+// inflate it itself, so the transfer is compressed whatever the host does.
+async function fetchSnapshot() {
+  const gz = typeof DecompressionStream !== "undefined";
+  const res = await fetch(gz ? SNAPSHOT_URL + ".gz" : SNAPSHOT_URL, { cache: "no-cache" });
+  if (!res.ok) throw new Error(`snapshot HTTP ${res.status}`);
+  const text = gz
+    ? await new Response(res.body.pipeThrough(new DecompressionStream("gzip"))).text()
+    : await res.text();
+  const snap = JSON.parse(text);
+  if (snap.version !== SNAPSHOT_VERSION || !Array.isArray(snap.rows)) {
+    throw new Error(`unsupported snapshot version ${snap.version}`);
+  }
+  return snap;
+}
+
+async function fetchLiveView() {
+  if (!SUPABASE_URL || !SUPABASE_ANON) {
+    throw new Error("Missing REACT_APP_SUPABASE_URL or REACT_APP_SUPABASE_ANON_KEY");
+  }
+  const res = await fetch(SB_URL, {
+    headers: { apikey: SUPABASE_ANON, Authorization: `Bearer ${SUPABASE_ANON}` }
+  });
+  if (!res.ok) throw new Error(`HTTP ${res.status}: ${await res.text()}`);
+  const data = await res.json();
+  return Array.isArray(data) ? data : [];
+}
+
 // ---- Helpers to keep flags identical to your leaderboard ----
 const COUNTRY_ALIASES = {
   "uk": "United Kingdom","u.k.":"United Kingdom","gb":"United Kingdom","great britain":"United Kingdom","britain":"United Kingdom",
@@ -75,19 +119,33 @@ function fmtPct(n) {
 export default function CountryAllocation() {
   const [rows, setRows] = useState([]);
   const [err, setErr] = useState("");
+  const [updatedAt, setUpdatedAt] = useState(null);
 
   useEffect(() => {
     (async () => {
-      try {
-        if (!SUPABASE_URL || !SUPABASE_ANON) {
-          throw new Error("Missing REACT_APP_SUPABASE_URL or REACT_APP_SUPABASE_ANON_KEY");
+      if (SNAPSHOT_URL) {
+        const cached = readCachedSnapshot();
+        if (cached) {
+          setRows(cached.rows);
+          setUpdatedAt(cached.generated_at);
         }
-        const res = await fetch(SB_URL, {
-          headers: { apikey: SUPABASE_ANON, Authorization: `Bearer ${SUPABASE_ANON}` }
-        });
-        if (!res.ok) throw new Error(`HTTP ${res.status}: ${await res.text()}`);
-        const data = await res.json();
-        setRows(Array.isArray(data) ? data : []);
+        try {
+          const snap = await fetchSnapshot();
+          if (!cached || snap.etag !== cached.etag) {
+            setRows(snap.rows);
+            try { window.localStorage.setItem(SNAPSHOT_CACHE_KEY, JSON.stringify(snap)); } catch (e) {}
+          }
+          setUpdatedAt(snap.generated_at);
+          setErr("");
+          return;
+        } catch (e) {
+          console.warn("Allocation snapshot unavailable, reading the live view:", e);
+          if (cached) return;
+        }
+      }
+      try {
+        setRows(await fetchLiveView());
+        setUpdatedAt(null);
         setErr("");
       } catch (e) {
         console.error(e);
@@ -117,7 +175,9 @@ export default function CountryAllocation() {
       </h1>
 
       <div style={{ textAlign: "center", marginBottom: 18, color: "#aaa" }}>
-        Towards US$1,000,000 goal • Live stats
+        Towards US$1,000,000 goal • {updatedAt
+          ? `Updated ${new Date(updatedAt).toLocaleString()}`
+          : "Live stats"}
       </div>
 
       <div style={container}>